@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+throughput, latency and memory of requests made with Resource
+"""
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from chub import API, LoopbackTransport
+
+from .server import make_app
+from .utils import measure_sync, measure_async, rss
+
+CSV = '''\
+source_id_types,source_ids,offer_ids,description
+examplecopictureid,100123,1~2~3~4,Sunset over a Caribbean beach'''
+
+
+def sync_get(server, options):
+    """Resource.get with the synchronous client"""
+    offer = API(server.base_url, async=False).repository.offers['1']
+    return measure_sync(offer.get, options.requests)
+
+
+def sync_post(server, options):
+    """Resource.post of JSON data with the synchronous client"""
+    assets = API(server.base_url, async=False).repository.repositories[
+        'repo1'].assets
+    return measure_sync(
+        lambda: assets.post(source_id_types=['examplecopictureid'],
+                            source_ids=['100123'],
+                            description='Sunset over a Caribbean beach'),
+        options.requests)
+
+
+def async_get(server, options):
+    """Resource.get with the asynchronous client"""
+    offer = API(server.base_url).repository.offers['1']
+    return measure_async(offer.get, options.requests, options.concurrency)
+
+
+def async_post(server, options):
+    """Resource.post of JSON data with the asynchronous client"""
+    assets = API(server.base_url).repository.repositories['repo1'].assets
+    return measure_async(
+        lambda: assets.post(source_id_types=['examplecopictureid'],
+                            source_ids=['100123'],
+                            description='Sunset over a Caribbean beach'),
+        options.requests, options.concurrency)
+
+
+def async_get_page(server, options):
+    """Resource.get of a page of assets with the asynchronous client"""
+    assets = API(server.base_url).repository.repositories['repo1'].assets
+    return measure_async(lambda: assets.get(page_size=options.page_size),
+                         options.requests, options.concurrency)
+
+
+def loopback_async_get(server, options):
+    """
+    Resource.get with the asynchronous client and an in-process transport,
+    measuring the client without the network
+    """
+    api = API(server.base_url, transport=LoopbackTransport(app=make_app()))
+    offer = api.repository.offers['1']
+    return measure_async(offer.get, options.requests, options.concurrency)
+
+
+def memory_per_request(server, options):
+    """Resident memory used by each request in flight"""
+    api = API(server.base_url)
+    # allow every request to be in flight instead of queued in the client
+    api.fetch.keywords['httpclient'].max_clients = options.in_flight
+    slow = api.slow
+    io_loop = IOLoop.current()
+    io_loop.run_sync(lambda: slow.get(delay=0))
+
+    @gen.coroutine
+    def run():
+        before = rss()
+        futures = [slow.get(delay=1) for _ in range(options.in_flight)]
+        yield gen.sleep(0.5)
+        during = rss()
+        yield futures
+        raise gen.Return((before, during))
+
+    start = time.time()
+    before, during = io_loop.run_sync(run)
+    result = {'in_flight': options.in_flight,
+              'elapsed': time.time() - start}
+    if before is not None:
+        result['bytes_per_request'] = float(during - before) / \
+            options.in_flight
+    return result
+
+
+BENCHMARKS = [sync_get, sync_post, async_get, async_post, async_get_page,
+              loopback_async_get, memory_per_request]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+per-call overhead of a client generated by chub.codegen compared with
+dynamic Resource attribute dispatch
+"""
+from functools import partial
+
+from chub import API
+from chub.codegen import compile_client
+from chub.handlers import direct_async_fetch
+
+from .fetch import ReadyClient
+from .utils import measure_cpu
+
+URL = 'http://localhost:8000'
+
+# the stand-in's repository endpoints
+SPEC = {
+    'swagger': '2.0',
+    'info': {'title': 'Open Permissions Platform Repository Service'},
+    'basePath': '/v1/repository',
+    'paths': {
+        '/repositories/{repository_id}/assets': {
+            'get': {
+                'operationId': 'getAssets',
+                'parameters': [
+                    {'name': 'repository_id', 'in': 'path',
+                     'type': 'string', 'required': True},
+                    {'name': 'page', 'in': 'query', 'type': 'integer'}]}},
+        '/repositories/{repository_id}/assets/{asset_id}': {
+            'get': {
+                'operationId': 'getAsset',
+                'parameters': [
+                    {'name': 'repository_id', 'in': 'path',
+                     'type': 'string', 'required': True},
+                    {'name': 'asset_id', 'in': 'path', 'type': 'string',
+                     'required': True}]}}}}
+
+
+def _noop(**kwargs):
+    return kwargs
+
+
+def _clients(fetch):
+    api = API(URL)
+    api.fetch = fetch
+    client = compile_client(SPEC)(URL)
+    client.fetch = fetch
+    return api, client
+
+
+def dispatch_dynamic(server, options):
+    """Resource attribute dispatch to the fetch function"""
+    api, _ = _clients(_noop)
+    return measure_cpu(
+        lambda: api.repository.repositories['repo1'].assets['a1'].get(),
+        options.iterations)
+
+
+def dispatch_generated(server, options):
+    """a generated client method building its request"""
+    _, client = _clients(_noop)
+    return measure_cpu(lambda: client.get_asset('repo1', 'a1'),
+                       options.iterations)
+
+
+def fetch_overhead_dynamic(server, options):
+    """Resource attribute dispatch and direct_async_fetch"""
+    fetch = partial(direct_async_fetch, httpclient=ReadyClient())
+    api, _ = _clients(fetch)
+    return measure_cpu(
+        lambda: api.repository.repositories['repo1'].assets.get(
+            page=1).result(),
+        options.iterations)
+
+
+def fetch_overhead_generated(server, options):
+    """a generated client method and direct_async_fetch"""
+    fetch = partial(direct_async_fetch, httpclient=ReadyClient())
+    _, client = _clients(fetch)
+    return measure_cpu(
+        lambda: client.get_assets('repo1', page=1).result(),
+        options.iterations)
+
+
+BENCHMARKS = [dispatch_dynamic, dispatch_generated, fetch_overhead_dynamic,
+              fetch_overhead_generated]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+compare two benchmark result files written by benchmarks.run
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+# metric name, True if a higher value is better
+METRICS = (('throughput', True),
+           ('p50_ms', False),
+           ('p99_ms', False),
+           ('per_call_us', False),
+           ('bytes_per_request', False))
+
+
+def compare(before, after):
+    """
+    compare benchmark results
+    :param before: the results dictionary of the baseline run
+    :param after: the results dictionary of the new run
+    :return: a list of (benchmark, metric, before, after, change) tuples,
+        where change is the relative improvement, e.g. 0.1 is 10% better
+    """
+    rows = []
+    for name in sorted(set(before) & set(after)):
+        for metric, higher_is_better in METRICS:
+            old = before[name].get(metric)
+            new = after[name].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / float(old)
+            if not higher_is_better:
+                change = -change
+            rows.append((name, metric, old, new, change))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print '{:<28} {:<18} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'metric', before['meta']['chub_version'],
+        after['meta']['chub_version'], 'change')
+    for name, metric, old, new, change in compare(before['results'],
+                                                  after['results']):
+        print '{:<28} {:<18} {:>12.2f} {:>12.2f} {:>+7.1f}%'.format(
+            name, metric, old, new, change * 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+latency and bytes on the wire of bulk POSTs and large pages of assets,
+with and without gzip compression
+"""
+import json
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+
+from chub import API, Compression
+
+from .server import StandInServer, make_app, make_asset
+from .utils import measure_async
+
+# the link speed used to estimate the time to transfer the bodies
+LINK_MBIT = 10
+
+
+def _with_gzip_server(benchmark):
+    def run(server, options):
+        gzip_server = StandInServer(app=make_app(compress_response=True),
+                                    decompress_request=True).start()
+        try:
+            return benchmark(gzip_server, options)
+        finally:
+            gzip_server.stop()
+    run.__name__ = benchmark.__name__
+    run.__doc__ = benchmark.__doc__
+    return run
+
+
+def _transfer(result, size):
+    """add the bytes per request and the time to send them"""
+    result['bytes'] = size
+    result['transfer_ms_{}mbit'.format(LINK_MBIT)] = (
+        1000.0 * 8 * size / (LINK_MBIT * 1000000))
+    return result
+
+
+def _post_bulk(server, options, compression):
+    api = API(server.base_url, compression=compression,
+              decompress_response=False)
+    assets = api.repository.repositories['repo1'].assets
+    data = [make_asset('repo1', index) for index in range(options.page_size)]
+    result = measure_async(lambda: assets.post(data=data),
+                           options.requests, options.concurrency)
+    if compression is None:
+        size = len(json.dumps({'data': data}))
+    else:
+        stats = compression.stats()
+        size = stats['bytes_out'] // stats['compressed']
+    return _transfer(result, size)
+
+
+def _get_page(server, options, compression):
+    api = API(server.base_url, compression=compression,
+              decompress_response=False)
+    assets = api.repository.repositories['repo1'].assets
+    result = measure_async(lambda: assets.get(page_size=options.page_size),
+                           options.requests, options.concurrency)
+
+    # the size of a response body as sent by the server
+    client = AsyncHTTPClient(force_instance=True)
+    encoding = 'identity' if compression is None else 'gzip'
+    try:
+        response = IOLoop.current().run_sync(lambda: client.fetch(
+            assets.path + '?page_size={}'.format(options.page_size),
+            decompress_response=False,
+            headers={'Accept-Encoding': encoding}))
+    finally:
+        client.close()
+    return _transfer(result, len(response.body))
+
+
+@_with_gzip_server
+def post_bulk(server, options):
+    """Resource.post of a page of assets, uncompressed"""
+    return _post_bulk(server, options, None)
+
+
+@_with_gzip_server
+def post_bulk_gzip(server, options):
+    """Resource.post of a page of assets, gzipped by Compression"""
+    return _post_bulk(server, options, Compression())
+
+
+@_with_gzip_server
+def get_page(server, options):
+    """Resource.get of a page of assets, uncompressed"""
+    return _get_page(server, options, None)
+
+
+@_with_gzip_server
+def get_page_gzip(server, options):
+    """Resource.get of a page of assets, gzipped by the server"""
+    return _get_page(server, options, Compression())
+
+
+BENCHMARKS = [post_bulk, post_bulk_gzip, get_page, get_page_gzip]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+per-request overhead of the async fetch functions, with a client whose
+responses are ready immediately so that only chub's own work is measured
+"""
+from StringIO import StringIO
+
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPResponse
+
+from chub.handlers import async_fetch, direct_async_fetch
+from chub.oauth2 import RequestToken
+
+from .utils import measure_cpu
+
+URL = 'http://localhost:8000/v1/repository/offers/1'
+BODY = '{"status": 200, "data": {"id": "1"}}'
+
+
+class ReadyClient(object):
+    """An AsyncHTTPClient stand-in returning a resolved Future"""
+    def fetch(self, request, **kwargs):
+        future = Future()
+        future.set_result(HTTPResponse(
+            request, 200, headers={'Content-Type': 'application/json'},
+            buffer=StringIO(BODY)))
+        return future
+
+
+def fetch_overhead_coroutine(server, options):
+    """async_fetch, running a coroutine for each request"""
+    client = ReadyClient()
+    return measure_cpu(
+        lambda: async_fetch(URL, 'GET', httpclient=client).result(),
+        options.iterations)
+
+
+def fetch_overhead_direct(server, options):
+    """direct_async_fetch, chaining the response with a callback"""
+    client = ReadyClient()
+    return measure_cpu(
+        lambda: direct_async_fetch(URL, 'GET', httpclient=client).result(),
+        options.iterations)
+
+
+def token_overhead_cached(server, options):
+    """get_token with a cached token, without a request"""
+    get_token = RequestToken()
+    key = get_token._key(server.base_url, 'client',
+                         get_token._parameters('read', None))
+    get_token._cache[key] = {'access_token': 'token',
+                             'expiry': get_token._now() + 3600}
+    return measure_cpu(
+        lambda: get_token(server.base_url, 'client', 'secret',
+                          scope='read').result(),
+        options.iterations)
+
+
+BENCHMARKS = [fetch_overhead_coroutine, fetch_overhead_direct,
+              token_overhead_cached]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+CPU cost of building requests and parsing responses
+"""
+import json
+from StringIO import StringIO
+
+from tornado.httpclient import HTTPRequest, HTTPResponse
+
+from chub.handlers import make_request, parse_response, DEFAULT_HEADERS
+
+from .server import make_asset
+from .utils import measure_cpu
+
+URL = 'http://localhost:8000/v1/repository/repositories/repo1/assets'
+
+
+def _asset(index):
+    return {u'source_id_types': [u'examplecopictureid'],
+            u'source_ids': [unicode(100000 + index)],
+            u'offers': [u'{:032x}'.format(index % 10)],
+            u'description': u'Sunset over a Caribbean beach'}
+
+
+def make_request_get(server, options):
+    """make_request with query string parameters"""
+    return measure_cpu(
+        lambda: make_request(URL, 'GET', dict(DEFAULT_HEADERS),
+                             page=1, page_size=100),
+        options.iterations)
+
+
+def make_request_post_small(server, options):
+    """make_request with a single JSON object"""
+    return measure_cpu(
+        lambda: make_request(URL, 'POST', dict(DEFAULT_HEADERS),
+                             **_asset(1)),
+        options.iterations)
+
+
+def make_request_post_large(server, options):
+    """make_request with a list of JSON objects"""
+    assets = [_asset(index) for index in range(options.page_size)]
+    return measure_cpu(
+        lambda: make_request(URL, 'POST', dict(DEFAULT_HEADERS),
+                             assets=assets),
+        max(1, options.iterations // 100))
+
+
+def _response(body):
+    request = HTTPRequest(URL)
+    return lambda: HTTPResponse(
+        request, 200, headers={'Content-Type': 'application/json'},
+        buffer=StringIO(body))
+
+
+def parse_response_small(server, options):
+    """parse_response of a single JSON object"""
+    response = _response(json.dumps({'status': 200,
+                                     'data': make_asset('repo1', 1)}))
+    return measure_cpu(lambda: parse_response(response()),
+                       options.iterations)
+
+
+def parse_response_large(server, options):
+    """parse_response of a page of JSON objects"""
+    response = _response(json.dumps({
+        'status': 200,
+        'data': [make_asset('repo1', i) for i in range(options.page_size)]}))
+    return measure_cpu(lambda: parse_response(response()),
+                       max(1, options.iterations // 100))
+
+
+BENCHMARKS = [make_request_get, make_request_post_small,
+              make_request_post_large, parse_response_small,
+              parse_response_large]
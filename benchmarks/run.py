@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+run the benchmarks and write the results as JSON, so that runs against
+different versions of chub can be compared with benchmarks.compare
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --only async_get,parse_response_large
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+
+import chub
+
+from . import client, codegen, compression, fetch, handlers, tls, tokens
+from .server import StandInServer
+
+BENCHMARKS = (client.BENCHMARKS + handlers.BENCHMARKS + fetch.BENCHMARKS +
+              codegen.BENCHMARKS + tokens.BENCHMARKS + tls.BENCHMARKS +
+              compression.BENCHMARKS)
+
+
+class ExternalServer(object):
+    """A stand-in server that is already running"""
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+
+def run(server, options, names=None):
+    """
+    run benchmarks
+    :param server: an object with the base_url of the stand-in server
+    :param options: the benchmark options, e.g. the number of requests
+    :param names: (optional) the names of the benchmarks to run
+    :return: a dictionary of results keyed by benchmark name
+    """
+    results = {}
+    for benchmark in BENCHMARKS:
+        name = benchmark.__name__
+        if names and name not in names:
+            continue
+        logging.info('Running %s', name)
+        result = benchmark(server, options)
+        result['description'] = benchmark.__doc__
+        results[name] = result
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--server',
+                        help='URL of a running stand-in server, by default '
+                             'one is started in a background thread')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=10000,
+                        help='calls for CPU benchmarks')
+    parser.add_argument('--in-flight', type=int, default=500,
+                        help='requests held in flight to measure memory')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--only', help='comma separated benchmark names')
+    parser.add_argument('--output', help='file to write the results to')
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('tornado').setLevel(logging.WARNING)
+
+    names = set(options.only.split(',')) if options.only else None
+    unknown = (names or set()) - {b.__name__ for b in BENCHMARKS}
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(
+            ', '.join(sorted(unknown))))
+
+    if options.server:
+        server = ExternalServer(options.server)
+    else:
+        server = StandInServer().start()
+    try:
+        results = run(server, options, names)
+    finally:
+        if not options.server:
+            server.stop()
+
+    output = {'meta': {'chub_version': chub.__version__,
+                       'python_version': platform.python_version(),
+                       'platform': platform.platform(),
+                       'timestamp': time.time(),
+                       'options': vars(options)},
+              'results': results}
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+a local stand-in for the Open Permissions Platform services, mimicking the
+accounts, auth, onboarding and repository endpoints used by chub
+
+Run it on its own with:
+    python -m benchmarks.server --port 8000
+"""
+import argparse
+import base64
+import calendar
+import json
+import threading
+import uuid
+from datetime import datetime
+
+from tornado import gen
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.web import Application, RequestHandler, HTTPError
+
+TOKEN_LIFETIME = 3600
+
+
+def _now():
+    return calendar.timegm(datetime.utcnow().timetuple())
+
+
+def make_asset(repository_id, index):
+    return {'id': '{:032x}'.format(index),
+            'repository_id': repository_id,
+            'source_id_types': ['examplecopictureid'],
+            'source_ids': [str(100000 + index)],
+            'offers': ['{:032x}'.format(index % 10)],
+            'description': 'Sunset over a Caribbean beach'}
+
+
+class BaseHandler(RequestHandler):
+    def write_data(self, data, status=200):
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.finish(json.dumps({'status': status, 'data': data}))
+
+    def json_body(self):
+        try:
+            return json.loads(self.request.body or '{}')
+        except ValueError:
+            raise HTTPError(400)
+
+
+class ServiceHandler(BaseHandler):
+    def get(self, service):
+        self.write_data({'service_name': 'Open Permissions Platform {} '
+                                         'Service'.format(service.title()),
+                         'version': '0.1.0'})
+
+
+class LoginHandler(BaseHandler):
+    def post(self):
+        body = self.json_body()
+        if 'email' not in body or 'password' not in body:
+            raise HTTPError(400)
+        self.write_data({'token': uuid.uuid4().hex,
+                         'user': {'email': body['email'],
+                                  'id': uuid.uuid4().hex}})
+
+
+class ServicesHandler(BaseHandler):
+    def post(self):
+        body = self.json_body()
+        self.write_data(dict(body, id=uuid.uuid4().hex), status=201)
+
+
+class TokenHandler(RequestHandler):
+    """OAuth token endpoint for the client credentials grant"""
+    def post(self):
+        auth = self.request.headers.get('Authorization', '')
+        if not auth.startswith('Basic '):
+            raise HTTPError(401)
+        client_id = base64.b64decode(auth[len('Basic '):]).split(':')[0]
+        self.settings['tokens_issued'][0] += 1
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({
+            'status': 200,
+            'access_token': '{}.{}'.format(client_id, uuid.uuid4().hex),
+            'token_type': 'bearer',
+            'expiry': _now() + TOKEN_LIFETIME}))
+
+
+class CapabilitiesHandler(BaseHandler):
+    def get(self):
+        self.write_data({'max_file_size': 2097152,
+                         'separators': [','],
+                         'content_types': ['text/csv']})
+
+
+class OnboardingAssetsHandler(BaseHandler):
+    def post(self, repository_id):
+        lines = self.request.body.strip().splitlines()
+        self.write_data({'repository_id': repository_id,
+                         'rows': max(0, len(lines) - 1)})
+
+
+class OfferHandler(BaseHandler):
+    def get(self, offer_id):
+        self.write_data({'id': offer_id,
+                         'type': 'offer',
+                         'title': 'Standard Print License',
+                         'policy': [{'type': 'permission',
+                                     'action': 'display'}]})
+
+
+class RepositoryAssetsHandler(BaseHandler):
+    def get(self, repository_id):
+        page = int(self.get_argument('page', 1))
+        page_size = int(self.get_argument('page_size',
+                                          self.settings['page_size']))
+        start = (page - 1) * page_size
+        self.write_data([make_asset(repository_id, index)
+                         for index in range(start, start + page_size)])
+
+    def post(self, repository_id):
+        body = self.json_body()
+        self.write_data(dict(body, id=uuid.uuid4().hex,
+                             repository_id=repository_id), status=201)
+
+
+class AssetHandler(BaseHandler):
+    def get(self, repository_id, asset_id):
+        self.write_data(make_asset(repository_id, int(asset_id, 16)))
+
+
+class SlowHandler(BaseHandler):
+    """Respond after a delay, e.g. to hold requests in flight"""
+    @gen.coroutine
+    def get(self):
+        yield gen.sleep(float(self.get_argument('delay', 0.1)))
+        self.write_data({})
+
+
+def make_app(page_size=100, compress_response=False):
+    """
+    create the stand-in application
+    :param page_size: the default number of assets in a page of assets
+    :param compress_response: gzip responses to clients accepting it
+    """
+    return Application([
+        (r'/v1/(accounts|auth|onboarding|repository)/?', ServiceHandler),
+        (r'/v1/accounts/login', LoginHandler),
+        (r'/v1/accounts/services', ServicesHandler),
+        (r'/v1/auth/token', TokenHandler),
+        (r'/v1/onboarding/capabilities', CapabilitiesHandler),
+        (r'/v1/onboarding/repositories/([^/]+)/assets',
+         OnboardingAssetsHandler),
+        (r'/v1/repository/offers/([^/]+)', OfferHandler),
+        (r'/v1/repository/repositories/([^/]+)/assets',
+         RepositoryAssetsHandler),
+        (r'/v1/repository/repositories/([^/]+)/assets/([0-9a-f]+)',
+         AssetHandler),
+        (r'/v1/slow', SlowHandler),
+    ], page_size=page_size, tokens_issued=[0],
+        compress_response=compress_response)
+
+
+class StandInServer(object):
+    """
+    Run the stand-in application in a background thread with its own
+    IOLoop, so it can serve both sync and async clients.
+
+    Example Usage:
+        >>> server = StandInServer()
+        >>> server.start()
+        >>> api = API(server.base_url, async=False)
+        >>> api.repository.offers['1'].get()
+        >>> server.stop()
+    """
+    def __init__(self, app=None, host='127.0.0.1', port=0, ssl_options=None,
+                 decompress_request=False):
+        """
+        :param app: (optional) the application, by default make_app()
+        :param host: the interface to listen on
+        :param port: the port, a free port is chosen by default
+        :param ssl_options: (optional) ssl options for an HTTPS server
+        :param decompress_request: accept gzipped request bodies
+        """
+        self.app = app or make_app()
+        self.host = host
+        self.port = port
+        self.ssl_options = ssl_options
+        self.decompress_request = decompress_request
+        self.io_loop = None
+        self._thread = None
+        self._started = threading.Event()
+
+    @property
+    def base_url(self):
+        scheme = 'https' if self.ssl_options else 'http'
+        return '{}://{}:{}/'.format(scheme, self.host, self.port)
+
+    def _run(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        sockets = bind_sockets(self.port, self.host)
+        self.port = sockets[0].getsockname()[1]
+        server = HTTPServer(self.app, ssl_options=self.ssl_options,
+                            decompress_request=self.decompress_request)
+        server.add_sockets(sockets)
+        self.io_loop.add_callback(self._started.set)
+        self.io_loop.start()
+        server.stop()
+        self.io_loop.close(all_fds=True)
+
+    def start(self):
+        """Start the server and wait until it is listening"""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        """Stop the server"""
+        self.io_loop.add_callback(self.io_loop.stop)
+        self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    make_app(args.page_size).listen(args.port, args.host)
+    print 'Stand-in server listening on http://{}:{}/'.format(args.host,
+                                                               args.port)
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+latency of the first request to a TLS service with and without warm
+pooled connections, and of steady requests with and without a pool
+"""
+import os
+import subprocess
+import tempfile
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from chub import API, ConnectionPool
+
+from .server import StandInServer
+from .utils import measure_async, summarise
+
+
+def _ssl_options():
+    """create a self-signed certificate for the stand-in server"""
+    directory = tempfile.mkdtemp(prefix='chub-benchmarks-')
+    certfile = os.path.join(directory, 'localhost.crt')
+    keyfile = os.path.join(directory, 'localhost.key')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-days', '1', '-subj', '/CN=localhost', '-keyout', keyfile,
+             '-out', certfile], stdout=devnull, stderr=devnull)
+    return {'certfile': certfile, 'keyfile': keyfile}
+
+
+def _measure_first_request(server, samples, warm):
+    io_loop = IOLoop.current()
+    latencies = []
+
+    @gen.coroutine
+    def run():
+        for _ in range(samples):
+            pool = ConnectionPool(io_loop=io_loop)
+            api = API(server.base_url, connection_pool=pool,
+                      validate_cert=False)
+            offer = api.repository.offers['1']
+            if warm:
+                yield api.warmup(connections=1)
+            start = io_loop.time()
+            yield offer.get()
+            latencies.append(io_loop.time() - start)
+            pool.close()
+            api.fetch.keywords['httpclient'].close()
+
+    start = time.time()
+    io_loop.run_sync(run)
+    return summarise(latencies, time.time() - start)
+
+
+def _with_tls_server(benchmark):
+    def run(server, options):
+        tls_server = StandInServer(ssl_options=_ssl_options()).start()
+        try:
+            return benchmark(tls_server, options)
+        finally:
+            tls_server.stop()
+    run.__name__ = benchmark.__name__
+    run.__doc__ = benchmark.__doc__
+    return run
+
+
+@_with_tls_server
+def tls_cold_start(server, options):
+    """the first request of a new client, including the TLS handshake"""
+    return _measure_first_request(server, max(1, options.requests // 10),
+                                  warm=False)
+
+
+@_with_tls_server
+def tls_warm_start(server, options):
+    """the first request of a new client after API.warmup"""
+    return _measure_first_request(server, max(1, options.requests // 10),
+                                  warm=True)
+
+
+@_with_tls_server
+def tls_async_get(server, options):
+    """Resource.get over TLS, with a connection for each request"""
+    api = API(server.base_url, validate_cert=False)
+    offer = api.repository.offers['1']
+    return measure_async(offer.get, options.requests, options.concurrency)
+
+
+@_with_tls_server
+def tls_async_get_pooled(server, options):
+    """Resource.get over TLS, reusing connections from a ConnectionPool"""
+    pool = ConnectionPool(max_idle=options.concurrency)
+    api = API(server.base_url, connection_pool=pool, validate_cert=False)
+    offer = api.repository.offers['1']
+    try:
+        return measure_async(offer.get, options.requests,
+                             options.concurrency)
+    finally:
+        pool.close()
+
+
+BENCHMARKS = [tls_cold_start, tls_warm_start, tls_async_get,
+              tls_async_get_pooled]
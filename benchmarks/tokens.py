@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+get_token with and without a cached token, and get_token.sync called from
+several threads
+"""
+from tornado.ioloop import IOLoop
+
+from chub.oauth2 import RequestToken
+
+from .utils import measure_async, measure_threads
+
+
+def token_cache_hit(server, options):
+    """get_token when the token is cached"""
+    get_token = RequestToken()
+    fetch = lambda: get_token(server.base_url, 'client', 'secret',
+                              scope='read')
+    measure_async(fetch, 1, 1)
+    return measure_async(fetch, options.requests, 1)
+
+
+def token_cache_miss(server, options):
+    """get_token requesting a new token from the auth service"""
+    get_token = RequestToken()
+    return measure_async(
+        lambda: get_token(server.base_url, 'client', 'secret',
+                          scope='read', cache=False),
+        options.requests, 1)
+
+
+def token_sync_threads(server, options):
+    """get_token.sync from several threads sharing a cached token"""
+    get_token = RequestToken()
+    app = getattr(server, 'app', None)
+    issued = app.settings['tokens_issued'][0] if app else None
+    result = measure_threads(
+        lambda: get_token.sync(server.base_url, 'client', 'secret',
+                               scope='read'),
+        options.requests * 10, options.concurrency)
+    if app:
+        result['token_requests'] = app.settings['tokens_issued'][0] - issued
+    return result
+
+
+def token_sync_threads_miss(server, options):
+    """get_token.sync from several threads, requesting new tokens"""
+    get_token = RequestToken()
+    return measure_threads(
+        lambda: get_token.sync(server.base_url, 'client', 'secret',
+                               scope='read', cache=False),
+        options.requests, options.concurrency)
+
+
+def token_run_sync_threads_miss(server, options):
+    """
+    get_token run with an IOLoop for each call from several threads,
+    requesting new tokens
+    """
+    get_token = RequestToken()
+    return measure_threads(
+        lambda: IOLoop().run_sync(
+            lambda: get_token(server.base_url, 'client', 'secret',
+                              scope='read', cache=False)),
+        options.requests, options.concurrency)
+
+
+BENCHMARKS = [token_cache_hit, token_cache_miss, token_sync_threads,
+              token_sync_threads_miss, token_run_sync_threads_miss]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+helpers for measuring throughput, latency and memory
+"""
+import os
+import threading
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from chub.stats import percentile
+
+PERCENTILES = (50, 90, 99)
+
+
+def summarise(latencies, elapsed):
+    """
+    summarise request latencies
+    :param latencies: a list of latencies in seconds
+    :param elapsed: the wall clock time taken to make the requests
+    :return: a dictionary with the throughput and latency percentiles in
+        milliseconds
+    """
+    summary = {'requests': len(latencies),
+               'elapsed': elapsed,
+               'throughput': len(latencies) / elapsed if elapsed else None,
+               'mean_ms': 1000 * sum(latencies) / len(latencies)
+               if latencies else None}
+    for pct in PERCENTILES:
+        value = percentile(latencies, pct)
+        summary['p{}_ms'.format(pct)] = (1000 * value
+                                         if value is not None else None)
+    return summary
+
+
+def measure_sync(func, requests):
+    """
+    call a function repeatedly and summarise the latencies
+    :param func: the function to call
+    :param requests: the number of calls
+    """
+    latencies = []
+    start = time.time()
+    for _ in range(requests):
+        call_start = time.time()
+        func()
+        latencies.append(time.time() - call_start)
+    return summarise(latencies, time.time() - start)
+
+
+def measure_async(func, requests, concurrency, io_loop=None):
+    """
+    call a coroutine function with a number of calls in flight at once and
+    summarise the latencies
+    :param func: the coroutine function to call
+    :param requests: the number of calls
+    :param concurrency: the number of calls in flight
+    :param io_loop: (optional) the IOLoop to run on
+    """
+    io_loop = io_loop or IOLoop.current()
+    latencies = []
+    remaining = [requests]
+
+    @gen.coroutine
+    def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            call_start = io_loop.time()
+            yield func()
+            latencies.append(io_loop.time() - call_start)
+
+    @gen.coroutine
+    def run():
+        yield [worker() for _ in range(concurrency)]
+
+    start = time.time()
+    io_loop.run_sync(run)
+    summary = summarise(latencies, time.time() - start)
+    summary['concurrency'] = concurrency
+    return summary
+
+
+def measure_threads(func, requests, threads):
+    """
+    call a function from several threads at once and summarise the
+    latencies
+    :param func: the function to call
+    :param requests: the number of calls
+    :param threads: the number of threads
+    """
+    latencies = []
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            call_start = time.time()
+            func()
+            latency = time.time() - call_start
+            with lock:
+                latencies.append(latency)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    summary = summarise(latencies, time.time() - start)
+    summary['threads'] = threads
+    return summary
+
+
+def measure_cpu(func, iterations):
+    """
+    measure the CPU time of a function
+    :param func: the function to call
+    :param iterations: the number of calls
+    :return: a dictionary with the mean time per call in microseconds
+    """
+    start = time.clock()
+    for _ in range(iterations):
+        func()
+    elapsed = time.clock() - start
+    return {'iterations': iterations,
+            'per_call_us': 1000000 * elapsed / iterations}
+
+
+def rss():
+    """
+    get the resident set size of the process in bytes, or None if it is
+    not available (Linux only)
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
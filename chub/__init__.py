@@ -9,7 +9,26 @@
 # 
 
 from .api import API, Resource
-from .handlers import sync_fetch, async_fetch
+from .handlers import sync_fetch, async_fetch, direct_async_fetch
+from .retry import RetryPolicy, RetryBudget
+from .breaker import CircuitBreaker, CircuitOpenError
+from .hedging import HedgePolicy
+from .ratelimit import RateLimiter
+from .priority import PriorityScheduler, Lane
+from .metrics import Metrics
+from .tracing import Tracer, SpanContext, Exporter, InMemoryExporter
+from .transport import Transport, LoopbackTransport
+from .capture import Recorder
+from .lag import LagMonitor
+from .resolver import CachingResolver, ThreadResolver
+from .pool import ConnectionPool, KeepAliveHTTPClient
+from .balancer import LoadBalancer
+from .deadline import Deadline, DeadlineExceeded, current_deadline
+from .timeouts import AdaptiveTimeout
+from .concurrency import ConcurrencyLimiter
+from .compression import Compression
+from .loader import Loader
+from .writer import Writer
 from . import oauth2
 
 __version__ = '1.0.6'
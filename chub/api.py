@@ -17,9 +17,13 @@ from functools import partial
 from urlparse import urljoin
 from urllib import quote_plus
 
+from tornado.gen import coroutine, Return
 from tornado.httpclient import HTTPRequest
 
+from .balancer import LoadBalancer
 from .handlers import make_fetch_func, DEFAULT_HEADERS
+from .loader import Loader
+from .writer import Writer
 
 
 HTTP_METHODS = ['GET', 'POST', 'HEAD', 'PUT', 'PATCH', 'DELETE',
@@ -34,8 +38,11 @@ class Resource(object):
     """
 
     def __init__(self, path, fetch, resource_map=None,
-                 request_class=HTTPRequest, default_headers=None):
+                 request_class=HTTPRequest, default_headers=None,
+                 priority=None, template=None):
         self.path = path
+        # the path with entity ids replaced by "{id}", e.g. "offers/{id}"
+        self.template = path if template is None else template
         self.fetch = fetch
         if resource_map is None:
             self.resource_map = {}
@@ -46,6 +53,8 @@ class Resource(object):
         if not default_headers:
             default_headers = dict(DEFAULT_HEADERS)
         self.default_headers = default_headers
+        # the PriorityScheduler lane for requests, inherited by sub resources
+        self.priority = priority
 
     def __getattr__(self, key):
         if key.upper() in HTTP_METHODS:
@@ -53,24 +62,30 @@ class Resource(object):
             # an HTTPRequest object will be used directly
             # a url will be converted into one by tornado
             request = self.http_request if self.http_request else self.path
-            return partial(self.fetch, request=request, method=key.upper(),
-                           default_headers=self.default_headers)
+            fetch = partial(self.fetch, request=request, method=key.upper(),
+                            default_headers=self.default_headers,
+                            chub_resource_template=self.template)
+            if self.priority is not None:
+                fetch = partial(fetch, chub_priority=self.priority)
+            return fetch
         path = '/'.join((self.path, key))
-        return self._sub_resource(path)
+        return self._sub_resource(path, key)
 
-    def _sub_resource(self, path):
+    def _sub_resource(self, path, name):
         """
         get or create sub resource
         """
         if path not in self.resource_map:
+            template = '/'.join(filter(None, (self.template, name)))
             self.resource_map[path] = Resource(
                 path, self.fetch, self.resource_map,
-                default_headers=self.default_headers)
+                default_headers=self.default_headers,
+                priority=self.priority, template=template)
         return self.resource_map[path]
 
     def __getitem__(self, entity_id):
         path = '/'.join((self.path, quote_plus(entity_id)))
-        return self._sub_resource(path)
+        return self._sub_resource(path, '{id}')
 
     def prepare_request(self, *args, **kw):
         """
@@ -78,23 +93,147 @@ class Resource(object):
         """
         self.http_request = self.request_class(self.path, *args, **kw)
 
+    def loader(self, **kwargs):
+        """
+        create a Loader batching lookups of items in this collection, e.g.
+        a loader for each incoming request. Only supported if async
+        :param kwargs: Loader options, e.g. batch and window
+        """
+        return Loader(self, **kwargs)
+
+    def writer(self, **kwargs):
+        """
+        create a Writer buffering records and POSTing them to this resource
+        in batches. Only supported if async
+        :param kwargs: Writer options, e.g. batch_size and flush_interval
+        """
+        return Writer(self, **kwargs)
+
 
 class API(Resource):
     """
     API takes the base_url and a boolean async . Based on value of async
     an async or sync fetch function is set
+
+    Pass a RetryPolicy as retry_policy to retry transient failures and a
+    CircuitBreaker as circuit_breaker to fail fast when a service is down.
+    Pass a RateLimiter as rate_limiter to limit the rate of requests,
+    Metrics as metrics to record request timings, a Tracer as tracer to
+    trace requests and an AdaptiveTimeout as adaptive_timeout to set
+    timeouts from the observed latency of each resource. Pass a Transport
+    as transport to send requests without opening connections, e.g. a
+    LoopbackTransport for profiling and tests, a Recorder as recorder to
+    capture traffic for chub.replay and a Compression as compression to
+    gzip large request bodies.
+    An async API also accepts a HedgePolicy as hedge_policy to hedge slow
+    requests, a PriorityScheduler as priority_scheduler to schedule
+    requests by priority, a LagMonitor as lag_monitor to find what
+    blocks the IOLoop, a CachingResolver as resolver to cache DNS
+    lookups without blocking the IOLoop, a ConnectionPool as
+    connection_pool to keep connections open between requests and a
+    ConcurrencyLimiter as concurrency_limiter to adapt the number of
+    requests in flight to each host to its latency.
+
+    An auth provider such as an oauth2.ClientCredentials may be passed as
+    auth_provider to add a bearer token to each request, instead of
+    setting token.
+
+    base_url may be a list of the base URLs of several endpoints of the
+    service, e.g. regional replicas. Requests are spread across them, and
+    fail over, with a LoadBalancer, which may be passed as load_balancer
+    to configure it
     """
 
     mappings = {}
 
     def __init__(self, base_url, async=True, api_version=API_VERSION,
-                 token=None, **kwargs):
+                 token=None, retry_policy=None, circuit_breaker=None,
+                 hedge_policy=None, rate_limiter=None,
+                 priority_scheduler=None, metrics=None, tracer=None,
+                 transport=None, recorder=None, lag_monitor=None,
+                 resolver=None, connection_pool=None, load_balancer=None,
+                 adaptive_timeout=None, concurrency_limiter=None,
+                 compression=None, auth_provider=None, **kwargs):
+        if isinstance(base_url, (list, tuple)) or load_balancer is not None:
+            if isinstance(base_url, basestring):
+                base_url = [base_url]
+            if load_balancer is None:
+                load_balancer = LoadBalancer()
+            load_balancer.set_endpoints([urljoin(url, api_version)
+                                         for url in base_url])
+            base_url = base_url[0]
         self.base_url = urljoin(base_url, api_version)
-        fetch = make_fetch_func(self.base_url, async, **kwargs)
-        super(API, self).__init__(self.base_url, fetch)
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.hedge_policy = hedge_policy
+        self.rate_limiter = rate_limiter
+        self.priority_scheduler = priority_scheduler
+        self.metrics = metrics
+        self.tracer = tracer
+        self.transport = transport
+        self.recorder = recorder
+        self.lag_monitor = lag_monitor
+        self.resolver = resolver
+        self.connection_pool = connection_pool
+        self.load_balancer = load_balancer
+        self.adaptive_timeout = adaptive_timeout
+        self.concurrency_limiter = concurrency_limiter
+        self.compression = compression
+        self.auth_provider = auth_provider
+        fetch = make_fetch_func(self.base_url, async,
+                                retry_policy=retry_policy,
+                                circuit_breaker=circuit_breaker,
+                                hedge_policy=hedge_policy,
+                                rate_limiter=rate_limiter,
+                                priority_scheduler=priority_scheduler,
+                                metrics=metrics, tracer=tracer,
+                                transport=transport, recorder=recorder,
+                                lag_monitor=lag_monitor, resolver=resolver,
+                                connection_pool=connection_pool,
+                                load_balancer=load_balancer,
+                                adaptive_timeout=adaptive_timeout,
+                                concurrency_limiter=concurrency_limiter,
+                                compression=compression,
+                                auth_provider=auth_provider, **kwargs)
+        super(API, self).__init__(self.base_url, fetch, template='')
         if token:
             self.token = token
 
+    @coroutine
+    def warmup(self, connections=1):
+        """
+        open connections to the service before they are needed, e.g. after
+        a deploy, so the first requests don't wait for TCP and TLS
+        handshakes. Only supported with a connection_pool
+
+        Example Usage:
+            >>> api = API('https://localhost:8004',
+                          connection_pool=ConnectionPool())
+            >>> yield api.warmup(connections=5)
+
+        :param connections: the number of connections to open to each
+            endpoint, up to the client's max_clients (10 by default)
+        :return: a Future resolving to the number of warm-up requests
+            answered by the service
+        """
+        if self.connection_pool is None:
+            raise ValueError('warmup requires a connection_pool')
+        client = self.fetch.keywords['httpclient']
+        base_urls = [self.base_url]
+        if self.load_balancer is not None:
+            base_urls = self.load_balancer.base_urls
+        # any response will do, the request is only made to open the
+        # connection
+        responses = yield [client.fetch(HTTPRequest(base_url, 'HEAD'),
+                                        raise_error=False)
+                           for base_url in base_urls
+                           for _ in range(connections)]
+        errors = [response.error for response in responses
+                  if response.code == 599]
+        if errors and len(errors) == len(responses):
+            raise errors[0]
+        raise Return(len(responses) - len(errors))
+
     @property
     def token(self):
         """
@@ -154,7 +293,7 @@ class Accounts(API):
         :param password: password
         """
         rsp = self._request()
-        self.default_headers['Authorization'] = rsp.data['token']
+        self.token = rsp.data['token']
         return rsp
 
     def register_service(self, name, location, organisation_id, certificate):
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a load balancer spreading requests across the endpoints of
+a service
+"""
+import copy
+import logging
+import time
+
+from tornado.gen import coroutine, Return
+from tornado.httputil import HTTPHeaders
+
+from .breaker import CircuitBreaker, CircuitOpenError
+
+LEAST_OUTSTANDING = 'least_outstanding'
+EWMA = 'ewma'
+
+
+class Endpoint(object):
+    """
+    The load and health of one endpoint
+    """
+    def __init__(self, base_url):
+        """
+        :param base_url: the base URL of the endpoint, including the API
+            version, e.g. "https://eu.example.com/v1"
+        """
+        self.base_url = base_url
+        self.outstanding = 0
+        self.ewma = None
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = None
+
+    def ejected(self, now):
+        return self.ejected_until is not None and self.ejected_until > now
+
+    def stats(self, now):
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'outstanding': self.outstanding,
+                'ewma_ms': 1000 * self.ewma if self.ewma is not None
+                else None,
+                'ejected': self.ejected(now),
+                'ejections': self.ejections}
+
+
+class LoadBalancer(object):
+    """
+    Spread requests across several endpoints of a service, e.g. regional
+    replicas, and fail over to another endpoint when one fails.
+
+    Requests go to the endpoint with the fewest requests in flight
+    ("least_outstanding"), or with the lowest latency weighted by the
+    requests in flight ("ewma"), where latency is an exponentially weighted
+    moving average. An endpoint failing failure_threshold requests in a
+    row is ejected for ejection_time seconds, doubling for each ejection in
+    a row up to max_ejection_time. When the time is up it is tried again,
+    and readmitted if the request succeeds. If every endpoint is ejected
+    the one readmitted soonest is used.
+
+    Requests with idempotent methods which fail with a connection error, a
+    5xx response or an open circuit are sent to another endpoint, up to
+    max_failovers times. A CircuitBreaker or RateLimiter passed to the API
+    is applied to each endpoint separately.
+
+    The API creates a LoadBalancer when it is given a list of base URLs,
+    or pass one to configure it:
+        >>> api = API(['https://eu.example.com', 'https://us.example.com'],
+                      load_balancer=LoadBalancer(strategy='ewma'))
+        >>> api.load_balancer.stats()['endpoints']['https://eu.example.com/v1']
+        {'requests': 120, 'errors': 0, 'outstanding': 2, 'ewma_ms': 12.1,
+         'ejected': False, 'ejections': 0}
+
+    A load balancer belongs to one API.
+    """
+    def __init__(self, strategy=LEAST_OUTSTANDING, alpha=0.3,
+                 failure_threshold=3, ejection_time=10,
+                 max_ejection_time=300, max_failovers=1,
+                 methods=('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')):
+        """
+        :param strategy: "least_outstanding" or "ewma"
+        :param alpha: the weight of the latest latency in the moving average
+        :param failure_threshold: the number of failures in a row which
+            eject an endpoint
+        :param ejection_time: the number of seconds an endpoint is ejected
+            for the first time
+        :param max_ejection_time: the maximum number of seconds an endpoint
+            is ejected for
+        :param max_failovers: the number of other endpoints to try when a
+            request fails
+        :param methods: the idempotent HTTP methods which can fail over
+        """
+        if strategy not in (LEAST_OUTSTANDING, EWMA):
+            raise ValueError('Unknown strategy {}'.format(strategy))
+        self.strategy = strategy
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.max_failovers = max_failovers
+        self.methods = frozenset(m.upper() for m in methods)
+        self.endpoints = []
+        self.failovers = 0
+        self._next = 0
+
+    _now = staticmethod(time.time)
+
+    @property
+    def base_urls(self):
+        return [endpoint.base_url for endpoint in self.endpoints]
+
+    def set_endpoints(self, base_urls):
+        """
+        set the endpoints requests are spread across. Requests are made to
+        the first one, and sent to the chosen endpoint instead
+        :param base_urls: the base URLs, including the API version
+        """
+        self.endpoints = [Endpoint(base_url) for base_url in base_urls]
+
+    def _score(self, endpoint):
+        if self.strategy == EWMA:
+            # endpoints without a latency yet are tried first
+            return (endpoint.ewma or 0) * (endpoint.outstanding + 1)
+        return endpoint.outstanding
+
+    def choose(self, exclude=()):
+        """
+        choose the endpoint for a request
+        :param exclude: endpoints already tried
+        :return: an Endpoint, or None if there isn't another one to try
+        """
+        now = self._now()
+        candidates = [endpoint for endpoint in self.endpoints
+                      if endpoint not in exclude]
+        if not candidates:
+            return None
+        healthy = [endpoint for endpoint in candidates
+                   if not endpoint.ejected(now)]
+        if not healthy:
+            if exclude:
+                return None
+            return min(candidates, key=lambda e: e.ejected_until)
+
+        # rotate the candidates so that ties are spread round robin
+        self._next = (self._next + 1) % len(healthy)
+        healthy = healthy[self._next:] + healthy[:self._next]
+        return min(healthy, key=self._score)
+
+    def _start(self, endpoint):
+        endpoint.requests += 1
+        endpoint.outstanding += 1
+        return self._now()
+
+    def _done(self, endpoint, start, error):
+        """
+        record the outcome of a request to an endpoint
+        :return: whether the error is a failure of the endpoint
+        """
+        endpoint.outstanding -= 1
+        failed = error is not None and (
+            isinstance(error, CircuitOpenError) or
+            CircuitBreaker.is_failure(error))
+        if error is not None:
+            endpoint.errors += 1
+        if not failed:
+            latency = self._now() - start
+            if endpoint.ewma is None:
+                endpoint.ewma = latency
+            else:
+                endpoint.ewma += self.alpha * (latency - endpoint.ewma)
+            endpoint.failures = 0
+            endpoint.ejections = 0
+            endpoint.ejected_until = None
+            return False
+
+        endpoint.failures += 1
+        if endpoint.failures >= self.failure_threshold and \
+                not endpoint.ejected(self._now()):
+            duration = min(self.ejection_time * 2 ** endpoint.ejections,
+                           self.max_ejection_time)
+            endpoint.ejections += 1
+            endpoint.ejected_until = self._now() + duration
+            logging.warning('Ejecting %s for %ds after %d failures: %s',
+                            endpoint.base_url, duration, endpoint.failures,
+                            error)
+        return True
+
+    def _request(self, request, endpoint):
+        """copy the request, sending it to the endpoint"""
+        primary = self.endpoints[0].base_url
+        request = copy.copy(request)
+        request.headers = HTTPHeaders(request.headers)
+        if request.url.startswith(primary):
+            request.url = endpoint.base_url + request.url[len(primary):]
+        return request
+
+    def _fail_over(self, request, tried):
+        if request.method.upper() not in self.methods or \
+                len(tried) > self.max_failovers:
+            return None
+        endpoint = self.choose(exclude=tried)
+        if endpoint is not None:
+            self.failovers += 1
+            logging.info('Failing over %s request from %s to %s',
+                         request.method, tried[-1].base_url,
+                         endpoint.base_url)
+        return endpoint
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function with the chosen endpoint
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        tried = []
+        endpoint = self.choose()
+        while True:
+            tried.append(endpoint)
+            start = self._start(endpoint)
+            try:
+                response = fetch(self._request(request, endpoint), **kwargs)
+            except Exception as exc:
+                failed = self._done(endpoint, start, exc)
+                endpoint = failed and self._fail_over(request, tried)
+                if not endpoint:
+                    raise
+            else:
+                self._done(endpoint, start, None)
+                return response
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function with the chosen endpoint
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        tried = []
+        endpoint = self.choose()
+        while True:
+            tried.append(endpoint)
+            start = self._start(endpoint)
+            try:
+                response = yield fetch(self._request(request, endpoint),
+                                       **kwargs)
+            except Exception as exc:
+                failed = self._done(endpoint, start, exc)
+                endpoint = failed and self._fail_over(request, tried)
+                if not endpoint:
+                    raise
+            else:
+                self._done(endpoint, start, None)
+                raise Return(response)
+
+    def stats(self):
+        """
+        get the number of failovers and the stats of each endpoint
+        """
+        now = self._now()
+        return {'failovers': self.failovers,
+                'endpoints': {endpoint.base_url: endpoint.stats(now)
+                              for endpoint in self.endpoints}}
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a circuit breaker to fail fast when a service is unhealthy
+"""
+import logging
+import time
+from collections import deque
+from urlparse import urlparse
+
+from tornado.gen import coroutine, Return
+from tornado.httpclient import HTTPError
+
+from .metrics import resource_path
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request while a circuit is open"""
+    def __init__(self, key, retry_after):
+        """
+        :param key: the circuit key, e.g. the host
+        :param retry_after: seconds until the circuit will be half-open
+        """
+        super(CircuitOpenError, self).__init__(
+            'Circuit for {} is open, retry in {:.1f}s'.format(
+                key, retry_after))
+        self.key = key
+        self.retry_after = retry_after
+
+
+class Circuit(object):
+    """
+    The state of the circuit for a single host or resource
+    """
+    def __init__(self, key, breaker):
+        """
+        :param key: the circuit key
+        :param breaker: the CircuitBreaker with the circuit configuration
+        """
+        self.key = key
+        self.breaker = breaker
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = deque(maxlen=breaker.window)
+        self._probes = 0
+        self._probe_successes = 0
+
+    def _transition(self, state):
+        old_state, self.state = self.state, state
+        if state == OPEN:
+            self.opened_at = self.breaker._now()
+        else:
+            self.opened_at = None
+        if state != HALF_OPEN:
+            self._outcomes.clear()
+        self._probes = 0
+        self._probe_successes = 0
+        self.breaker._emit(self.key, old_state, state)
+
+    def before_call(self):
+        """
+        check whether a request may be made
+        :raises: CircuitOpenError if the circuit is open, or half-open and
+            already probing
+        """
+        if self.state == OPEN:
+            elapsed = self.breaker._now() - self.opened_at
+            if elapsed < self.breaker.reset_timeout:
+                raise CircuitOpenError(self.key,
+                                       self.breaker.reset_timeout - elapsed)
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes >= self.breaker.half_open_calls:
+                raise CircuitOpenError(self.key, 0)
+            self._probes += 1
+
+    def record(self, failed, duration):
+        """
+        record the outcome of a request
+        :param failed: whether the request failed
+        :param duration: the request duration in seconds
+        """
+        slow = (self.breaker.slow_call_duration is not None and
+                duration >= self.breaker.slow_call_duration)
+
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._transition(OPEN)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.breaker.half_open_calls:
+                    self._transition(CLOSED)
+            return
+
+        self._outcomes.append((failed, slow))
+        if self.state == CLOSED and self._should_trip():
+            self._transition(OPEN)
+
+    def _rates(self):
+        total = len(self._outcomes)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        return float(failures) / total, float(slow) / total
+
+    def _should_trip(self):
+        if len(self._outcomes) < self.breaker.min_requests:
+            return False
+        failure_rate, slow_rate = self._rates()
+        return (failure_rate >= self.breaker.failure_rate or
+                slow_rate >= self.breaker.slow_call_rate)
+
+    def stats(self):
+        """
+        get the circuit state and the rates in the current window
+        """
+        failure_rate, slow_rate = self._rates()
+        return {'state': self.state,
+                'requests': len(self._outcomes),
+                'failure_rate': failure_rate,
+                'slow_call_rate': slow_rate}
+
+
+class _ResourceBreaker(object):
+    """Call fetch functions through the circuit of a resource template"""
+    def __init__(self, breaker, template):
+        self.breaker = breaker
+        self.template = template
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function through the circuit breaker
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        breaker = self.breaker
+        circuit = breaker.circuit(request.url, self.template)
+        circuit.before_call()
+        start = breaker._now()
+        try:
+            response = fetch(request, **kwargs)
+        except Exception as exc:
+            circuit.record(breaker.is_failure(exc), breaker._now() - start)
+            raise
+        circuit.record(False, breaker._now() - start)
+        return response
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function through the circuit breaker
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        breaker = self.breaker
+        circuit = breaker.circuit(request.url, self.template)
+        circuit.before_call()
+        start = breaker._now()
+        try:
+            response = yield fetch(request, **kwargs)
+        except Exception as exc:
+            circuit.record(breaker.is_failure(exc), breaker._now() - start)
+            raise
+        circuit.record(False, breaker._now() - start)
+        raise Return(response)
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breakers keyed by host, or by host and resource path, with the
+    entity ids of the path replaced by "{id}", e.g.
+    "localhost:8004/v1/offers/{id}".
+
+    A circuit trips open when the failure rate, or the rate of calls slower
+    than slow_call_duration, within the last `window` requests exceeds a
+    threshold. While open, requests fail fast with CircuitOpenError. After
+    reset_timeout seconds the circuit becomes half-open and lets through
+    probe requests, closing again if they succeed.
+
+    Example Usage:
+        >>> breaker = CircuitBreaker(failure_rate=0.5, reset_timeout=30)
+        >>> breaker.add_listener(
+                lambda key, old, new: logging.warn('%s is %s', key, new))
+        >>> api = API('https://localhost:8004', circuit_breaker=breaker)
+        >>> breaker.state('localhost:8004')
+        'closed'
+    """
+    def __init__(self, failure_rate=0.5, slow_call_duration=None,
+                 slow_call_rate=1.0, window=20, min_requests=10,
+                 reset_timeout=30, half_open_calls=1, per_path=False):
+        """
+        :param failure_rate: trip when this ratio of requests fail
+        :param slow_call_duration: (optional) requests taking at least this
+            many seconds are slow
+        :param slow_call_rate: trip when this ratio of requests are slow
+        :param window: the number of recent requests used for the rates
+        :param min_requests: the minimum number of requests in the window
+            before the circuit can trip
+        :param reset_timeout: seconds to wait before probing an open circuit
+        :param half_open_calls: the number of successful probes needed to
+            close the circuit
+        :param per_path: key circuits by host and resource template instead
+            of host
+        """
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.window = window
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.per_path = per_path
+        self._circuits = {}
+        self._listeners = []
+
+    @staticmethod
+    def _now():
+        return time.time()
+
+    def key(self, url, template=None):
+        """
+        get the circuit key for a url
+        :param url: the request url
+        :param template: (optional) the resource template, so that requests
+            for different entities share a circuit if per_path is set
+        """
+        if self.per_path:
+            return resource_path(url, template)
+        return urlparse(url).netloc
+
+    def circuit(self, url, template=None):
+        """
+        get or create the circuit for a url
+        """
+        key = self.key(url, template)
+        if key not in self._circuits:
+            self._circuits[key] = Circuit(key, self)
+        return self._circuits[key]
+
+    def state(self, key):
+        """
+        get the state of a circuit
+        :param key: the circuit key, e.g. "localhost:8004"
+        """
+        circuit = self._circuits.get(key)
+        return circuit.state if circuit else CLOSED
+
+    def stats(self):
+        """
+        get the stats of all circuits
+        """
+        return {key: circuit.stats()
+                for key, circuit in self._circuits.items()}
+
+    def add_listener(self, listener):
+        """
+        add a function called with (key, old_state, new_state) when a
+        circuit changes state
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Remove a listener"""
+        self._listeners.remove(listener)
+
+    def _emit(self, key, old_state, new_state):
+        logging.info('Circuit for %s changed from %s to %s',
+                     key, old_state, new_state)
+        for listener in self._listeners:
+            try:
+                listener(key, old_state, new_state)
+            except Exception:
+                logging.exception('Error in circuit breaker listener')
+
+    @staticmethod
+    def is_failure(error):
+        """
+        whether an error counts as a failure of the service. Client errors
+        (4xx) do not count.
+        """
+        if isinstance(error, HTTPError):
+            return error.code >= 500
+        return isinstance(error, IOError)
+
+    def resource(self, template=None):
+        """
+        get an object calling fetch functions through the circuit breaker,
+        keyed by the resource template if per_path is set
+        :param template: (optional) the resource template, e.g.
+            "offers/{id}"
+        """
+        return _ResourceBreaker(self, template)
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function through the circuit breaker
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        return self.resource().sync_call(fetch, request, **kwargs)
+
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function through the circuit breaker
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        return self.resource().async_call(fetch, request, **kwargs)
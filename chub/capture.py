@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a recorder that captures requests and responses to an
+append-only log, which can be replayed with chub.replay
+"""
+import base64
+import json
+import logging
+import threading
+import time
+
+from tornado.gen import coroutine, Return
+from tornado.httpclient import HTTPError
+
+REDACTED = 'REDACTED'
+REDACT_HEADERS = ('Authorization', 'Cookie', 'Set-Cookie')
+
+
+def _encode_body(record, key, body):
+    """add a body to a record, base64 encoded if it isn't UTF-8 text"""
+    if not body:
+        return
+    try:
+        record[key] = body.decode('utf-8')
+    except UnicodeDecodeError:
+        record[key + '_b64'] = base64.b64encode(body)
+
+
+def decode_body(record, key):
+    """
+    get a body from a record
+    :param record: a dictionary read from a capture log
+    :param key: "body" or "response_body"
+    """
+    if key + '_b64' in record:
+        return base64.b64decode(record[key + '_b64'])
+    return record.get(key, u'').encode('utf-8')
+
+
+def read_log(path):
+    """
+    read the records in a capture log, skipping a partly written last line
+    :param path: the path of the log file
+    :return: a generator of dictionaries
+    """
+    with open(path) as log:
+        for line in log:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning('Skipping invalid line in %s', path)
+
+
+class _ResourceRecorder(object):
+    """Records requests for a resource template"""
+    def __init__(self, recorder, template):
+        self.recorder = recorder
+        self.template = template
+
+    def _record(self, request, response, error, start):
+        duration = time.time() - start
+        if isinstance(error, HTTPError):
+            response = error.response
+            status = error.code
+        elif error is not None:
+            status = 599
+        else:
+            status = response.code
+        self.recorder.record(request, self.template, status, response,
+                             start, duration, error)
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function and record the request
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        start = time.time()
+        try:
+            response = fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(request, None, exc, start)
+            raise
+        self._record(request, response, None, start)
+        return response
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function and record the request
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        start = time.time()
+        try:
+            response = yield fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(request, None, exc, start)
+            raise
+        self._record(request, response, None, start)
+        raise Return(response)
+
+
+class Recorder(object):
+    """
+    Capture every request sent and the response received to an
+    append-only log with one JSON object per line. Each attempt is
+    recorded, including retries, so the log has the traffic as it was
+    sent over the network.
+
+    Example Usage:
+        >>> recorder = Recorder('traffic.log')
+        >>> api = API('https://localhost:8004', recorder=recorder)
+        >>> api.offers['1234'].get()
+        >>> recorder.close()
+
+    Then replay the traffic at twice the recorded rate:
+        $ python -m chub.replay traffic.log --target http://localhost:8000 \
+            --speed 2
+
+    A record has the keys:
+        t: when the request was sent, as a unix timestamp
+        method, url, template: e.g. "GET", the URL and "offers/{id}"
+        headers, body: the request headers and body
+        status, duration: the response status (599 for connection errors)
+            and seconds taken
+        response_headers, response_body: if responses are recorded
+        error: the error, if the request failed
+    """
+    def __init__(self, path, responses=True, redact=REDACT_HEADERS):
+        """
+        :param path: the path of the log file, which is appended to
+        :param responses: whether to record response headers and bodies
+        :param redact: the names of headers whose values aren't recorded
+        """
+        self.path = path
+        self.responses = responses
+        self.redact = {header.lower() for header in redact}
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def _headers(self, headers):
+        return {name: REDACTED if name.lower() in self.redact else value
+                for name, value in (headers or {}).items()}
+
+    def resource(self, template):
+        """
+        get a layer recording requests for a resource
+        :param template: the resource template, e.g. "offers/{id}"
+        """
+        return _ResourceRecorder(self, template)
+
+    def record(self, request, template, status, response, start, duration,
+               error=None):
+        """
+        append a request to the log
+        :param request: the HTTPRequest
+        :param template: the resource template
+        :param status: the response status
+        :param response: the HTTPResponse, or None
+        :param start: when the request was sent
+        :param duration: the seconds taken
+        :param error: (optional) the exception raised
+        """
+        record = {'t': start,
+                  'method': request.method,
+                  'url': request.url,
+                  'template': template,
+                  'headers': self._headers(request.headers),
+                  'status': status,
+                  'duration': duration}
+        _encode_body(record, 'body', request.body)
+        if error is not None:
+            record['error'] = repr(error)
+        if self.responses and response is not None:
+            record['response_headers'] = self._headers(response.headers)
+            _encode_body(record, 'response_body', response.body)
+
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self.records += 1
+
+    def close(self):
+        """Close the log file"""
+        with self._lock:
+            self._file.close()
+
+    def stats(self):
+        """
+        get the number of requests recorded
+        """
+        return {'records': self.records}
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+generate client classes with a method for each operation in a Swagger
+(OpenAPI 2.0) or OpenAPI 3 spec
+
+    python -m chub.codegen repository.json --output repository_client.py
+    python -m chub.codegen repository.yaml --class-name Repository
+
+Each method builds the URL from a precomputed path template, checks the
+types of its parameters and calls the API's fetch function directly with a
+finished request, without walking Resource attributes. Query parameters go
+in the query string and the body parameter is sent as JSON, whatever the
+method:
+    >>> from repository_client import RepositoryClient
+    >>> repository = RepositoryClient('https://localhost:8004')
+    >>> offer = yield repository.get_offer(offer_id='1')
+
+Generated clients are API subclasses, so they take the same options, e.g.
+a retry_policy, and record metrics with the same resource templates as
+dynamic Resources. Reading YAML specs needs PyYAML.
+"""
+import argparse
+import json
+import keyword
+import re
+import sys
+from collections import OrderedDict
+from urllib import quote_plus, urlencode
+
+from tornado.httpclient import HTTPRequest
+
+from .api import API, API_VERSION
+from .handlers import convert
+
+HEADER = '''\
+# generated by chub.codegen from {source}, do not edit
+from urllib import quote_plus
+
+from chub.api import API
+from chub.codegen import build_request, check
+'''
+
+HTTP_METHODS = ('get', 'put', 'post', 'delete', 'options', 'head', 'patch')
+
+# the build_request argument for parameters in each location, others are
+# sent in the query string
+COLLECTIONS = {'query': 'query', 'header': 'headers', 'formData': 'form'}
+
+TYPES = {'string': basestring,
+         'integer': (int, long),
+         'number': (int, long, float),
+         'boolean': bool,
+         'array': (list, tuple),
+         'object': dict}
+
+
+def check(name, value, kind, enum=None):
+    """
+    check the type of a parameter of a generated method
+    :param name: the parameter name
+    :param value: the value
+    :param kind: the JSON schema type, e.g. "string"
+    :param enum: (optional) the allowed values
+    :raises: ValueError if the value isn't valid
+    """
+    expected = TYPES.get(kind)
+    if expected is not None and (
+            not isinstance(value, expected) or
+            (isinstance(value, bool) and kind in ('integer', 'number'))):
+        raise ValueError('{} must be of type {}, not {}'.format(
+            name, kind, type(value).__name__))
+    if enum is not None and value not in enum:
+        raise ValueError('{} must be one of {}'.format(
+            name, ', '.join(repr(item) for item in enum)))
+
+
+def _query_value(value):
+    """format booleans in a query string as JSON does"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return [_query_value(item) for item in value]
+    return value
+
+
+def build_request(url, method, query=None, body=None, form=None,
+                  headers=None):
+    """
+    build the request of a generated method
+    :param url: the url, without a query string
+    :param method: the HTTP method
+    :param query: (optional) a dictionary of query parameters. Lists are
+        sent as repeated parameters
+    :param body: (optional) the body, sent as JSON unless it is a string
+    :param form: (optional) a dictionary of form fields, sent as the body
+        if there isn't one
+    :param headers: (optional) a dictionary of headers
+    :return: an HTTPRequest
+    """
+    headers = dict(headers or {})
+    if query:
+        url += '?' + urlencode(
+            convert({name: _query_value(value)
+                     for name, value in query.items()}), doseq=True)
+    if body is None and form:
+        body = urlencode(convert(form), doseq=True)
+        headers.setdefault('Content-Type',
+                           'application/x-www-form-urlencoded')
+    elif body is not None and not isinstance(body, basestring):
+        body = json.dumps(body)
+    # a body is sent with any method it is given for, and POST, PUT and
+    # PATCH requests without one are sent with an empty body, so that they
+    # have a Content-Length
+    if body is None and method in ('POST', 'PUT', 'PATCH'):
+        body = ''
+    return HTTPRequest(url, method, headers=headers, body=body,
+                       allow_nonstandard_methods=True)
+
+
+def load_spec(path):
+    """
+    read a spec from a JSON or YAML file
+    :param path: the path of the file
+    """
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('PyYAML is needed to read {}'.format(path))
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def _str(value):
+    """convert unicode read from a spec into a byte string"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (list, tuple)):
+        return [_str(item) for item in value]
+    return value
+
+
+def snake_case(name):
+    """
+    convert an operationId or parameter name into a Python identifier,
+    e.g. "getOffer" into "get_offer"
+    """
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name)
+    name = re.sub(r'[^0-9a-zA-Z]+', '_', name).strip('_').lower()
+    if not name or name[0].isdigit() or keyword.iskeyword(name):
+        name += '_'
+    return name
+
+
+def _resolve(spec, item):
+    """follow a local $ref, e.g. "#/parameters/offer_id" """
+    while isinstance(item, dict) and '$ref' in item:
+        ref = item['$ref']
+        if not ref.startswith('#/'):
+            raise ValueError('Only local references are supported: ' + ref)
+        item = spec
+        for part in ref[2:].split('/'):
+            item = item[part.replace('~1', '/').replace('~0', '~')]
+    return item
+
+
+def _base_path(spec, api_version):
+    """the path of the spec's operations relative to the API's base_url"""
+    if 'servers' in spec:
+        url = spec['servers'][0]['url'] if spec['servers'] else ''
+        base_path = re.sub(r'^[a-z]+://[^/]*', '', url)
+    else:
+        base_path = spec.get('basePath', '')
+    base_path = base_path.strip('/')
+    if base_path == api_version:
+        return ''
+    if base_path.startswith(api_version + '/'):
+        return base_path[len(api_version) + 1:]
+    return base_path
+
+
+class Parameter(object):
+    """A parameter of an operation"""
+    def __init__(self, spec, name, location, kind=None, required=False,
+                 enum=None, description=''):
+        self.spec = spec
+        self.name = _str(name)
+        self.location = _str(location)
+        self.kind = _str(kind)
+        self.required = required or location == 'path'
+        self.enum = _str(enum)
+        self.description = _str(' '.join((description or '').split()))
+        self.argument = _str(snake_case(name))
+
+    @classmethod
+    def from_spec(cls, spec, item):
+        item = _resolve(spec, item)
+        schema = _resolve(spec, item.get('schema', {}))
+        location = item['in']
+        kind = item.get('type', schema.get('type'))
+        if location == 'body':
+            kind = schema.get('type', 'object')
+        return cls(spec, item['name'], location, kind,
+                   item.get('required', False),
+                   item.get('enum', schema.get('enum')),
+                   item.get('description'))
+
+    def check(self):
+        """the source checking the parameter"""
+        if self.kind not in TYPES and self.enum is None:
+            return None
+        args = [repr(self.argument), self.argument, repr(self.kind)]
+        if self.enum is not None:
+            args.append(repr(tuple(self.enum)))
+        return 'check({})'.format(', '.join(args))
+
+
+class Operation(object):
+    """An operation, i.e. a method and path"""
+    def __init__(self, spec, method, path, base_path, item, shared=()):
+        self.method = _str(method.upper())
+        self.path = _str('/'.join(filter(None, (base_path,
+                                                 path.strip('/')))))
+        self.summary = _str(' '.join((item.get('summary') or
+                                      item.get('description') or '').split()))
+        self.name = _str(snake_case(item.get('operationId') or
+                                    '{} {}'.format(method, path)))
+
+        parameters = OrderedDict()
+        for parameter in list(shared) + list(item.get('parameters', [])):
+            parameter = Parameter.from_spec(spec, parameter)
+            parameters[(parameter.name, parameter.location)] = parameter
+        body = _resolve(spec, item.get('requestBody'))
+        if body:
+            content = body.get('content', {})
+            schema = next(iter(content.values()), {}).get('schema', {})
+            schema = _resolve(spec, schema)
+            parameters[('body', 'body')] = Parameter(
+                spec, 'body', 'body', schema.get('type', 'object'),
+                body.get('required', False),
+                description=body.get('description'))
+        # path parameters first, in the order they are in the path, then
+        # the other required parameters
+        positions = {name: index for index, name in enumerate(
+            re.findall(r'\{([^}]+)\}', self.path))}
+        self.parameters = sorted(
+            parameters.values(),
+            key=lambda p: (not p.required, p.location != 'path',
+                           positions.get(p.name, 0)))
+
+        names = [p.argument for p in self.parameters]
+        for parameter in self.parameters:
+            if names.count(parameter.argument) > 1:
+                parameter.argument += '_' + parameter.location
+
+    def template(self):
+        """
+        the path with {} for each path parameter and the resource template
+        used by Metrics, with each path parameter replaced by "{id}"
+        """
+        arguments = []
+        by_name = {p.name: p for p in self.parameters
+                   if p.location == 'path'}
+
+        def replace(match):
+            parameter = by_name.get(match.group(1))
+            if parameter is None:
+                raise ValueError('{} {} has no path parameter {}'.format(
+                    self.method, self.path, match.group(1)))
+            arguments.append(parameter)
+            return '{}'
+
+        path = re.sub(r'\{([^}]+)\}', replace, self.path)
+        template = re.sub(r'\{([^}]+)\}', '{id}', self.path)
+        return path, template, arguments
+
+    def source(self):
+        """the source of the method"""
+        path, template, path_arguments = self.template()
+        signature = ['self'] + [
+            p.argument if p.required else '{}=None'.format(p.argument)
+            for p in self.parameters]
+        lines = ['    def {}({}):'.format(self.name, ', '.join(signature)),
+                 '        """']
+        if self.summary:
+            lines.append('        {}'.format(self.summary))
+        lines.append('        {} {}'.format(self.method, self.path))
+        for parameter in self.parameters:
+            lines.append('        :param {}: {}{}'.format(
+                parameter.argument,
+                '' if parameter.required else '(optional) ',
+                parameter.description or '{} {} parameter'.format(
+                    parameter.kind or 'a', parameter.location)))
+        lines.append('        """')
+
+        for parameter in self.parameters:
+            if parameter.location == 'path' and parameter.check():
+                lines.append('        ' + parameter.check())
+
+        # query, header and form parameters are collected in dictionaries
+        # and the body is passed as it is
+        collections = OrderedDict()
+        body = None
+        for parameter in self.parameters:
+            if parameter.location == 'path':
+                continue
+            if parameter.location == 'body':
+                body = parameter
+            else:
+                collections.setdefault(COLLECTIONS.get(
+                    parameter.location, 'query'), []).append(parameter)
+        for collection in collections:
+            lines.append('        {} = {{}}'.format(collection))
+        for parameter in self.parameters:
+            if parameter.location == 'path':
+                continue
+            statements = filter(None, [parameter.check()])
+            if parameter.location != 'body':
+                statements.append('{}[{!r}] = {}'.format(
+                    COLLECTIONS.get(parameter.location, 'query'),
+                    parameter.name, parameter.argument))
+            indent = '        '
+            if statements and not parameter.required:
+                lines.append('        if {} is not None:'.format(
+                    parameter.argument))
+                indent += '    '
+            lines.extend(indent + statement for statement in statements)
+
+        if path_arguments:
+            quoted = ', '.join(
+                'quote_plus({})'.format(p.argument if p.kind == 'string'
+                                        else 'str({})'.format(p.argument))
+                for p in path_arguments)
+            lines.append('        url = self.path + {!r}.format('.format(
+                '/' + path))
+            lines.append('            {})'.format(quoted))
+        else:
+            lines.append('        url = self.path + {!r}'.format('/' + path))
+
+        arguments = ['url', repr(self.method)]
+        arguments += ['{0}={0}'.format(collection)
+                      for collection in collections]
+        if body is not None:
+            arguments.append('body={}'.format(body.argument))
+        lines.append('        request = build_request({})'.format(
+            ', '.join(arguments)))
+        lines.append('        return self.fetch(')
+        lines.append('            request=request, method={!r},'.format(
+            self.method))
+        lines.append('            default_headers=self.default_headers,')
+        lines.append('            chub_resource_template={!r})'.format(
+            template))
+        return '\n'.join(lines)
+
+
+def operations(spec, api_version=API_VERSION):
+    """
+    get the operations in a spec
+    :param spec: the spec, a dictionary
+    :param api_version: the API version in the API's base_url, which is
+        removed from the start of the spec's paths
+    """
+    base_path = _base_path(spec, api_version)
+    result = []
+    for path, item in sorted(spec.get('paths', {}).items()):
+        item = _resolve(spec, item)
+        shared = item.get('parameters', [])
+        for method in HTTP_METHODS:
+            if method in item:
+                result.append(Operation(spec, method, path, base_path,
+                                        item[method], shared))
+    names = [operation.name for operation in result]
+    duplicates = set(name for name in names if names.count(name) > 1)
+    if duplicates:
+        raise ValueError('Duplicate operation names: {}'.format(
+            ', '.join(sorted(duplicates))))
+    return result
+
+
+def class_name(spec):
+    """
+    get a class name for a spec from its base path or title, e.g.
+    "RepositoryClient"
+    """
+    base_path = _base_path(spec, API_VERSION)
+    name = base_path.split('/')[-1] or spec.get('info', {}).get('title', '')
+    return ''.join(part.title() for part in snake_case(name).split('_')) + \
+        'Client'
+
+
+def generate_class(spec, name=None, api_version=API_VERSION):
+    """
+    generate the source of a client class
+    :param spec: the spec, a dictionary
+    :param name: (optional) the class name, by default derived from the
+        spec's base path
+    :param api_version: the API version in the API's base_url
+    """
+    name = name or class_name(spec)
+    info = spec.get('info', {})
+    title = ' '.join((info.get('title') or name).split())
+    lines = ['class {}(API):'.format(name),
+             '    """',
+             '    {}'.format(title)]
+    if info.get('version'):
+        lines.append('    generated from version {} of the spec'.format(
+            info['version']))
+    lines.append('    """')
+    methods = [operation.source()
+               for operation in operations(spec, api_version)]
+    return '\n'.join(lines) + '\n\n' + '\n\n'.join(methods) + '\n'
+
+
+def generate(specs, source='a spec', api_version=API_VERSION):
+    """
+    generate the source of a module of client classes
+    :param specs: a list of (spec, class name or None) tuples
+    :param source: the name of the specs, written in the module header
+    :param api_version: the API version in the API's base_url
+    """
+    classes = [generate_class(spec, name, api_version)
+               for spec, name in specs]
+    return (HEADER.format(source=source) + '\n\n' +
+            '\n\n'.join(classes))
+
+
+def compile_client(spec, name=None, api_version=API_VERSION):
+    """
+    generate a client class and compile it, without writing a module
+    :param spec: the spec, a dictionary
+    :param name: (optional) the class name
+    :param api_version: the API version in the API's base_url
+    :return: the class
+    """
+    name = name or class_name(spec)
+    namespace = {'API': API, 'build_request': build_request, 'check': check,
+                 'quote_plus': quote_plus}
+    source = generate_class(spec, name, api_version)
+    exec compile(source, '<chub.codegen {}>'.format(name), 'exec') in \
+        namespace
+    return namespace[name]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('specs', nargs='+',
+                        help='Swagger or OpenAPI specs, JSON or YAML')
+    parser.add_argument('--class-name',
+                        help='the class name, if there is one spec')
+    parser.add_argument('--api-version', default=API_VERSION,
+                        help='the API version in the base URL')
+    parser.add_argument('--output', help='the module to write')
+    args = parser.parse_args(argv)
+    if args.class_name and len(args.specs) > 1:
+        parser.error('--class-name needs a single spec')
+
+    specs = [(load_spec(path), args.class_name) for path in args.specs]
+    module = generate(specs, ', '.join(args.specs), args.api_version)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(module)
+    else:
+        sys.stdout.write(module)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has gzip compression of large request bodies
+"""
+import copy
+import sys
+import threading
+import zlib
+from Queue import Queue
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
+
+
+def gzip_body(body, level=6):
+    """
+    gzip a request body
+    :param body: the body, a byte string
+    :param level: the compression level, from 1 (fastest) to 9 (smallest)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+class Compression(object):
+    """
+    Gzip request bodies of at least threshold bytes and send them with
+    Content-Encoding: gzip, e.g. bulk POSTs of assets. The service must
+    accept compressed bodies, e.g. a Tornado HTTPServer created with
+    decompress_request=True.
+
+    Responses are requested with Accept-Encoding: gzip and decompressed as
+    they are read, even if the client's defaults turn off
+    decompress_response.
+
+    An async client gzips bodies of at least thread_threshold bytes in a
+    worker thread, so the IOLoop isn't blocked. zlib releases the GIL
+    while it compresses, so the IOLoop runs in the meantime.
+
+    Example Usage:
+        >>> compression = Compression(threshold=4096, level=6)
+        >>> api = API('https://localhost:8004', compression=compression)
+        >>> compression.stats()
+        {'compressed': 120, 'threaded': 2, 'bytes_in': 31457280,
+         'bytes_out': 2202009, 'ratio': 0.07}
+    """
+    def __init__(self, threshold=1024, level=6, thread_threshold=1048576,
+                 io_loop=None):
+        """
+        :param threshold: the minimum size of a body to compress, in bytes
+        :param level: the compression level, from 1 (fastest) to 9
+            (smallest)
+        :param thread_threshold: the minimum size of a body compressed in a
+            worker thread by an async client, in bytes, or None to always
+            compress on the IOLoop
+        :param io_loop: (optional) the IOLoop
+        """
+        if not 1 <= level <= 9:
+            raise ValueError('level must be from 1 to 9')
+        self.threshold = threshold
+        self.level = level
+        self.thread_threshold = thread_threshold
+        self.io_loop = io_loop
+        self.compressed = 0
+        self.threaded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+        self._jobs = None
+
+    def _compressible(self, request):
+        return (request.body is not None and
+                len(request.body) >= self.threshold and
+                'Content-Encoding' not in request.headers)
+
+    def _request(self, request, body=None):
+        """
+        copy a request, with the compressed body if there is one
+        """
+        request = copy.copy(request)
+        request.headers = HTTPHeaders(request.headers)
+        if request.decompress_response is None:
+            request.decompress_response = True
+        if body is not None:
+            with self._lock:
+                self.compressed += 1
+                self.bytes_in += len(request.body)
+                self.bytes_out += len(body)
+            request.body = body
+            request.headers['Content-Encoding'] = 'gzip'
+        return request
+
+    def _work(self):
+        while True:
+            future, io_loop, body = self._jobs.get()
+            try:
+                result = gzip_body(body, self.level)
+            except Exception:
+                io_loop.add_callback(future.set_exc_info, sys.exc_info())
+            else:
+                io_loop.add_callback(future.set_result, result)
+
+    def compress_in_thread(self, body):
+        """
+        gzip a body in the worker thread
+        :param body: the body, a byte string
+        :return: a Future resolving to the compressed body
+        """
+        with self._lock:
+            if self._jobs is None:
+                self._jobs = Queue()
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+            self.threaded += 1
+        future = Future()
+        self._jobs.put((future, self.io_loop or IOLoop.current(), body))
+        return future
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function with the request body compressed
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        body = None
+        if self._compressible(request):
+            body = gzip_body(request.body, self.level)
+        return fetch(self._request(request, body), **kwargs)
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function with the request body
+        compressed
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        body = None
+        if self._compressible(request):
+            if (self.thread_threshold is not None and
+                    len(request.body) >= self.thread_threshold):
+                body = yield self.compress_in_thread(request.body)
+            else:
+                body = gzip_body(request.body, self.level)
+        response = yield fetch(self._request(request, body), **kwargs)
+        raise Return(response)
+
+    def stats(self):
+        """
+        get the number of bodies compressed, in total and in the worker
+        thread, and their size before and after compression
+        """
+        return {'compressed': self.compressed,
+                'threaded': self.threaded,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': float(self.bytes_out) / self.bytes_in
+                if self.bytes_in else None}
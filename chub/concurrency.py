@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a limit on the number of requests in flight to each host,
+which adapts to the latency and errors of the host
+"""
+import logging
+import math
+import time
+from collections import deque
+from functools import partial
+from urlparse import urlparse
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return
+from tornado.httpclient import HTTPError
+from tornado.queues import QueueFull
+
+from .breaker import CircuitBreaker
+from .deadline import current_deadline
+
+AIMD = 'aimd'
+GRADIENT = 'gradient'
+
+
+class _HostLimit(object):
+    """
+    The concurrency limit, requests in flight and queue of a host
+    """
+    def __init__(self, key, limit):
+        """
+        :param key: the host
+        :param limit: the initial limit
+        """
+        self.key = key
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.baseline = None
+        self.latency = None
+        self.decreases = 0
+        self.last_decrease = None
+        self._queue = deque()
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'baseline_ms': 1000 * self.baseline
+                if self.baseline is not None else None,
+                'latency_ms': 1000 * self.latency
+                if self.latency is not None else None,
+                'decreases': self.decreases}
+
+
+class ConcurrencyLimiter(object):
+    """
+    Limit the number of requests in flight to each host, adapting the limit
+    so that a host gets as many requests as it can serve without queueing.
+    Requests over the limit wait in a queue.
+
+    The latency of each host is compared with its baseline, a slow moving
+    average of the latency. With the "aimd" algorithm, the limit grows by
+    one each round trip while the limit is in use and the latency stays
+    within tolerance times the baseline. It is multiplied by backoff when
+    the latency rises above that, or a request fails with a connection
+    error, a 5xx or a 429, at most once a round trip. With the "gradient"
+    algorithm, the limit is scaled by the ratio of the baseline to the
+    latency, plus headroom of the square root of the limit, and smoothed.
+
+    Example Usage:
+        >>> limiter = ConcurrencyLimiter(initial_limit=10, max_limit=200)
+        >>> api = API('https://localhost:8004', concurrency_limiter=limiter)
+        >>> limiter.stats()['hosts']['localhost:8004']
+        {'limit': 24, 'in_flight': 24, 'queued': 310, 'baseline_ms': 11.2,
+         'latency_ms': 12.5, 'decreases': 3}
+
+    The AsyncHTTPClient's max_clients should be at least the sum of the
+    max_limit of the hosts, so that requests don't also queue in the
+    client.
+    """
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=100,
+                 algorithm=AIMD, tolerance=2.0, backoff=0.9, smoothing=0.2,
+                 alpha=0.3, baseline_alpha=0.01, max_queue=10000):
+        """
+        :param initial_limit: the limit of a host before it adapts
+        :param min_limit: the minimum limit
+        :param max_limit: the maximum limit
+        :param algorithm: "aimd" or "gradient"
+        :param tolerance: the ratio of the latency to the baseline above
+            which the host is considered overloaded
+        :param backoff: multiply the limit by this when overloaded (aimd)
+        :param smoothing: the weight of a new limit (gradient)
+        :param alpha: the weight of the latest latency in the moving average
+        :param baseline_alpha: the weight of the latest latency in the
+            baseline
+        :param max_queue: the maximum number of requests waiting for each
+            host, after which QueueFull is raised
+        """
+        if algorithm not in (AIMD, GRADIENT):
+            raise ValueError('Unknown algorithm {}'.format(algorithm))
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.algorithm = algorithm
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.alpha = alpha
+        self.baseline_alpha = baseline_alpha
+        self.max_queue = max_queue
+        self.rejected = 0
+        self.hosts = {}
+
+    _now = staticmethod(time.time)
+
+    @staticmethod
+    def key(url):
+        """
+        get the host key for a url
+        """
+        return urlparse(url).netloc
+
+    def host(self, key):
+        """
+        get or create the _HostLimit for a host
+        """
+        if key not in self.hosts:
+            self.hosts[key] = _HostLimit(key, self.initial_limit)
+        return self.hosts[key]
+
+    def acquire(self, host):
+        """
+        queue for a request slot
+        :param host: the _HostLimit
+        :return: a Future resolved when the request may start
+        :raises: QueueFull if max_queue requests are waiting
+        """
+        future = Future()
+        if host.in_flight < int(host.limit) and not host._queue:
+            host.in_flight += 1
+            future.set_result(None)
+        elif host.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull()
+        else:
+            host._queue.append(future)
+        return future
+
+    def release(self, host, latency, error=None):
+        """
+        release a request slot and adapt the limit
+        :param host: the _HostLimit
+        :param latency: the number of seconds the request took
+        :param error: (optional) the exception raised by the request
+        """
+        self.update(host, latency, error)
+        host.in_flight -= 1
+        self._dispatch(host)
+
+    def cancel(self, host, future):
+        """
+        give up a request slot, e.g. when the deadline has passed
+        :param host: the _HostLimit
+        :param future: the Future returned by acquire
+        """
+        if future.done():
+            host.in_flight -= 1
+            self._dispatch(host)
+        else:
+            host._queue.remove(future)
+
+    @staticmethod
+    def _dispatch(host):
+        while host._queue and host.in_flight < int(host.limit):
+            host.in_flight += 1
+            host._queue.popleft().set_result(None)
+
+    @staticmethod
+    def _overload(error):
+        if isinstance(error, HTTPError) and error.code == 429:
+            return True
+        return error is not None and CircuitBreaker.is_failure(error)
+
+    def update(self, host, latency, error=None):
+        """
+        adapt the limit of a host to the outcome of a request
+        :param host: the _HostLimit
+        :param latency: the number of seconds the request took
+        :param error: (optional) the exception raised by the request
+        """
+        failed = self._overload(error)
+        if not failed:
+            if host.latency is None:
+                host.latency = host.baseline = latency
+            else:
+                host.latency += self.alpha * (latency - host.latency)
+                host.baseline += self.baseline_alpha * (latency -
+                                                        host.baseline)
+        if host.latency is None:
+            return
+        overloaded = failed or (host.latency >
+                                self.tolerance * host.baseline)
+        # don't grow the limit when it isn't being used
+        in_use = host.in_flight + host.queued >= host.limit / 2
+
+        if self.algorithm == AIMD:
+            if overloaded:
+                now = self._now()
+                if (host.last_decrease is not None and
+                        now - host.last_decrease < host.latency):
+                    return
+                host.last_decrease = now
+                limit = host.limit * self.backoff
+            elif in_use:
+                limit = host.limit + 1 / host.limit
+            else:
+                return
+        else:
+            gradient = 0.5 if failed else max(0.5, min(
+                1.0, self.tolerance * host.baseline / host.latency))
+            if gradient == 1.0 and not in_use:
+                return
+            target = host.limit * gradient + math.sqrt(host.limit)
+            limit = host.limit + self.smoothing * (target - host.limit)
+
+        limit = min(self.max_limit, max(self.min_limit, limit))
+        if limit < host.limit:
+            host.decreases += 1
+            logging.debug('Reducing the concurrency limit of %s to %.1f',
+                          host.key, limit)
+        host.limit = limit
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function when the host's limit allows it
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        host = self.host(self.key(request.url))
+        slot = self.acquire(host)
+        deadline = current_deadline()
+        if deadline is not None:
+            slot = deadline.wait(slot, partial(self.cancel, host))
+        yield slot
+        start = self._now()
+        try:
+            response = yield fetch(request, **kwargs)
+        except Exception as exc:
+            self.release(host, self._now() - start, exc)
+            raise
+        self.release(host, self._now() - start)
+        raise Return(response)
+
+    def stats(self):
+        """
+        get the number of rejected requests and the limit, requests in
+        flight and queue of each host
+        """
+        return {'rejected': self.rejected,
+                'hosts': {key: host.stats()
+                          for key, host in self.hosts.items()}}
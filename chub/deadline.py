@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a deadline shared by the requests made while handling a
+request, so the total time taken stays within a budget
+"""
+import copy
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+
+from tornado.concurrent import Future, chain_future
+from tornado.gen import (coroutine, Return, TimeoutError, maybe_future,
+                         with_timeout)
+from tornado.httpclient import HTTPError, HTTPRequest
+from tornado.httputil import HTTPHeaders
+from tornado.stack_context import StackContext, run_with_stack_context
+
+
+class _State(threading.local):
+    deadline = None
+
+_state = _State()
+
+
+def current_deadline():
+    """
+    get the active deadline, or None
+    """
+    return _state.deadline
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of making a request when the deadline has passed"""
+    def __init__(self, timeout):
+        """
+        :param timeout: the number of seconds the deadline allowed
+        """
+        super(DeadlineExceeded, self).__init__(
+            'Deadline of {:.3f}s exceeded'.format(timeout))
+        self.timeout = timeout
+
+
+def _client_defaults(fetch):
+    """
+    get the request defaults of the client a fetch function belongs to,
+    e.g. the request_timeout the API was created with
+    """
+    client = getattr(fetch, '__self__', None)
+    # the synchronous HTTPClient sends requests with an AsyncHTTPClient
+    client = getattr(client, '_async_client', client)
+    return getattr(client, 'defaults', None) or HTTPRequest._DEFAULTS
+
+
+class _ActiveDeadline(object):
+    """Context manager used by StackContext to make a deadline active"""
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = _state.deadline
+        _state.deadline = self.deadline
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _state.deadline = self.previous
+
+
+class Deadline(object):
+    """
+    A time by which a piece of work, such as handling an incoming request,
+    must be done. Requests made while a deadline is active use the time
+    remaining as their connect and request timeouts, unless they or the
+    client set shorter ones, and fail with DeadlineExceeded once it has
+    passed. Retries are not attempted if the deadline would pass during
+    the backoff, requests don't wait for the rate limiter or in a queue
+    past it, and get_token requests share the same budget.
+
+    A deadline created while another is active can't end later than it.
+
+    In a coroutine, run a function with the deadline active in the
+    callbacks and coroutines it starts:
+        >>> offers = yield Deadline(2.0).run(get_offers, api, ids)
+
+    In synchronous code, use it as a context manager:
+        >>> with Deadline(2.0):
+                token = get_token(...)
+                offers = api.offers.get()
+    """
+    def __init__(self, timeout):
+        """
+        :param timeout: the number of seconds until the deadline
+        """
+        self.timeout = timeout
+        self.expires = self._now() + timeout
+        outer = current_deadline()
+        if outer is not None and outer.expires < self.expires:
+            self.expires = outer.expires
+        self._previous = []
+
+    _now = staticmethod(time.time)
+
+    def remaining(self):
+        """
+        the number of seconds until the deadline, or 0 if it has passed
+        """
+        return max(0, self.expires - self._now())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        """
+        :raises: DeadlineExceeded if the deadline has passed
+        """
+        if self.expired:
+            raise DeadlineExceeded(self.timeout)
+
+    def __enter__(self):
+        self._previous.append(_state.deadline)
+        _state.deadline = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _state.deadline = self._previous.pop()
+
+    def run(self, func, *args, **kwargs):
+        """
+        call a function, e.g. a coroutine, with the deadline active. The
+        deadline stays active in callbacks and coroutines started by the
+        function.
+        :param func: the function
+        :return: a Future with the result of the function
+        """
+        result = Future()
+
+        def call():
+            chain_future(maybe_future(func(*args, **kwargs)), result)
+
+        run_with_stack_context(
+            StackContext(partial(_ActiveDeadline, self)), call)
+        return result
+
+    @coroutine
+    def wait(self, future, cancel=None):
+        """
+        wait for a future, e.g. a request slot, until the deadline
+        :param future: the Future
+        :param cancel: (optional) called with the future if the deadline
+            passes first, e.g. to leave a queue
+        :raises: DeadlineExceeded if the deadline passes first
+        """
+        try:
+            self.check()
+            result = yield with_timeout(
+                timedelta(seconds=self.remaining()), future)
+        except (DeadlineExceeded, TimeoutError):
+            if cancel is not None:
+                cancel(future)
+            raise DeadlineExceeded(self.timeout)
+        raise Return(result)
+
+    def _request(self, request, defaults=HTTPRequest._DEFAULTS):
+        """
+        copy the request with timeouts no longer than the time left
+        :param request: an HTTPRequest object
+        :param defaults: the client's defaults, used for timeouts the
+            request doesn't set
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(self.timeout)
+        request = copy.copy(request)
+        request.headers = HTTPHeaders(request.headers)
+        for name in ('connect_timeout', 'request_timeout'):
+            timeout = getattr(request, name)
+            if timeout is None:
+                timeout = defaults.get(name, HTTPRequest._DEFAULTS[name])
+            setattr(request, name, min(timeout, remaining))
+        return request
+
+    def _timed_out(self, error):
+        return (isinstance(error, HTTPError) and error.code == 599 and
+                self.expired)
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function with the time remaining
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        try:
+            request = self._request(request, _client_defaults(fetch))
+            return fetch(request, **kwargs)
+        except HTTPError as exc:
+            if self._timed_out(exc):
+                raise DeadlineExceeded(self.timeout)
+            raise
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function with the time remaining
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        try:
+            request = self._request(request, _client_defaults(fetch))
+            response = yield fetch(request, **kwargs)
+        except HTTPError as exc:
+            if self._timed_out(exc):
+                raise DeadlineExceeded(self.timeout)
+            raise
+        raise Return(response)
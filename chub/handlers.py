@@ -14,13 +14,28 @@ this module has some handler utilities for HTTP request and response
 import collections
 import urllib
 import json
+import sys
 from functools import partial
 
+from tornado.concurrent import Future
 from tornado.httpclient import AsyncHTTPClient, HTTPClient, HTTPRequest
 from tornado.gen import coroutine, Return
+from tornado.ioloop import IOLoop
+
+from .deadline import current_deadline
+from .pool import KeepAliveHTTPClient
 
 JSON_TYPE = 'application/json'
 DEFAULT_HEADERS = (('Content-Type', 'application/json'),)
+# the async_fetch options which need the coroutine. The fetch options are
+# prefixed with "chub_", so that they can't be mistaken for the query string
+# entities or POST data of a request
+LAYER_OPTIONS = ('chub_retry_policy', 'chub_circuit_breaker',
+                 'chub_hedge_policy', 'chub_rate_limiter',
+                 'chub_priority_scheduler', 'chub_metrics', 'chub_tracer',
+                 'chub_recorder', 'chub_lag_monitor', 'chub_load_balancer',
+                 'chub_adaptive_timeout', 'chub_concurrency_limiter',
+                 'chub_compression', 'chub_auth_provider')
 
 
 def convert(data):
@@ -101,48 +116,359 @@ def parse_response(response):
         return response.body
 
 
+def wrap_fetch(fetch, mode, *layers):
+    """
+    wrap a fetch function with layers such as a RetryPolicy. Each layer
+    has sync_call and async_call methods taking the fetch function to call
+    and the request.
+    :param fetch: the fetch function, e.g. HTTPClient.fetch
+    :param mode: "sync" or "async"
+    :param layers: the layers, innermost first. None is skipped
+    """
+    for layer in layers:
+        if layer is not None:
+            fetch = partial(getattr(layer, mode + '_call'), fetch)
+    return fetch
+
+
 def sync_fetch(request, method, default_headers=None,
-               httpclient=None, **kwargs):
+               httpclient=None, chub_retry_policy=None,
+               chub_circuit_breaker=None, chub_rate_limiter=None,
+               chub_metrics=None, chub_resource_template=None,
+               chub_priority=None, chub_tracer=None, chub_recorder=None,
+               chub_load_balancer=None, chub_adaptive_timeout=None,
+               chub_compression=None, chub_auth_provider=None, **kwargs):
     """
     fetch resource using the synchronous HTTPClient
     :param request: HTTPRequest object or a url
     :param method: HTTP method in string format, e.g. GET, POST
+    :param chub_retry_policy: (optional) a RetryPolicy for transient
+    failures
+    :param chub_circuit_breaker: (optional) a CircuitBreaker
+    :param chub_rate_limiter: (optional) a RateLimiter
+    :param chub_metrics: (optional) Metrics to record the request in
+    :param chub_resource_template: (optional) the resource template used
+    as the metrics key, e.g. "offers/{id}"
+    :param chub_priority: ignored, the synchronous client makes one request
+    at a time
+    :param chub_tracer: (optional) a Tracer to create a span for the request
+    :param chub_recorder: (optional) a Recorder to capture the request in
+    :param chub_load_balancer: (optional) a LoadBalancer choosing the
+    endpoint
+    :param chub_adaptive_timeout: (optional) an AdaptiveTimeout setting the
+    request timeout
+    :param chub_compression: (optional) a Compression gzipping large request
+    bodies
+    :param chub_auth_provider: (optional) an auth provider adding a token to
+    the request, e.g. an oauth2.ClientCredentials
     :param kwargs: query string entities or POST data
+
+    Requests made while a Deadline is active use the time remaining as
+    their timeouts.
     """
     updated_request = make_request(request, method, default_headers, **kwargs)
     if not httpclient:
         httpclient = HTTPClient()
-    rsp = httpclient.fetch(updated_request)
-    return parse_response(rsp)
+    resource_metrics = None
+    if chub_metrics is not None:
+        resource_metrics = chub_metrics.resource(
+            method, updated_request.url, chub_resource_template)
+    span = None
+    if chub_tracer is not None:
+        span = chub_tracer.request_span(updated_request,
+                                        chub_resource_template)
+    resource_recorder = None
+    if chub_recorder is not None:
+        resource_recorder = chub_recorder.resource(chub_resource_template)
+    resource_timeout = None
+    if chub_adaptive_timeout is not None:
+        resource_timeout = chub_adaptive_timeout.resource(
+            method, updated_request.url, chub_resource_template)
+    resource_breaker = None
+    if chub_circuit_breaker is not None:
+        resource_breaker = chub_circuit_breaker.resource(
+            chub_resource_template)
+    resource_limiter = None
+    if chub_rate_limiter is not None:
+        resource_limiter = chub_rate_limiter.resource(chub_resource_template)
+    # the circuit breaker and rate limiter are inside the load balancer, so
+    # that they are keyed by the chosen endpoint
+    fetch = wrap_fetch(httpclient.fetch, 'sync', current_deadline(),
+                       resource_timeout, resource_recorder, resource_breaker,
+                       resource_limiter, chub_load_balancer,
+                       resource_metrics, span, chub_retry_policy,
+                       chub_auth_provider, chub_compression)
+    try:
+        rsp = fetch(updated_request)
+        if resource_metrics is not None:
+            result = resource_metrics.parse(parse_response, rsp)
+        else:
+            result = parse_response(rsp)
+    except Exception as exc:
+        if span is not None:
+            span.finish(exc)
+        raise
+    if span is not None:
+        span.finish()
+    return result
 
 
 @coroutine
 def async_fetch(request, method, default_headers=None,
-                callback=None, httpclient=None, **kwargs):
+                callback=None, httpclient=None, chub_retry_policy=None,
+                chub_circuit_breaker=None, chub_hedge_policy=None,
+                chub_rate_limiter=None, chub_priority_scheduler=None,
+                chub_priority=None, chub_metrics=None,
+                chub_resource_template=None, chub_tracer=None,
+                chub_recorder=None, chub_lag_monitor=None,
+                chub_load_balancer=None, chub_adaptive_timeout=None,
+                chub_concurrency_limiter=None, chub_compression=None,
+                chub_auth_provider=None, **kwargs):
     """
     fetch resource using the asynchronous AsyncHTTPClient
     :param request: HTTPRequest object or a url
     :param method: HTTP method in string format, e.g. GET, POST
     :param callback: callback function on the result. it is used
     by the coroutine decorator.
+    :param chub_retry_policy: (optional) a RetryPolicy for transient
+    failures
+    :param chub_circuit_breaker: (optional) a CircuitBreaker
+    :param chub_hedge_policy: (optional) a HedgePolicy for slow requests
+    :param chub_rate_limiter: (optional) a RateLimiter
+    :param chub_priority_scheduler: (optional) a PriorityScheduler
+    :param chub_priority: (optional) the name of the scheduler lane to use
+    :param chub_metrics: (optional) Metrics to record the request in
+    :param chub_resource_template: (optional) the resource template used
+    as the metrics key, e.g. "offers/{id}"
+    :param chub_tracer: (optional) a Tracer to create a span for the request
+    :param chub_recorder: (optional) a Recorder to capture the request in
+    :param chub_lag_monitor: (optional) a LagMonitor to record the time spent
+    building the request and parsing the response in
+    :param chub_load_balancer: (optional) a LoadBalancer choosing the
+    endpoint
+    :param chub_adaptive_timeout: (optional) an AdaptiveTimeout setting the
+    request timeout
+    :param chub_concurrency_limiter: (optional) a ConcurrencyLimiter
+    :param chub_compression: (optional) a Compression gzipping large request
+    bodies
+    :param chub_auth_provider: (optional) an auth provider adding a token to
+    the request, e.g. an oauth2.ClientCredentials
     :param kwargs: query string entities or POST data
+
+    Requests made while a Deadline is active use the time remaining as
+    their timeouts.
     """
-    updated_request = make_request(request, method, default_headers, **kwargs)
+    parse = parse_response
+    if chub_lag_monitor is not None:
+        blocking = chub_lag_monitor.resource(method, request,
+                                             chub_resource_template)
+        updated_request = blocking.make_request(
+            make_request, request, method, default_headers, **kwargs)
+        parse = partial(blocking.parse, parse)
+    else:
+        updated_request = make_request(request, method, default_headers,
+                                       **kwargs)
     if not httpclient:
         httpclient = AsyncHTTPClient()
-    rsp = yield httpclient.fetch(updated_request)
-    raise Return(parse_response(rsp))
+    lane = None
+    if chub_priority_scheduler is not None:
+        lane = chub_priority_scheduler.lane(chub_priority)
+    resource_metrics = None
+    if chub_metrics is not None:
+        resource_metrics = chub_metrics.resource(
+            method, updated_request.url, chub_resource_template)
+    span = None
+    if chub_tracer is not None:
+        span = chub_tracer.request_span(updated_request,
+                                        chub_resource_template)
+    resource_recorder = None
+    if chub_recorder is not None:
+        resource_recorder = chub_recorder.resource(chub_resource_template)
+    resource_timeout = None
+    if chub_adaptive_timeout is not None:
+        resource_timeout = chub_adaptive_timeout.resource(
+            method, updated_request.url, chub_resource_template)
+    resource_breaker = None
+    if chub_circuit_breaker is not None:
+        resource_breaker = chub_circuit_breaker.resource(
+            chub_resource_template)
+    resource_limiter = None
+    if chub_rate_limiter is not None:
+        resource_limiter = chub_rate_limiter.resource(chub_resource_template)
+    resource_hedge = None
+    if chub_hedge_policy is not None:
+        resource_hedge = chub_hedge_policy.resource(chub_resource_template)
+    # the circuit breaker and rate limiter are inside the load balancer, so
+    # that they are keyed by the chosen endpoint, and the span is outside
+    # the hedge, so that its attempts are only counted as retries
+    fetch = wrap_fetch(httpclient.fetch, 'async', current_deadline(),
+                       resource_timeout, resource_recorder,
+                       chub_concurrency_limiter, resource_breaker,
+                       resource_limiter, chub_load_balancer, resource_metrics,
+                       lane, resource_hedge, span, chub_retry_policy,
+                       chub_auth_provider, chub_compression)
+    try:
+        rsp = yield fetch(updated_request)
+        if resource_metrics is not None:
+            result = resource_metrics.parse(parse, rsp)
+        else:
+            result = parse(rsp)
+    except Exception as exc:
+        if span is not None:
+            span.finish(exc)
+        raise
+    if span is not None:
+        span.finish()
+    raise Return(result)
+
+
+def direct_async_fetch(request, method, default_headers=None,
+                       callback=None, httpclient=None, **kwargs):
+    """
+    fetch resource using the asynchronous AsyncHTTPClient, chaining the
+    response to the returned Future with a callback instead of running a
+    coroutine. Requests using layers, such as a chub_retry_policy or
+    chub_metrics, or made while a Deadline is active, are passed to
+    async_fetch.
+    :param request: HTTPRequest object or a url
+    :param method: HTTP method in string format, e.g. GET, POST
+    :param callback: (optional) callback function on the result
+    :param kwargs: async_fetch options, query string entities or POST data
+    :return: a Future resolving to the parsed response
+    """
+    if current_deadline() is not None or any(
+            kwargs.get(name) is not None for name in LAYER_OPTIONS):
+        if callback is not None:
+            kwargs['callback'] = callback
+        return async_fetch(request, method, default_headers,
+                           httpclient=httpclient, **kwargs)
+    for name in LAYER_OPTIONS + ('chub_priority', 'chub_resource_template'):
+        kwargs.pop(name, None)
+
+    result = Future()
+    try:
+        updated_request = make_request(request, method, default_headers,
+                                       **kwargs)
+        if not httpclient:
+            httpclient = AsyncHTTPClient()
+        response = httpclient.fetch(updated_request)
+    except Exception:
+        result.set_exc_info(sys.exc_info())
+    else:
+        def parse(future):
+            try:
+                result.set_result(parse_response(future.result()))
+            except Exception:
+                result.set_exc_info(sys.exc_info())
+        response.add_done_callback(parse)
+    if callback is not None:
+        IOLoop.current().add_future(
+            result, lambda future: callback(future.result()))
+    return result
 
 
-def make_fetch_func(base_url, async, **kwargs):
+def make_fetch_func(base_url, async, retry_policy=None,
+                    circuit_breaker=None, hedge_policy=None,
+                    rate_limiter=None, priority_scheduler=None,
+                    metrics=None, tracer=None, transport=None,
+                    recorder=None, lag_monitor=None, resolver=None,
+                    connection_pool=None, load_balancer=None,
+                    adaptive_timeout=None, concurrency_limiter=None,
+                    compression=None, auth_provider=None, **kwargs):
     """
     make a fetch function based on conditions of
     1) async
     2) ssl
+    The async fetch function only runs a coroutine for requests using
+    layers, e.g. a retry_policy
+    :param retry_policy: (optional) a RetryPolicy used by default for
+    requests made with the fetch function
+    :param circuit_breaker: (optional) a CircuitBreaker used by default for
+    requests made with the fetch function
+    :param hedge_policy: (optional) a HedgePolicy used by default for
+    requests made with the fetch function. Only supported if async
+    :param rate_limiter: (optional) a RateLimiter used by default for
+    requests made with the fetch function
+    :param priority_scheduler: (optional) a PriorityScheduler used by
+    default for requests made with the fetch function. Only supported if
+    async
+    :param metrics: (optional) Metrics to record requests made with the
+    fetch function in
+    :param tracer: (optional) a Tracer to create spans for requests made
+    with the fetch function
+    :param transport: (optional) a Transport used to send requests instead
+    of opening connections, e.g. a LoopbackTransport
+    :param recorder: (optional) a Recorder to capture requests made with
+    the fetch function in
+    :param lag_monitor: (optional) a LagMonitor to attribute IOLoop lag to
+    requests made with the fetch function. Only supported if async
+    :param resolver: (optional) a Resolver used by the client to look up
+    hostnames, e.g. a CachingResolver. Only supported if async
+    :param connection_pool: (optional) a ConnectionPool the client keeps
+    connections open in between requests. Only supported if async
+    :param load_balancer: (optional) a LoadBalancer spreading requests made
+    with the fetch function across endpoints
+    :param adaptive_timeout: (optional) an AdaptiveTimeout setting the
+    timeout of requests made with the fetch function
+    :param concurrency_limiter: (optional) a ConcurrencyLimiter adapting
+    the number of requests made with the fetch function in flight to each
+    host. Only supported if async
+    :param compression: (optional) a Compression gzipping large bodies of
+    requests made with the fetch function
+    :param auth_provider: (optional) an auth provider adding a token to
+    requests made with the fetch function, e.g. an
+    oauth2.ClientCredentials
     """
     if async:
-        client = AsyncHTTPClient(force_instance=True, defaults=kwargs)
-        return partial(async_fetch, httpclient=client)
+        if transport is not None:
+            client = transport.async_client(defaults=kwargs)
+        else:
+            client_class = AsyncHTTPClient
+            options = {}
+            if resolver is not None:
+                options['resolver'] = resolver
+            if connection_pool is not None:
+                client_class = KeepAliveHTTPClient
+                options['pool'] = connection_pool
+            client = client_class(force_instance=True, defaults=kwargs,
+                                  **options)
+        return partial(direct_async_fetch, httpclient=client,
+                       chub_retry_policy=retry_policy,
+                       chub_circuit_breaker=circuit_breaker,
+                       chub_hedge_policy=hedge_policy,
+                       chub_rate_limiter=rate_limiter,
+                       chub_priority_scheduler=priority_scheduler,
+                       chub_metrics=metrics, chub_tracer=tracer,
+                       chub_recorder=recorder, chub_lag_monitor=lag_monitor,
+                       chub_load_balancer=load_balancer,
+                       chub_adaptive_timeout=adaptive_timeout,
+                       chub_concurrency_limiter=concurrency_limiter,
+                       chub_compression=compression,
+                       chub_auth_provider=auth_provider)
     else:
-        client = HTTPClient(force_instance=True, defaults=kwargs)
-        return partial(sync_fetch, httpclient=client)
+        if hedge_policy is not None:
+            raise ValueError('hedge_policy requires an async client')
+        if priority_scheduler is not None:
+            raise ValueError('priority_scheduler requires an async client')
+        if lag_monitor is not None:
+            raise ValueError('lag_monitor requires an async client')
+        if resolver is not None:
+            raise ValueError('resolver requires an async client')
+        if connection_pool is not None:
+            raise ValueError('connection_pool requires an async client')
+        if concurrency_limiter is not None:
+            raise ValueError('concurrency_limiter requires an async client')
+        if transport is not None:
+            client = transport.sync_client(defaults=kwargs)
+        else:
+            client = HTTPClient(force_instance=True, defaults=kwargs)
+        return partial(sync_fetch, httpclient=client,
+                       chub_retry_policy=retry_policy,
+                       chub_circuit_breaker=circuit_breaker,
+                       chub_rate_limiter=rate_limiter,
+                       chub_metrics=metrics, chub_tracer=tracer,
+                       chub_recorder=recorder,
+                       chub_load_balancer=load_balancer,
+                       chub_adaptive_timeout=adaptive_timeout,
+                       chub_compression=compression,
+                       chub_auth_provider=auth_provider)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a policy for hedging slow requests with a second request
+"""
+import copy
+import logging
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
+
+from .deadline import current_deadline
+from .metrics import Metrics
+from .retry import RetryBudget
+from .stats import RollingWindows
+
+
+class _ResourceHedge(object):
+    """Hedge requests to a resource template"""
+    def __init__(self, policy, template):
+        self.policy = policy
+        self.template = template
+
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function, hedging slow requests
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        return self.policy._hedged_call(fetch, request, self.template,
+                                        kwargs)
+
+
+class HedgePolicy(object):
+    """
+    Send a second, identical request if the first one has not completed
+    within a delay, and use whichever response arrives first.
+
+    The delay is either fixed or the observed percentile of the latency of
+    the method and resource template, e.g. "GET offers/{id}". Hedging is
+    limited to max_ratio of requests so that the extra load on the service
+    is bounded. Only the asynchronous client supports hedging.
+
+    Tornado's HTTP client can't abort a request in flight, so the slower
+    request is left to complete and its result discarded.
+
+    Example Usage:
+        >>> api = API('https://localhost:8004',
+                      hedge_policy=HedgePolicy(delay=0.05, percentile=95))
+        >>> offer = yield api.offers['1234'].get()
+    """
+    def __init__(self, delay=0.1, percentile=None, min_samples=20,
+                 max_ratio=0.05, methods=('GET', 'HEAD'), window=200):
+        """
+        :param delay: seconds to wait before hedging, used until there are
+            min_samples latencies for the resource if percentile is set
+        :param percentile: (optional) hedge after this percentile of the
+            observed latency of the resource, e.g. 95
+        :param min_samples: the number of latencies needed to use the
+            percentile
+        :param max_ratio: the maximum ratio of hedged requests
+        :param methods: HTTP methods that can be hedged
+        :param window: the number of latencies kept for each resource
+        """
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.methods = frozenset(m.upper() for m in methods)
+        self.budget = RetryBudget(ratio=max_ratio, reserve=1)
+        self.latencies = RollingWindows(window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @staticmethod
+    def key(method, url, template=None):
+        """
+        get the key used to track latency for a request
+        :param method: the HTTP method
+        :param url: the request url, used if there is no template
+        :param template: (optional) the resource template, so that requests
+            for different entities share their latencies
+        """
+        return Metrics.key(method, url, template)
+
+    def hedge_delay(self, key):
+        """
+        the number of seconds to wait before hedging a request
+        :param key: the resource key
+        """
+        if self.percentile is not None and key in self.latencies:
+            window = self.latencies[key]
+            if len(window) >= self.min_samples:
+                return window.percentile(self.percentile)
+        return self.delay
+
+    def _fetch(self, fetch, request, key, **kwargs):
+        io_loop = IOLoop.current()
+        start = io_loop.time()
+        future = fetch(request, **kwargs)
+
+        def record(f):
+            if f.exception() is None:
+                self.latencies[key].add(io_loop.time() - start)
+        future.add_done_callback(record)
+        return future
+
+    @staticmethod
+    def _copy_request(request):
+        hedge = copy.copy(request)
+        hedge.headers = HTTPHeaders(request.headers)
+        return hedge
+
+    def resource(self, template=None):
+        """
+        get an object hedging requests to a resource
+        :param template: (optional) the resource template, e.g.
+            "offers/{id}"
+        """
+        return _ResourceHedge(self, template)
+
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function, hedging slow requests
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        return self._hedged_call(fetch, request, None, kwargs)
+
+    @coroutine
+    def _hedged_call(self, fetch, request, template, kwargs):
+        """
+        call an asynchronous fetch function, hedging slow requests
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        :param template: the resource template, or None to use the path
+        :param kwargs: the keyword arguments for the fetch function
+        """
+        if request.method.upper() not in self.methods:
+            response = yield fetch(request, **kwargs)
+            raise Return(response)
+
+        self.requests += 1
+        self.budget.deposit()
+        key = self.key(request.method, request.url, template)
+        io_loop = IOLoop.current()
+        result = Future()
+        pending = []
+
+        def on_done(future):
+            pending.remove(future)
+            if result.done():
+                # consume the loser's exception so it isn't logged
+                future.exception()
+                return
+            if future.exception() is not None and pending:
+                return
+            if future is not first:
+                self.hedge_wins += 1
+            if timeout is not None:
+                io_loop.remove_timeout(timeout)
+            if future.exception() is not None:
+                result.set_exc_info(future.exc_info())
+            else:
+                result.set_result(future.result())
+
+        def hedge():
+            if result.done() or not self.budget.withdraw():
+                return
+            self.hedges += 1
+            logging.debug('Hedging %s request to %s',
+                          request.method, request.url)
+            second = self._fetch(fetch, self._copy_request(request),
+                                 key, **kwargs)
+            pending.append(second)
+            second.add_done_callback(on_done)
+
+        first = self._fetch(fetch, request, key, **kwargs)
+        pending.append(first)
+        delay = self.hedge_delay(key)
+        deadline = current_deadline()
+        timeout = None
+        # don't wait to hedge past the deadline, the first request fails
+        # with DeadlineExceeded by then
+        if deadline is None or delay < deadline.remaining():
+            timeout = io_loop.call_later(delay, hedge)
+        first.add_done_callback(on_done)
+
+        response = yield result
+        raise Return(response)
+
+    def stats(self):
+        """
+        get the hedging counters
+        """
+        return {'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins}
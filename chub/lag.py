@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a monitor for IOLoop lag, which attributes blocking to the
+chub operations run on the IOLoop
+"""
+import logging
+import time
+from collections import defaultdict, deque
+
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+
+from .metrics import Histogram, Metrics
+
+
+class _ResourceLag(object):
+    """Time the blocking operations for a request to a resource"""
+    def __init__(self, monitor, key):
+        self.monitor = monitor
+        self.key = key
+
+    def make_request(self, make_request, request, method, *args, **kwargs):
+        """
+        call make_request and record how long it blocks
+        :param make_request: the make_request function
+        """
+        start = self.monitor._now()
+        result = make_request(request, method, *args, **kwargs)
+        self.monitor.record('make_request', self.key, len(result.body or ''),
+                            self.monitor._now() - start)
+        return result
+
+    def parse(self, parse, response):
+        """
+        call a parse function and record how long it blocks
+        :param parse: the parse function, e.g. parse_response
+        :param response: the HTTPResponse
+        """
+        start = self.monitor._now()
+        try:
+            return parse(response)
+        finally:
+            self.monitor.record('parse_response', self.key,
+                                len(response.body or ''),
+                                self.monitor._now() - start)
+
+
+class LagMonitor(object):
+    """
+    Measure how late the IOLoop runs a callback scheduled every interval.
+    The lag is how long other callbacks, such as building requests and
+    parsing large responses, blocked the IOLoop.
+
+    The time taken by make_request and parse_response is recorded for each
+    request made with the API, so when the lag is over the threshold the
+    longest chub operation since the previous check is logged with the
+    resource and payload size. If there isn't one the blocking was caused by
+    other code.
+
+    The monitor is started by the first request, or by calling start.
+
+    Example Usage:
+        >>> monitor = LagMonitor(threshold=0.05)
+        >>> api = API('https://localhost:8004', lag_monitor=monitor)
+        >>> monitor.stats()['lag']['p99']
+        0.0012
+        >>> monitor.events[-1]
+        {'lag': 0.31, 'operation': 'parse_response',
+         'resource': 'GET repositories/{id}/assets', 'size': 20971520,
+         'duration': 0.3, 'time': 1460000000.0}
+    """
+    def __init__(self, interval=0.05, threshold=0.1, max_events=100,
+                 io_loop=None):
+        """
+        :param interval: the number of seconds between checks
+        :param threshold: log lag and blocking operations longer than this
+            many seconds
+        :param max_events: the number of recent slow events to keep
+        :param io_loop: (optional) the IOLoop, by default the current IOLoop
+            when the monitor is started
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.io_loop = io_loop
+        self.lag = Histogram(scale=1000000)
+        self.blocking = defaultdict(lambda: Histogram(scale=1000000))
+        self.events = deque(maxlen=max_events)
+        self.slow_events = 0
+        self._operations = []
+        self._expected = None
+        self._timeout = None
+
+    _now = staticmethod(time.time)
+
+    @property
+    def running(self):
+        return self._timeout is not None
+
+    def start(self):
+        """Start checking the IOLoop lag"""
+        if self.running:
+            return
+        if self.io_loop is None:
+            self.io_loop = IOLoop.current()
+        self._schedule()
+
+    def stop(self):
+        """Stop checking the IOLoop lag"""
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _schedule(self):
+        self._expected = self.io_loop.time() + self.interval
+        self._timeout = self.io_loop.call_at(self._expected, self._check)
+
+    def _check(self):
+        self.check(max(0, self.io_loop.time() - self._expected))
+        self._schedule()
+
+    def check(self, lag):
+        """
+        record the lag and log an event if it is over the threshold
+        :param lag: the number of seconds the check was late
+        """
+        operations, self._operations = self._operations, []
+        self.lag.record(lag)
+        if lag < self.threshold:
+            return
+
+        self.slow_events += 1
+        event = {'time': self._now(), 'lag': lag, 'operation': None,
+                 'resource': None, 'size': None, 'duration': None}
+        if operations:
+            operation, key, size, duration = max(operations,
+                                                 key=lambda op: op[3])
+            event.update(operation=operation, resource=key, size=size,
+                         duration=duration)
+            logging.warning('IOLoop blocked for %.3fs, %s for %s took '
+                            '%.3fs with %d bytes', lag, operation, key,
+                            duration, size)
+        else:
+            logging.warning('IOLoop blocked for %.3fs outside chub', lag)
+        self.events.append(event)
+
+    def resource(self, method, request, template=None):
+        """
+        get an object timing the blocking operations of a request
+        :param method: the HTTP method
+        :param request: an HTTPRequest or url
+        :param template: (optional) the resource template
+        """
+        self.start()
+        url = request.url if isinstance(request, HTTPRequest) else request
+        return _ResourceLag(self, Metrics.key(method, url, template))
+
+    def record(self, operation, key, size, duration):
+        """
+        record a blocking operation
+        :param operation: the operation, e.g. "parse_response"
+        :param key: the method and resource template
+        :param size: the payload size in bytes
+        :param duration: the number of seconds it took
+        """
+        self.blocking[(operation, key)].record(duration)
+        if self.running:
+            self._operations.append((operation, key, size, duration))
+
+    def stats(self):
+        """
+        get the lag histogram, the time blocked by each operation and
+        resource, and the number of slow events
+        """
+        blocking = defaultdict(dict)
+        for (operation, key), histogram in self.blocking.items():
+            blocking[key][operation] = histogram.snapshot()
+        return {'lag': self.lag.snapshot(),
+                'blocking': dict(blocking),
+                'slow_events': self.slow_events}
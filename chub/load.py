@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+generate load with the chub client, making resource calls in the same
+way as applications do
+
+Keep 20 requests in flight for a minute, with three offer lookups for each
+page of assets:
+    python -m chub.load https://localhost:8004 \
+        --call 'repository.offers[{id}].get=3' \
+        --call 'repository.repositories[{repo}].assets.get?page_size=100' \
+        --var id=1,2,3 --var repo=abc --concurrency 20 --duration 60
+
+Or send 200 requests per second, with the calls in a JSON scenario file:
+    python -m chub.load https://localhost:8004 --scenario scenario.json \
+        --rate 200
+
+A scenario file is a list of calls, e.g.
+    [{"call": "repository.offers[{id}].get", "weight": 3},
+     {"call": "onboarding.repositories[{repo}].assets.post",
+      "params": {"body": "...", "headers": {"Content-Type": "text/csv"}}}]
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import string
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from urlparse import parse_qsl
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.ioloop import IOLoop
+
+from .api import API, HTTP_METHODS, Resource
+from .metrics import Histogram
+
+CALL_RE = re.compile(r'([A-Za-z_][\w-]*)|\[([^\]]*)\]|(\.)')
+_formatter = string.Formatter()
+
+
+def parse_call(expression):
+    """
+    parse a resource call, e.g. "repository.offers[{id}].get?page=1"
+    :param expression: the resource call
+    :return: a tuple of the path steps, the HTTP method and the query
+        parameters. A step is ('attr', name) or ('item', template)
+    """
+    path, _, query = expression.partition('?')
+    steps = []
+    position = 0
+    while position < len(path):
+        match = CALL_RE.match(path, position)
+        if not match:
+            raise ValueError('Invalid call "{}"'.format(expression))
+        name, item, _ = match.groups()
+        if name is not None:
+            steps.append(('attr', name))
+        elif item is not None:
+            steps.append(('item', item))
+        position = match.end()
+    if not steps or steps[-1][0] != 'attr' or \
+            steps[-1][1].upper() not in HTTP_METHODS:
+        raise ValueError('Call "{}" must end with an HTTP method, e.g. '
+                         '.get'.format(expression))
+    return steps[:-1], steps[-1][1], dict(parse_qsl(query))
+
+
+class Call(object):
+    """
+    A weighted resource call in a scenario
+    """
+    def __init__(self, expression, weight=1, params=None):
+        """
+        :param expression: the resource call, e.g. "offers[{id}].get"
+        :param weight: the relative number of times to make the call
+        :param params: (optional) keyword arguments for the call, e.g. a
+            POST body
+        """
+        self.expression = expression
+        self.weight = weight
+        self.params = params or {}
+        self.steps, self.method, query = parse_call(expression)
+        self.params.update(query)
+
+    def __call__(self, api, variables, rng):
+        """
+        make the call
+        :param api: an API instance
+        :param variables: a dictionary of lists of values for placeholders
+        :param rng: a random.Random used to choose the values
+        :return: a Future
+        """
+        values = _Values(variables, rng)
+        resource = api
+        for kind, value in self.steps:
+            if kind == 'attr':
+                resource = getattr(resource, value)
+                continue
+            entity_id = _formatter.vformat(value, (), values)
+            if values.generated.intersection(
+                    name for _, name, _, _ in _formatter.parse(value)):
+                # don't keep a resource for each random ID in the API's
+                # resource map for the length of the run
+                resource = _uncached(resource)
+            resource = resource[entity_id]
+        return getattr(resource, self.method)(**self.params)
+
+
+def _uncached(resource):
+    """copy a resource, keeping its sub resources in a new resource map"""
+    return Resource(resource.path, resource.fetch, {},
+                    default_headers=resource.default_headers,
+                    priority=resource.priority, template=resource.template)
+
+
+class _Values(dict):
+    """Choose a value for each placeholder"""
+    def __init__(self, variables, rng):
+        super(_Values, self).__init__()
+        self.variables = variables
+        self.rng = rng
+        self.generated = set()
+
+    def __missing__(self, key):
+        if key in self.variables:
+            value = self.rng.choice(self.variables[key])
+        else:
+            value = uuid.UUID(int=self.rng.getrandbits(128)).hex
+            self.generated.add(key)
+        self[key] = value
+        return value
+
+
+class Scenario(object):
+    """
+    A weighted mix of resource calls
+    """
+    def __init__(self, calls, variables=None, seed=None):
+        """
+        :param calls: a list of Call objects
+        :param variables: (optional) a dictionary of lists of values for
+            placeholders such as {id}. Placeholders without values get
+            random hex IDs
+        :param seed: (optional) a seed for the random number generator
+        """
+        if not calls:
+            raise ValueError('A scenario needs at least one call')
+        self.calls = calls
+        self.variables = variables or {}
+        self.random = random.Random(seed)
+        self._total = float(sum(call.weight for call in calls))
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        load the calls from a JSON file
+        :param path: the path of the file
+        """
+        with open(path) as f:
+            calls = [Call(item['call'], item.get('weight', 1),
+                          item.get('params'))
+                     for item in json.load(f)]
+        return cls(calls, **kwargs)
+
+    def choose(self):
+        """choose a call at random by weight"""
+        value = self.random.random() * self._total
+        for call in self.calls:
+            value -= call.weight
+            if value < 0:
+                return call
+        return self.calls[-1]
+
+
+class _Results(object):
+    """Latencies and outcomes of calls"""
+    def __init__(self):
+        self.latency = Histogram(scale=1000000)
+        self.calls = defaultdict(lambda: Histogram(scale=1000000))
+        self.outcomes = defaultdict(int)
+
+    def record(self, call, latency, outcome):
+        self.latency.record(latency)
+        self.calls[call.expression].record(latency)
+        self.outcomes[outcome] += 1
+
+    def summary(self, elapsed):
+        errors = sum(count for outcome, count in self.outcomes.items()
+                     if outcome != 'ok')
+        return {'requests': self.latency.count,
+                'elapsed': elapsed,
+                'throughput': self.latency.count / elapsed
+                if elapsed else None,
+                'errors': errors,
+                'outcomes': dict(self.outcomes),
+                'latency': self.latency.snapshot(),
+                'calls': {expression: histogram.snapshot()
+                          for expression, histogram in self.calls.items()}}
+
+
+def _outcome(error):
+    if error is None:
+        return 'ok'
+    if isinstance(error, HTTPError):
+        return error.code
+    return type(error).__name__
+
+
+class LoadGenerator(object):
+    """
+    Make the calls in a scenario with an async API, either keeping a number
+    of calls in flight or starting calls at a fixed rate, and report the
+    throughput, latency percentiles and errors as it goes.
+
+    Example Usage:
+        >>> scenario = Scenario([Call('repository.offers[{id}].get')],
+                                variables={'id': ['1', '2']})
+        >>> generator = LoadGenerator(API('https://localhost:8004'),
+                                      scenario, concurrency=20, duration=60)
+        >>> summary = IOLoop.current().run_sync(generator.run)
+    """
+    def __init__(self, api, scenario, concurrency=None, rate=None,
+                 duration=60, interval=1, report=None, max_in_flight=1000):
+        """
+        :param api: an async API
+        :param scenario: the Scenario
+        :param concurrency: the number of calls to keep in flight
+        :param rate: the number of calls to start each second, instead of
+            keeping a number in flight
+        :param duration: the number of seconds to generate load for
+        :param interval: the number of seconds between reports
+        :param report: (optional) a function called with the summary of
+            each interval, by default logging it
+        :param max_in_flight: the maximum calls in flight with a rate,
+            calls that would exceed it are counted as "dropped"
+        """
+        if (concurrency is None) == (rate is None):
+            raise ValueError('Either concurrency or rate is required')
+        self.api = api
+        self.scenario = scenario
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.interval = interval
+        self.report = report or log_report
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.total = _Results()
+        self._interval = _Results()
+        self._deadline = None
+        # resolved when the last call in flight completes
+        self._idle = None
+
+    _now = staticmethod(time.time)
+
+    @coroutine
+    def _call(self):
+        call = self.scenario.choose()
+        self.in_flight += 1
+        start = self._now()
+        error = None
+        try:
+            yield call(self.api, self.scenario.variables,
+                       self.scenario.random)
+        except Exception as exc:
+            error = exc
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight and self._idle is not None:
+                self._idle.set_result(None)
+                self._idle = None
+        latency = self._now() - start
+        outcome = _outcome(error)
+        self.total.record(call, latency, outcome)
+        self._interval.record(call, latency, outcome)
+
+    @coroutine
+    def _worker(self):
+        while self._now() < self._deadline:
+            yield self._call()
+
+    @coroutine
+    def _arrivals(self):
+        start = self._now()
+        started = 0
+        while self._now() < self._deadline:
+            due = start + started / float(self.rate)
+            if due > self._now():
+                yield gen.sleep(due - self._now())
+                continue
+            started += 1
+            if self.in_flight >= self.max_in_flight:
+                self.total.outcomes['dropped'] += 1
+                self._interval.outcomes['dropped'] += 1
+                continue
+            # only the number of calls in flight is kept, not their
+            # futures, so memory doesn't grow with rate and duration
+            self._call()
+        if self.in_flight:
+            self._idle = Future()
+            yield self._idle
+
+    @coroutine
+    def _reporter(self, done):
+        last = self._now()
+        while not done.done():
+            yield _wait(done, self.interval)
+            now = self._now()
+            interval, self._interval = self._interval, _Results()
+            summary = interval.summary(now - last)
+            summary['in_flight'] = self.in_flight
+            self.report(summary)
+            last = now
+
+    @coroutine
+    def run(self):
+        """
+        generate load for the duration
+        :return: a summary of all the calls
+        """
+        start = self._now()
+        self._deadline = start + self.duration
+        if self.concurrency is not None:
+            done = gen.multi_future([self._worker()
+                                     for _ in range(self.concurrency)])
+        else:
+            done = self._arrivals()
+        if self.interval:
+            yield [done, self._reporter(done)]
+        else:
+            yield done
+        raise Return(self.total.summary(self._now() - start))
+
+
+@coroutine
+def _wait(future, timeout):
+    """wait for a future to finish or a timeout, whichever is first"""
+    try:
+        yield gen.with_timeout(timedelta(seconds=timeout), future)
+    except gen.TimeoutError:
+        pass
+
+
+def log_report(summary):
+    """log the summary of an interval on one line"""
+    latency = summary['latency']
+    errors = ', '.join('{}: {}'.format(outcome, count)
+                       for outcome, count in sorted(summary['outcomes'].items())
+                       if outcome != 'ok')
+    logging.info('%6.1f req/s  p50 %7.1fms  p99 %7.1fms  in flight %4d  '
+                 'errors %d%s',
+                 summary['throughput'] or 0,
+                 1000 * (latency['p50'] or 0),
+                 1000 * (latency['p99'] or 0),
+                 summary['in_flight'], summary['errors'],
+                 ' ({})'.format(errors) if errors else '')
+
+
+def _parse_var(value):
+    name, _, values = value.partition('=')
+    return name, values.split(',')
+
+
+def _parse_call(value):
+    """parse a call with an optional weight, e.g. offers.get?page=1=3"""
+    expression, _, weight = value.rpartition('=')
+    query = expression.partition('?')[2]
+    if (not expression or not weight.replace('.', '', 1).isdigit() or
+            ('?' in expression and '=' not in query)):
+        return Call(value)
+    return Call(expression, float(weight))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base_url', help='e.g. https://localhost:8004')
+    parser.add_argument('--call', action='append', default=[],
+                        help='a resource call, optionally with a weight, '
+                             'e.g. "offers[{id}].get=3"')
+    parser.add_argument('--scenario', help='a JSON scenario file')
+    parser.add_argument('--var', action='append', default=[],
+                        help='comma separated values for a placeholder, '
+                             'e.g. "id=1,2,3"')
+    parser.add_argument('--concurrency', type=int,
+                        help='the number of calls to keep in flight')
+    parser.add_argument('--rate', type=float,
+                        help='the number of calls to start each second')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--interval', type=float, default=1,
+                        help='seconds between reports, 0 for none')
+    parser.add_argument('--token', help='a bearer token')
+    parser.add_argument('--api-version', default='v1')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help='file to write the summary to')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    if args.concurrency is None and args.rate is None:
+        args.concurrency = 10
+    variables = dict(_parse_var(value) for value in args.var)
+    try:
+        if args.scenario:
+            scenario = Scenario.from_file(args.scenario, variables=variables,
+                                          seed=args.seed)
+        else:
+            scenario = Scenario([_parse_call(value) for value in args.call],
+                                variables=variables, seed=args.seed)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    # let every call be in flight rather than queued in the client
+    AsyncHTTPClient.configure(None, max_clients=args.concurrency or 1000)
+    api = API(args.base_url, api_version=args.api_version, token=args.token)
+    generator = LoadGenerator(api, scenario, concurrency=args.concurrency,
+                              rate=args.rate, duration=args.duration,
+                              interval=args.interval)
+    summary = IOLoop.current().run_sync(generator.run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    else:
+        json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
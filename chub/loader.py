@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a loader that merges lookups of items in a collection into
+batched requests
+"""
+import logging
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, maybe_future, multi_future, Return
+from tornado.httpclient import HTTPError
+from tornado.ioloop import IOLoop
+
+# statuses meaning the batch endpoint isn't supported by the service
+UNSUPPORTED_STATUSES = {404, 405, 501}
+
+
+def _data(response):
+    """get the data from a response, e.g. {"status": 200, "data": {}}"""
+    if isinstance(response, dict) and 'data' in response:
+        return response['data']
+    return response
+
+
+class Loader(object):
+    """
+    Collect lookups of items in a collection made in the same IOLoop
+    iteration, or within a time window, and fetch them with one request to
+    a batch endpoint. Each key is fetched once, and the result is
+    remembered, so a loader should be created for each incoming request
+    rather than shared between them.
+
+    Without a batch endpoint, or if the service doesn't support it, the
+    items are fetched with a GET request each, made in parallel.
+
+    Example Usage:
+        >>> assets = api.repository.repositories['1234'].assets
+        >>> loader = assets.loader(batch='ids')
+        >>> first, second = yield [loader.load('a1'), loader.load('a2')]
+
+    This makes one request, POST repositories/1234/assets/ids with the body
+    {"ids": ["a1", "a2"]}, and picks the items out of the response data by
+    their "id". A function may be used for other batch endpoints:
+        >>> @coroutine
+            def search(ids):
+                response = yield api.query.search.post(ids=ids)
+                raise Return({item['key']: item for item in response.data})
+        >>> loader = assets.loader(batch=search)
+    """
+    def __init__(self, resource, batch=None, key='id', window=0,
+                 max_batch=100, io_loop=None):
+        """
+        :param resource: the collection Resource, e.g. api.offers
+        :param batch: (optional) the name of a sub resource to POST the ids
+            to, or a function taking a list of keys and returning a Future
+            resolving to a dictionary of items by key
+        :param key: the field of the items in a batch response with the key
+        :param window: the number of seconds to collect lookups for, by
+            default lookups made in the same IOLoop iteration are batched
+        :param max_batch: the maximum number of keys in a batch request
+        :param io_loop: (optional) the IOLoop
+        """
+        self.resource = resource
+        self.batch = batch
+        self.key = key
+        self.window = window
+        self.max_batch = max_batch
+        self.io_loop = io_loop or IOLoop.current()
+        self._memo = {}
+        self._pending = []
+        self._scheduled = False
+        self.loads = 0
+        self.memo_hits = 0
+        self.batches = 0
+        self.fallbacks = 0
+
+    def load(self, key):
+        """
+        get an item
+        :param key: the key of the item, e.g. an ID
+        :return: a Future resolving to the item
+        """
+        self.loads += 1
+        if key in self._memo:
+            self.memo_hits += 1
+            return self._memo[key]
+        future = Future()
+        self._memo[key] = future
+        self._pending.append((key, future))
+        if not self._scheduled:
+            self._scheduled = True
+            if self.window:
+                self.io_loop.call_later(self.window, self._dispatch)
+            else:
+                self.io_loop.add_callback(self._dispatch)
+        return future
+
+    def load_many(self, keys):
+        """
+        get several items
+        :param keys: the keys of the items
+        :return: a Future resolving to a list of items
+        """
+        return multi_future([self.load(key) for key in keys])
+
+    def prime(self, key, value):
+        """
+        remember an item, e.g. one fetched by another request
+        """
+        if key not in self._memo:
+            future = Future()
+            future.set_result(value)
+            self._memo[key] = future
+
+    def clear(self, key=None):
+        """
+        forget a remembered item, or all of them, e.g. after changing it
+        :param key: (optional) the key of the item
+        """
+        if key is None:
+            self._memo = {}
+        else:
+            self._memo.pop(key, None)
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, []
+        self._scheduled = False
+        for start in range(0, len(pending), self.max_batch):
+            keys, futures = zip(*pending[start:start + self.max_batch])
+            self._load_batch(list(keys), futures)
+
+    @coroutine
+    def _fetch_batch(self, keys):
+        if callable(self.batch):
+            items = yield maybe_future(self.batch(keys))
+        else:
+            response = yield getattr(self.resource, self.batch).post(ids=keys)
+            items = {item[self.key]: item for item in _data(response)}
+        raise Return(items)
+
+    @coroutine
+    def _load_batch(self, keys, futures):
+        if self.batch is not None:
+            self.batches += 1
+            try:
+                items = yield self._fetch_batch(keys)
+            except HTTPError as exc:
+                if exc.code not in UNSUPPORTED_STATUSES:
+                    self._fail(keys, futures, exc)
+                    return
+                logging.info('Batch endpoint not supported, fetching items '
+                             'one at a time: %s', exc)
+                self.batch = None
+            except Exception as exc:
+                self._fail(keys, futures, exc)
+                return
+            else:
+                for key, future in zip(keys, futures):
+                    if key in items:
+                        future.set_result(items[key])
+                    else:
+                        self._fail([key], [future], HTTPError(
+                            404, 'Not found in batch response'))
+                return
+
+        self.fallbacks += 1
+        for key, future in zip(keys, futures):
+            self._load_one(key, future)
+
+    @coroutine
+    def _load_one(self, key, future):
+        try:
+            response = yield self.resource[key].get()
+        except Exception as exc:
+            self._fail([key], [future], exc)
+        else:
+            future.set_result(_data(response))
+
+    def _fail(self, keys, futures, error):
+        # errors aren't remembered, so the item can be loaded again
+        for key, future in zip(keys, futures):
+            if self._memo.get(key) is future:
+                del self._memo[key]
+            future.set_exception(error)
+
+    def stats(self):
+        """
+        get the number of loads, remembered results, batch requests and
+        fallbacks to single requests
+        """
+        return {'loads': self.loads,
+                'memo_hits': self.memo_hits,
+                'batches': self.batches,
+                'fallbacks': self.fallbacks}
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has per-request timing metrics and latency histograms
+"""
+import time
+from collections import defaultdict
+from urlparse import urlparse
+
+from tornado.gen import coroutine, Return
+from tornado.httpclient import HTTPError
+
+# (metric name, time_info key, time_info key it is measured from)
+# see http://curl.haxx.se/libcurl/c/curl_easy_getinfo.html
+TIME_INFO = (('queue', 'queue', None),
+             ('dns', 'namelookup', None),
+             ('connect', 'connect', 'namelookup'),
+             ('tls', 'appconnect', 'connect'),
+             ('ttfb', 'starttransfer', None))
+TIMINGS = ('total',) + tuple(name for name, _, _ in TIME_INFO) + ('parse',)
+SIZES = ('bytes_in', 'bytes_out')
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram(object):
+    """
+    A histogram with log-linear buckets, in the style of an HDR histogram.
+
+    Each power of two range of values is split into `precision` linear
+    buckets, so recorded values keep a relative precision of about
+    1 / precision while using little memory.
+    """
+    def __init__(self, precision=32, scale=1):
+        """
+        :param precision: the number of buckets for each power of two
+        :param scale: multiply values by this before bucketing them, e.g.
+            1000000 for seconds with microsecond resolution
+        """
+        self.precision = precision
+        self.scale = scale
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._buckets = defaultdict(int)
+
+    def _index(self, value):
+        if value < self.precision:
+            return value
+        exponent = value.bit_length() - 1
+        offset = ((value - (1 << exponent)) * self.precision) >> exponent
+        return (exponent << 16) | offset
+
+    def _upper(self, index):
+        if index < self.precision:
+            return index
+        exponent, offset = index >> 16, index & 0xffff
+        # the largest value whose offset in _index is this one, rounding up
+        # so that it is right for any precision, not just powers of two
+        width = -(-((offset + 1) << exponent) // self.precision)
+        return (1 << exponent) + width - 1
+
+    def record(self, value):
+        """
+        record a value
+        :param value: a non-negative number
+        """
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self._buckets[self._index(int(value * self.scale))] += 1
+
+    def percentile(self, pct):
+        """
+        get a percentile of the recorded values
+        :param pct: the percentile, between 0 and 100
+        :return: the percentile, or None if no values have been recorded
+        """
+        if not self.count:
+            return None
+        threshold = pct / 100.0 * self.count
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= threshold:
+                break
+        value = float(self._upper(index)) / self.scale
+        return min(max(value, self.min), self.max)
+
+    def snapshot(self):
+        """
+        get a summary of the recorded values
+        """
+        snapshot = {'count': self.count,
+                    'sum': self.total,
+                    'min': self.min,
+                    'max': self.max,
+                    'mean': float(self.total) / self.count
+                    if self.count else None}
+        for quantile in QUANTILES:
+            snapshot['p{:g}'.format(quantile * 100)] = self.percentile(
+                quantile * 100)
+        return snapshot
+
+
+class ResourceMetrics(object):
+    """
+    The metrics for requests with the same method and resource template,
+    e.g. "GET offers/{id}"
+    """
+    def __init__(self, key, precision=32):
+        """
+        :param key: the method and resource template
+        :param precision: the precision of the histograms
+        """
+        self.key = key
+        self.timings = {name: Histogram(precision, scale=1000000)
+                        for name in TIMINGS}
+        self.sizes = {name: Histogram(precision) for name in SIZES}
+        self.statuses = defaultdict(int)
+
+    def _record_response(self, request, response, duration):
+        self.timings['total'].record(duration)
+        self.sizes['bytes_out'].record(len(request.body or ''))
+        if response is None:
+            return
+        self.sizes['bytes_in'].record(len(response.body or ''))
+        time_info = response.time_info
+        for name, key, since in TIME_INFO:
+            if key in time_info:
+                value = time_info[key]
+                if since is not None:
+                    value -= time_info.get(since, 0)
+                self.timings[name].record(max(0, value))
+
+    def _record(self, request, response, error, start):
+        duration = time.time() - start
+        if error is None:
+            status = response.code
+        elif isinstance(error, HTTPError):
+            status = error.code
+            response = error.response
+        else:
+            status = type(error).__name__
+        self.statuses[status] += 1
+        self._record_response(request, response, duration)
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function and record the request metrics
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        start = time.time()
+        try:
+            response = fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(request, None, exc, start)
+            raise
+        self._record(request, response, None, start)
+        return response
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function and record the request metrics
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        start = time.time()
+        try:
+            response = yield fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(request, None, exc, start)
+            raise
+        self._record(request, response, None, start)
+        raise Return(response)
+
+    def parse(self, parse, response):
+        """
+        call a parse function and record how long it takes
+        :param parse: the parse function, e.g. parse_response
+        :param response: the HTTPResponse
+        """
+        start = time.time()
+        try:
+            return parse(response)
+        finally:
+            self.timings['parse'].record(time.time() - start)
+
+    def snapshot(self):
+        """
+        get a summary of the metrics
+        """
+        snapshot = {name: histogram.snapshot()
+                    for name, histogram in self.timings.items()
+                    if histogram.count}
+        snapshot.update({name: histogram.snapshot()
+                         for name, histogram in self.sizes.items()
+                         if histogram.count})
+        snapshot['status'] = dict(self.statuses)
+        return snapshot
+
+
+def resource_path(url, template=None):
+    """
+    get the host and path of a url with the entity ids replaced by those of
+    the resource template, e.g. "example.com/v1/offers/{id}"
+    :param url: the request url
+    :param template: (optional) the resource template, e.g. "offers/{id}"
+    """
+    parsed = urlparse(url)
+    path = parsed.path
+    if template:
+        # entity ids are quoted, so the template has a name for each of the
+        # last segments of the path
+        names = template.split('/')
+        segments = path.rstrip('/').split('/')
+        path = '/'.join(segments[:-len(names)] + names)
+    return parsed.netloc + path
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')
+
+
+class Metrics(object):
+    """
+    Request metrics keyed by method and resource template.
+
+    Example Usage:
+        >>> metrics = Metrics()
+        >>> api = API('https://localhost:8004', metrics=metrics)
+        >>> api.offers['1234'].get()
+        >>> metrics.snapshot()['GET offers/{id}']['total']['p99']
+        0.0123
+        >>> print metrics.prometheus()
+
+    Queue, DNS, connect, TLS and time to first byte timings are only
+    available with the curl based AsyncHTTPClient, which reports them in
+    HTTPResponse.time_info.
+    """
+    def __init__(self, precision=32, prefix='chub'):
+        """
+        :param precision: the precision of the histograms
+        :param prefix: the prefix for Prometheus metric names
+        """
+        self.precision = precision
+        self.prefix = prefix
+        self._resources = {}
+
+    @staticmethod
+    def key(method, url, template=None):
+        """
+        get the metrics key for a request
+        :param method: the HTTP method
+        :param url: the request url, used if there is no template
+        :param template: (optional) the resource template,
+            e.g. "offers/{id}"
+        """
+        if template is None:
+            template = urlparse(url).path.lstrip('/')
+        return '{} {}'.format(method.upper(), template)
+
+    def resource(self, method, url, template=None):
+        """
+        get or create the ResourceMetrics for a request
+        """
+        key = self.key(method, url, template)
+        if key not in self._resources:
+            self._resources[key] = ResourceMetrics(key, self.precision)
+        return self._resources[key]
+
+    def reset(self):
+        """Reset the metrics"""
+        self._resources = {}
+
+    def snapshot(self):
+        """
+        get a summary of the metrics of each resource
+        """
+        return {key: resource.snapshot()
+                for key, resource in self._resources.items()}
+
+    def prometheus(self):
+        """
+        export the metrics in the Prometheus text format
+        """
+        lines = []
+        resources = sorted(self._resources.items())
+
+        name = '{}_requests_total'.format(self.prefix)
+        lines.append('# TYPE {} counter'.format(name))
+        for key, resource in resources:
+            for status, count in sorted(resource.statuses.items()):
+                lines.append('{}{{resource="{}",status="{}"}} {}'.format(
+                    name, _escape(key), _escape(status), count))
+
+        summaries = [(timing, 'seconds', 'timings') for timing in TIMINGS]
+        summaries += [(size, '', 'sizes') for size in SIZES]
+        for metric, unit, attr in summaries:
+            name = '_'.join(filter(None, (self.prefix, 'request',
+                                          metric, unit)))
+            lines.append('# TYPE {} summary'.format(name))
+            for key, resource in resources:
+                histogram = getattr(resource, attr)[metric]
+                if not histogram.count:
+                    continue
+                label = 'resource="{}"'.format(_escape(key))
+                for quantile in QUANTILES:
+                    lines.append('{}{{{},quantile="{}"}} {}'.format(
+                        name, label, quantile,
+                        histogram.percentile(quantile * 100)))
+                lines.append('{}_sum{{{}}} {}'.format(
+                    name, label, histogram.total))
+                lines.append('{}_count{{{}}} {}'.format(
+                    name, label, histogram.count))
+        return '\n'.join(lines) + '\n'
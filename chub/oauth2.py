@@ -8,12 +8,20 @@
 # See the License for the specific language governing permissions and limitations under the License.
 # 
 
+import base64
+import copy
 import logging
 import calendar
+import threading
+import time
 import urllib
+from collections import defaultdict
 from datetime import datetime
 
+from tornado.concurrent import Future
 from tornado.gen import coroutine, Return
+from tornado.httpclient import HTTPError
+from tornado.httputil import HTTPHeaders
 
 from . import API
 
@@ -140,21 +148,63 @@ class Scope(object):
         return str(self) != str(other)
 
 
+class _SyncClients(object):
+    """
+    A pool of synchronous APIs for token requests, so that each thread
+    making a request at the same time has its own HTTPClient and threads
+    don't create a client for every request
+    """
+    max_idle = 10
+
+    def __init__(self):
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, base_url, **kwargs):
+        """
+        get an idle API or create one
+        :return: the pool key and the API
+        """
+        key = (base_url, tuple(sorted(kwargs.items())))
+        with self._lock:
+            if self._idle[key]:
+                return key, self._idle[key].pop()
+        return key, API(base_url, async=False, **kwargs)
+
+    def release(self, key, api):
+        """return an API to the pool"""
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(api)
+                return
+        api.fetch.keywords['httpclient'].close()
+
+
 class RequestToken(object):
     """
     Function object for making token requests with simple caching of the
     responses
 
+    The cache is shared by the asynchronous and synchronous (sync) methods
+    and may be used from several threads. Synchronous requests for the same
+    token are serialised by a lock, so only one thread requests it.
+
     NOTE: errors are not cached
     """
     # Don't re-use a token with less than this many seconds remaining
     max_until_expired = 60
     max_cache_size = 100
+    # the timeout of token requests, unless the client sets one
+    request_timeout = 60
+    # the number of locks shared by the cache keys of synchronous requests
+    lock_stripes = 64
 
     def __init__(self):
         self._cache = {}
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(self.lock_stripes)]
+        self._sync_clients = _SyncClients()
 
-    @coroutine
     def __call__(self, base_url, client_id, client_secret, scope=None,
                  jwt=None, cache=True, **kwargs):
         """
@@ -202,7 +252,23 @@ class RequestToken(object):
         :param jwt: (optional) a JWT for the jwt-bearer grant
         :param cache: whether or not to use the in-memory cache
         :param ca_certs: (optional) a CA certificate file
+        :return: a Future resolving to the token. If the token is cached the
+            Future is already resolved
         """
+        parameters = self._parameters(scope, jwt)
+        if cache:
+            cached = self._cache.get(self._key(base_url, client_id,
+                                               parameters), {})
+            if cached.get('access_token') and not self._expired(cached):
+                future = Future()
+                future.set_result(cached['access_token'])
+                return future
+        return self._get_token(base_url, client_id, client_secret,
+                               parameters, cache, **kwargs)
+
+    @staticmethod
+    def _parameters(scope, jwt):
+        """The body of the token request"""
         parameters = {'grant_type': CLIENT_CREDENTIALS}
 
         if scope is not None:
@@ -212,6 +278,139 @@ class RequestToken(object):
             parameters['grant_type'] = JWT_BEARER
             parameters['assertion'] = jwt
 
+        return parameters
+
+    @staticmethod
+    def _key(base_url, client_id, parameters):
+        """The cache key of a token request"""
+        return (base_url, client_id, tuple(parameters.items()))
+
+    @coroutine
+    def response(self, base_url, client_id, client_secret, scope=None,
+                 jwt=None, min_remaining=None, force=False, **kwargs):
+        """
+        Get a token response, with the token and its expiry, from the cache
+        or the auth service
+
+        :param base_url: base auth serivce URL
+        :param client_id: the client ID
+        :param client_secret: the client secret
+        :param scope: (optional) a scope object or string
+        :param jwt: (optional) a JWT for the jwt-bearer grant
+        :param min_remaining: (optional) request a new token if the cached
+            token expires in less than this many seconds, by default
+            max_until_expired
+        :param force: request a new token even if one is cached, e.g. after
+            it was rejected
+        :return: a Future resolving to a dictionary with the
+            "access_token" and its "expiry" timestamp
+        """
+        parameters = self._parameters(scope, jwt)
+        key = self._key(base_url, client_id, parameters)
+        cached = self._cache.get(key, {})
+        if min_remaining is None:
+            min_remaining = self.max_until_expired
+        if force or not self._valid(cached, min_remaining):
+            cached = yield self._request(base_url, client_id, client_secret,
+                                         parameters, **kwargs)
+            self._store(key, cached)
+        raise Return(cached)
+
+    def sync(self, base_url, client_id, client_secret, scope=None,
+             jwt=None, cache=True, **kwargs):
+        """
+        Get an OAuth token with a synchronous request, e.g. from a thread
+        without an IOLoop
+
+        Example Usage:
+            >>> token = get_token.sync('https://localhost:8007',
+                                       'a service id',
+                                       'the client secret',
+                                       scope=Write('just one service'))
+
+        Takes the same arguments as get_token
+        :return: the token
+        """
+        if not cache:
+            parameters = self._parameters(scope, jwt)
+            return self._sync_request(base_url, client_id, client_secret,
+                                      parameters, **kwargs)['access_token']
+        return self.sync_response(base_url, client_id, client_secret,
+                                  scope=scope, jwt=jwt,
+                                  **kwargs)['access_token']
+
+    def sync_response(self, base_url, client_id, client_secret, scope=None,
+                      jwt=None, min_remaining=None, force=False, **kwargs):
+        """
+        Get a token response, with the token and its expiry, from the cache
+        or with a synchronous request to the auth service. Threads needing
+        the same token wait for one of them to request it
+
+        Takes the same arguments as response
+        :return: a dictionary with the "access_token" and its "expiry"
+            timestamp
+        """
+        parameters = self._parameters(scope, jwt)
+        key = self._key(base_url, client_id, parameters)
+        if min_remaining is None:
+            min_remaining = self.max_until_expired
+        cached = self._cache.get(key, {})
+        if not force and self._valid(cached, min_remaining):
+            return cached
+
+        with self._key_locks[hash(key) % self.lock_stripes]:
+            current = self._cache.get(key, {})
+            # another thread may have requested the token while this one
+            # was waiting
+            if ((current is not cached or not force) and
+                    self._valid(current, min_remaining)):
+                return current
+            response = self._sync_request(base_url, client_id,
+                                          client_secret, parameters,
+                                          **kwargs)
+            self._store(key, response)
+        return response
+
+    def _sync_request(self, base_url, client_id, client_secret,
+                      parameters, **kwargs):
+        """Make a synchronous API request to get the token"""
+        logging.debug('Getting an OAuth token for client "%s" with scope "%s"',
+                      client_id, parameters.get('scope'))
+        credentials = base64.b64encode('{}:{}'.format(client_id,
+                                                      client_secret))
+        headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                   'Accept': 'application/json',
+                   'Authorization': 'Basic {}'.format(credentials)}
+
+        kwargs.setdefault('request_timeout', self.request_timeout)
+        pool_key, api = self._sync_clients.acquire(base_url, **kwargs)
+        try:
+            response = api.auth.token.post(body=urllib.urlencode(parameters),
+                                           headers=headers)
+        finally:
+            self._sync_clients.release(pool_key, api)
+
+        logging.debug('Received token: %s', response.get('access_token'))
+        return response
+
+    def _valid(self, cached, min_remaining):
+        return bool(cached.get('access_token')) and \
+            cached.get('expiry') >= self._now() + min_remaining
+
+    def _store(self, key, response):
+        """Cache a token response"""
+        if 'expiry' not in response and 'expires_in' in response:
+            response['expiry'] = self._now() + response['expires_in']
+        with self._lock:
+            self._cache[key] = response
+            # Purge cache when adding a new item so it doesn't grow too
+            # large
+            self.purge_cache()
+
+    @coroutine
+    def _get_token(self, base_url, client_id, client_secret, parameters,
+                   cache, **kwargs):
+        """Request a token, or get it from the cache"""
         if cache:
             response = yield self._cached_request(base_url, client_id,
                                                   client_secret, parameters,
@@ -232,6 +431,7 @@ class RequestToken(object):
         headers = {'Content-Type': 'application/x-www-form-urlencoded',
                    'Accept': 'application/json'}
 
+        kwargs.setdefault('request_timeout', self.request_timeout)
         api = API(base_url,
                   auth_username=client_id,
                   auth_password=client_secret,
@@ -239,7 +439,6 @@ class RequestToken(object):
         endpoint = api.auth.token
 
         response = yield endpoint.post(body=urllib.urlencode(parameters),
-                                       request_timeout=60,
                                        headers=headers)
 
         logging.debug('Received token: %s', response.get('access_token'))
@@ -257,18 +456,16 @@ class RequestToken(object):
     def _cached_request(self, base_url, client_id, client_secret,
                         parameters, **kwargs):
         """Cache the token request and use cached responses if available"""
-        key = (base_url, client_id, tuple(parameters.items()))
+        key = self._key(base_url, client_id, parameters)
         cached = self._cache.get(key, {})
 
         if not cached.get('access_token') or self._expired(cached):
             cached = yield self._request(base_url, client_id, client_secret,
                                          parameters, **kwargs)
-            self._cache[key] = cached
-            # Purge cache when adding a new item so it doesn't grow too large
             # It's assumed the cache size is small enough that it's OK to loop
             # over the whole cache regularly. If not, could change this to
             # just pop off the oldest one
-            self.purge_cache()
+            self._store(key, cached)
 
         logging.debug('Using a cached token: %s', cached.get('access_token'))
         raise Return(cached)
@@ -287,3 +484,197 @@ class RequestToken(object):
                            if not self._expired(v)}
 
 get_token = RequestToken()
+
+
+class ClientCredentials(object):
+    """
+    Authenticate requests made with an API with a bearer token for a
+    client's credentials and scope.
+
+    The token is held by the provider, so a request with a valid token
+    doesn't wait for the token cache. A new token is requested in the
+    background when the token expires in less than refresh_ahead seconds,
+    and requests wait for one only if the token has expired. Requests
+    rejected with a 401 are retried once with a new token. Concurrent
+    requests share the same token request.
+
+    With a synchronous API, the thread which finds the token about to
+    expire requests a new one, while other threads keep using the current
+    token until it has expired.
+
+    Example Usage:
+        >>> auth = ClientCredentials('https://localhost:8007',
+                                     'a service id', 'the client secret',
+                                     scope=Write('a repository id'))
+        >>> api = API('https://localhost:8004', auth_provider=auth)
+        >>> yield api.repository.repositories['1234'].assets.post(...)
+    """
+    def __init__(self, base_url, client_id, client_secret, scope=None,
+                 refresh_ahead=300, token_source=None, **kwargs):
+        """
+        :param base_url: base auth service URL
+        :param client_id: the client ID
+        :param client_secret: the client secret
+        :param scope: (optional) a scope object or string
+        :param refresh_ahead: the number of seconds before the token expires
+            to request a new one
+        :param token_source: (optional) the RequestToken, by default the
+            shared get_token
+        :param kwargs: options for token requests, e.g. ca_certs
+        """
+        self.base_url = base_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.refresh_ahead = refresh_ahead
+        self.token_source = token_source or get_token
+        self.kwargs = kwargs
+        self.token = None
+        self.expiry = 0
+        self.refreshes = 0
+        self.retries = 0
+        self._refreshing = None
+        self._lock = threading.Lock()
+
+    _now = staticmethod(time.time)
+
+    def refresh(self, force=False):
+        """
+        Get a new token, shared with other requests waiting for one
+
+        :param force: request a new token even if the cached one is valid,
+            e.g. after it was rejected
+        :return: a Future resolving to the token
+        """
+        if self._refreshing is not None:
+            return self._refreshing
+        future = self._refresh(force)
+        if not future.done():
+            self._refreshing = future
+        return future
+
+    @coroutine
+    def _refresh(self, force):
+        try:
+            response = yield self.token_source.response(
+                self.base_url, self.client_id, self.client_secret,
+                scope=self.scope, min_remaining=self.refresh_ahead,
+                force=force, **self.kwargs)
+        finally:
+            self._refreshing = None
+        self.refreshes += 1
+        self.token = response['access_token']
+        self.expiry = response['expiry']
+        raise Return(self.token)
+
+    def _sync_refresh(self, stale=None):
+        """
+        Get a new token with a synchronous request, holding the lock
+        :param stale: (optional) a token which was rejected
+        """
+        if (self.token is not None and self.token != stale and
+                self.expiry - self._now() >= self.refresh_ahead):
+            # another thread got a new token while this one was waiting
+            return self.token
+        response = self.token_source.sync_response(
+            self.base_url, self.client_id, self.client_secret,
+            scope=self.scope, min_remaining=self.refresh_ahead,
+            force=stale is not None, **self.kwargs)
+        self.refreshes += 1
+        self.token = response['access_token']
+        self.expiry = response['expiry']
+        return self.token
+
+    def sync_refresh(self, stale=None):
+        """
+        Get a new token with a synchronous request. Threads waiting for a
+        token share the one requested by the first of them
+
+        :param stale: (optional) a token which was rejected
+        :return: the token
+        """
+        with self._lock:
+            return self._sync_refresh(stale)
+
+    @staticmethod
+    def _log_error(future):
+        if future.exception() is not None:
+            logging.warning('Failed to refresh the OAuth token: %s',
+                            future.exception())
+
+    @staticmethod
+    def _request(request, token):
+        request = copy.copy(request)
+        request.headers = HTTPHeaders(request.headers)
+        request.headers['Authorization'] = 'Bearer {}'.format(token)
+        return request
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function with a bearer token
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        token = self.token
+        remaining = self.expiry - self._now()
+        if token is None or remaining <= 0:
+            token = self.sync_refresh()
+        elif remaining < self.refresh_ahead and self._lock.acquire(False):
+            # only one thread refreshes ahead, the others don't wait
+            try:
+                token = self._sync_refresh()
+            except Exception as exc:
+                logging.warning('Failed to refresh the OAuth token: %s', exc)
+            finally:
+                self._lock.release()
+
+        try:
+            return fetch(self._request(request, token), **kwargs)
+        except HTTPError as exc:
+            if exc.code != 401:
+                raise
+            with self._lock:
+                self.retries += 1
+                token = self._sync_refresh(stale=token)
+            return fetch(self._request(request, token), **kwargs)
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function with a bearer token
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        token = self.token
+        remaining = self.expiry - self._now()
+        if token is None or remaining <= 0:
+            token = yield self.refresh()
+        elif remaining < self.refresh_ahead and self._refreshing is None:
+            self.refresh().add_done_callback(self._log_error)
+
+        try:
+            response = yield fetch(self._request(request, token), **kwargs)
+        except HTTPError as exc:
+            if exc.code != 401:
+                raise
+            self.retries += 1
+            if self.token == token:
+                # the token was rejected, so nothing else should use it
+                self.token = None
+                token = yield self.refresh(force=True)
+            elif self.token is None:
+                token = yield self.refresh()
+            else:
+                token = self.token
+            response = yield fetch(self._request(request, token), **kwargs)
+        raise Return(response)
+
+    def stats(self):
+        """
+        get the number of tokens received, retries after a 401 and the
+        number of seconds until the token expires
+        """
+        return {'refreshes': self.refreshes,
+                'retries': self.retries,
+                'expires_in': self.expiry - self._now()
+                if self.token is not None else None}
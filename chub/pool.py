@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a pool of keep-alive connections shared by async clients
+"""
+import weakref
+from collections import defaultdict, deque
+from functools import partial
+
+from tornado.concurrent import Future
+from tornado.http1connection import HTTP1Connection, HTTP1ConnectionParameters
+from tornado.ioloop import IOLoop
+from tornado.simple_httpclient import SimpleAsyncHTTPClient, _HTTPConnection
+
+
+def _key(host, port, ssl_options):
+    """The pool key of a connection"""
+    if isinstance(ssl_options, dict):
+        ssl_options = tuple(sorted(ssl_options.items()))
+    return host, port, ssl_options
+
+
+class ConnectionPool(object):
+    """
+    Keep connections to services open between requests, so requests don't
+    wait for a TCP and TLS handshake each time. The pool is shared by the
+    clients of APIs using it, e.g. an API for each service.
+
+    Up to max_idle connections to each host are kept, and connections idle
+    for idle_timeout seconds are closed.
+
+    Example Usage:
+        >>> pool = ConnectionPool(max_idle=20)
+        >>> api = API('https://localhost:8004', connection_pool=pool)
+        >>> yield api.warmup(connections=10)
+        >>> pool.stats()
+        {'connects': 10, 'reuses': 0, 'idle': 10, 'expired': 0}
+    """
+    def __init__(self, max_idle=10, idle_timeout=60.0, io_loop=None):
+        """
+        :param max_idle: the maximum number of idle connections to a host
+        :param idle_timeout: the number of seconds to keep an idle
+            connection open
+        :param io_loop: (optional) the IOLoop
+        """
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.io_loop = io_loop or IOLoop.current()
+        self._idle = defaultdict(deque)
+        self._keys = weakref.WeakKeyDictionary()
+        self._timeout = None
+        self.connects = 0
+        self.reuses = 0
+        self.expired = 0
+
+    @property
+    def idle(self):
+        return sum(len(streams) for streams in self._idle.values())
+
+    def connect(self, tcp_client, host, port, ssl_options=None, **kwargs):
+        """
+        get an idle connection to a host, or open a new one
+        :param tcp_client: the TCPClient used to open a connection
+        :param kwargs: TCPClient.connect arguments
+        :return: a Future resolving to an IOStream
+        """
+        key = _key(host, port, ssl_options)
+        streams = self._idle.get(key)
+        while streams:
+            stream, _ = streams.pop()
+            if not stream.closed():
+                stream.set_close_callback(None)
+                self.reuses += 1
+                future = Future()
+                future.set_result(stream)
+                return future
+
+        self.connects += 1
+        future = Future()
+
+        def connected(connecting):
+            if connecting.exception() is not None:
+                future.set_exc_info(connecting.exc_info())
+            else:
+                self._keys[connecting.result()] = key
+                future.set_result(connecting.result())
+        connecting = tcp_client.connect(host, port, ssl_options=ssl_options,
+                                        **kwargs)
+        self.io_loop.add_future(connecting, connected)
+        return future
+
+    def release(self, stream):
+        """
+        keep a connection open for another request
+        :param stream: an IOStream opened by connect
+        """
+        key = self._keys.get(stream)
+        if key is None or stream.closed():
+            return
+        streams = self._idle[key]
+        if len(streams) >= self.max_idle:
+            stream.close()
+            return
+        streams.append((stream, self.io_loop.time()))
+        # the close callback makes the stream listen for the server closing
+        # the connection while it is idle
+        stream.set_close_callback(partial(self._remove, key, stream))
+        if self._timeout is None:
+            self._timeout = self.io_loop.call_later(self.idle_timeout,
+                                                    self._expire)
+
+    def _remove(self, key, stream):
+        streams = self._idle.get(key, ())
+        for item in list(streams):
+            if item[0] is stream:
+                streams.remove(item)
+
+    def _expire(self):
+        self._timeout = None
+        deadline = self.io_loop.time() - self.idle_timeout
+        for streams in self._idle.values():
+            while streams and streams[0][1] <= deadline:
+                stream, _ = streams.popleft()
+                stream.set_close_callback(None)
+                stream.close()
+                self.expired += 1
+        if self.idle:
+            self._timeout = self.io_loop.call_later(self.idle_timeout / 2.0,
+                                                    self._expire)
+
+    def close(self):
+        """close the idle connections"""
+        for streams in self._idle.values():
+            for stream, _ in streams:
+                stream.set_close_callback(None)
+                stream.close()
+        self._idle.clear()
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def stats(self):
+        """
+        get the number of new and reused connections, idle connections and
+        connections closed after being idle for too long
+        """
+        return {'connects': self.connects,
+                'reuses': self.reuses,
+                'idle': self.idle,
+                'expired': self.expired}
+
+
+class _PooledTCPClient(object):
+    """A TCPClient getting connections from a ConnectionPool"""
+    def __init__(self, pool, tcp_client):
+        self.pool = pool
+        self.tcp_client = tcp_client
+
+    def connect(self, host, port, callback=None, **kwargs):
+        future = self.pool.connect(self.tcp_client, host, port, **kwargs)
+        if callback is not None:
+            self.pool.io_loop.add_future(
+                future, lambda future: callback(future.result()))
+        return future
+
+    def release(self, stream):
+        self.pool.release(stream)
+
+    def close(self):
+        self.tcp_client.close()
+
+
+class _KeepAliveConnection(_HTTPConnection):
+    """An HTTP connection returned to the pool after the response"""
+    def _on_connect(self, stream):
+        if 'Connection' not in self.request.headers:
+            self.request.headers['Connection'] = 'keep-alive'
+        super(_KeepAliveConnection, self)._on_connect(stream)
+
+    def _create_connection(self, stream):
+        stream.set_nodelay(True)
+        return HTTP1Connection(
+            stream, True,
+            HTTP1ConnectionParameters(
+                no_keep_alive=False,
+                max_header_size=self.max_header_size,
+                max_body_size=self.max_body_size,
+                decompress=self.request.decompress_response),
+            self._sockaddr)
+
+    def _read_response(self):
+        self.io_loop.add_future(self.connection.read_response(self),
+                                self._on_response_read)
+
+    def _on_response_read(self, future):
+        # the stream is released once the HTTP1Connection is done with it
+        try:
+            keep_alive = future.result()
+        except Exception:
+            self.stream.close()
+            raise
+        if (keep_alive and not self.connection._disconnect_on_finish and
+                not self.stream.closed()):
+            self.tcp_client.release(self.stream)
+        else:
+            self.stream.close()
+
+    def _on_end_request(self):
+        pass
+
+
+class KeepAliveHTTPClient(SimpleAsyncHTTPClient):
+    """
+    A SimpleAsyncHTTPClient reusing connections from a ConnectionPool,
+    instead of opening a connection for each request
+    """
+    def initialize(self, io_loop, pool=None, **kwargs):
+        """
+        :param pool: (optional) the ConnectionPool, by default a pool for
+            this client
+        :param kwargs: SimpleAsyncHTTPClient arguments
+        """
+        super(KeepAliveHTTPClient, self).initialize(io_loop, **kwargs)
+        self.pool = pool or ConnectionPool(io_loop=io_loop)
+        self.tcp_client = _PooledTCPClient(self.pool, self.tcp_client)
+
+    def _connection_class(self):
+        return _KeepAliveConnection
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a scheduler for requests with different priorities
+"""
+from collections import deque
+from functools import partial
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return
+from tornado.ioloop import IOLoop
+
+from .deadline import current_deadline
+from .stats import RollingWindow
+
+INTERACTIVE = 'interactive'
+DEFAULT = 'default'
+BULK = 'bulk'
+
+
+class Lane(object):
+    """
+    A queue of requests with the same priority
+    """
+    def __init__(self, name, weight, max_concurrency=None):
+        """
+        :param name: the lane name, e.g. "interactive"
+        :param weight: the share of request slots given to the lane
+        :param max_concurrency: (optional) the maximum number of requests
+            in flight from the lane
+        """
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.scheduler = None
+        self.in_flight = 0
+        self.started = 0
+        self.waits = RollingWindow()
+        self._queue = deque()
+        self._current_weight = 0
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def _ready(self):
+        return self._queue and (self.max_concurrency is None or
+                                self.in_flight < self.max_concurrency)
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function when the lane is scheduled
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        slot = self.scheduler.acquire(self)
+        deadline = current_deadline()
+        if deadline is not None:
+            slot = deadline.wait(slot, partial(self.scheduler.cancel, self))
+        yield slot
+        try:
+            response = yield fetch(request, **kwargs)
+        finally:
+            self.scheduler.release(self)
+        raise Return(response)
+
+    def stats(self):
+        """
+        get the lane's queue and queue wait stats
+        """
+        return {'queued': self.queued,
+                'in_flight': self.in_flight,
+                'started': self.started,
+                'wait_p50': self.waits.percentile(50),
+                'wait_p99': self.waits.percentile(99),
+                'wait_max': self.waits.percentile(100)}
+
+
+class PriorityScheduler(object):
+    """
+    Schedule requests from priority lanes so that bulk requests can't
+    starve interactive requests sharing the same client.
+
+    At most max_concurrency requests are in flight, which should not exceed
+    the max_clients of the AsyncHTTPClient (10 by default) so that requests
+    don't queue in the client. When a slot is free the next request is
+    taken from the lanes using smooth weighted round robin.
+
+    The priority is set per call or per Resource:
+        >>> api = API('https://localhost:8004',
+                      priority_scheduler=PriorityScheduler())
+        >>> api.offers['1234'].get(chub_priority=INTERACTIVE)
+        >>> api.repositories.priority = BULK
+    """
+    def __init__(self, max_concurrency=10, lanes=None, default=DEFAULT):
+        """
+        :param max_concurrency: the maximum number of requests in flight
+        :param lanes: (optional) a list of Lanes. By default there are
+            interactive, default and bulk lanes, and bulk requests may use
+            at most half of the slots
+        :param default: the name of the lane used if there is no priority
+        """
+        if lanes is None:
+            lanes = [Lane(INTERACTIVE, 8),
+                     Lane(DEFAULT, 4),
+                     Lane(BULK, 1, max(1, max_concurrency // 2))]
+        self.max_concurrency = max_concurrency
+        self.lanes = {}
+        for lane in lanes:
+            lane.scheduler = self
+            self.lanes[lane.name] = lane
+        self.default = default
+        self.in_flight = 0
+
+    def lane(self, name=None):
+        """
+        get a lane
+        :param name: the lane name. The default lane if None
+        """
+        if name is None:
+            name = self.default
+        try:
+            return self.lanes[name]
+        except KeyError:
+            raise ValueError('Unknown priority "{}"'.format(name))
+
+    def acquire(self, lane):
+        """
+        queue for a request slot
+        :param lane: the Lane
+        :return: a Future resolved when the request may start
+        """
+        future = Future()
+        lane._queue.append((future, IOLoop.current().time()))
+        self._dispatch()
+        return future
+
+    def cancel(self, lane, future):
+        """
+        give up a request slot, e.g. when the deadline has passed
+        :param lane: the Lane
+        :param future: the Future returned by acquire
+        """
+        if future.done():
+            self.release(lane)
+            return
+        for item in lane._queue:
+            if item[0] is future:
+                lane._queue.remove(item)
+                break
+
+    def release(self, lane):
+        """
+        release a request slot
+        :param lane: the Lane
+        """
+        self.in_flight -= 1
+        lane.in_flight -= 1
+        self._dispatch()
+
+    def _next_lane(self):
+        ready = [lane for lane in self.lanes.values() if lane._ready()]
+        if not ready:
+            return None
+        total = 0
+        for lane in ready:
+            lane._current_weight += lane.weight
+            total += lane.weight
+        chosen = max(ready, key=lambda lane: lane._current_weight)
+        chosen._current_weight -= total
+        return chosen
+
+    def _dispatch(self):
+        now = IOLoop.current().time()
+        while self.in_flight < self.max_concurrency:
+            lane = self._next_lane()
+            if lane is None:
+                break
+            future, queued_at = lane._queue.popleft()
+            self.in_flight += 1
+            lane.in_flight += 1
+            lane.started += 1
+            lane.waits.add(now - queued_at)
+            future.set_result(None)
+
+    def stats(self):
+        """
+        get the stats of each lane
+        """
+        return {name: lane.stats() for name, lane in self.lanes.items()}
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a client side rate limiter
+"""
+import logging
+import threading
+import time
+from urlparse import urlparse
+
+from tornado.gen import coroutine, Return, sleep
+from tornado.httpclient import HTTPError
+
+from .deadline import DeadlineExceeded, current_deadline
+from .metrics import resource_path
+from .retry import parse_retry_after
+
+
+class TokenBucket(object):
+    """
+    A token bucket where callers reserve a token and wait until it is
+    available. Reservations are served in the order they are made, so
+    requests are queued fairly rather than rejected.
+
+    The rate is reduced when the service responds with 429 Too Many
+    Requests and recovers linearly to the configured rate over
+    recovery_time seconds.
+    """
+    def __init__(self, rate, burst, now, backoff=0.5, min_rate=0.1,
+                 recovery_time=30):
+        """
+        :param rate: tokens per second
+        :param burst: the maximum number of tokens
+        :param now: the current time
+        :param backoff: multiply the rate by this after a 429 response
+        :param min_rate: the minimum rate after backing off
+        :param recovery_time: seconds to recover to the configured rate
+        """
+        self.max_rate = float(rate)
+        self.burst = burst
+        self.backoff = backoff
+        self.min_rate = min(min_rate, self.max_rate)
+        self.recovery_time = recovery_time
+        self.tokens = float(burst)
+        self.updated = now
+        self._penalized_rate = None
+        self._penalized_at = None
+
+    def rate(self, now):
+        """
+        the current rate, taking recovery after a 429 into account
+        """
+        if self._penalized_rate is None:
+            return self.max_rate
+        elapsed = max(0, now - self._penalized_at)
+        if elapsed >= self.recovery_time:
+            self._penalized_rate = None
+            return self.max_rate
+        recovered = (self.max_rate - self._penalized_rate) * (
+            float(elapsed) / self.recovery_time)
+        return self._penalized_rate + recovered
+
+    def reserve(self, now):
+        """
+        reserve a token
+        :param now: the current time
+        :return: the number of seconds to wait before using the token
+        """
+        rate = self.rate(now)
+        if now > self.updated:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * rate)
+            self.updated = now
+        self.tokens -= 1
+        return max(0, self.updated - now) + max(0, -self.tokens) / rate
+
+    def penalize(self, now, retry_after=None):
+        """
+        slow down after a 429 Too Many Requests response
+        :param now: the current time
+        :param retry_after: (optional) seconds before requests may resume
+        """
+        self._penalized_rate = max(self.min_rate,
+                                   self.rate(now) * self.backoff)
+        self._penalized_at = now
+        self.tokens = min(self.tokens, 0)
+        if retry_after:
+            self.updated = max(self.updated, now + retry_after)
+
+    def cancel(self):
+        """
+        give back a reserved token which wasn't used
+        """
+        self.tokens += 1
+
+
+class _ResourceLimiter(object):
+    """Limit the rate of requests to a resource template"""
+    def __init__(self, limiter, template):
+        self.limiter = limiter
+        self.template = template
+
+    def _reserve(self, request):
+        """
+        reserve a request, failing fast if the active deadline would pass
+        before the request can be made
+        :return: the number of seconds to wait before making the request
+        """
+        delay = self.limiter.reserve(request.url, self.template)
+        deadline = current_deadline()
+        if deadline is not None and delay >= deadline.remaining():
+            self.limiter.cancel(request.url, delay, self.template)
+            raise DeadlineExceeded(deadline.timeout)
+        return delay
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function when the rate limit allows it
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        delay = self._reserve(request)
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            return fetch(request, **kwargs)
+        except Exception as exc:
+            self.limiter._on_error(request.url, exc, self.template)
+            raise
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function when the rate limit allows it
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        delay = self._reserve(request)
+        if delay > 0:
+            yield sleep(delay)
+        try:
+            response = yield fetch(request, **kwargs)
+        except Exception as exc:
+            self.limiter._on_error(request.url, exc, self.template)
+            raise
+        raise Return(response)
+
+
+class RateLimiter(object):
+    """
+    Limit the rate of requests to each host, or to each resource.
+
+    Example Usage:
+        >>> limiter = RateLimiter(rate=50, burst=10,
+                                  rates={'acc-stage.copyrighthub.org': 5})
+        >>> api = API('https://localhost:8004', rate_limiter=limiter)
+    """
+    def __init__(self, rate, burst=1, rates=None, per_path=False,
+                 backoff=0.5, min_rate=0.1, recovery_time=30):
+        """
+        :param rate: requests per second
+        :param burst: the number of requests that can be made at once
+        :param rates: (optional) a dictionary of rates, or (rate, burst)
+            tuples, keyed by host or resource that override rate and burst,
+            e.g. "localhost:8004/v1/offers/{id}"
+        :param per_path: limit each resource (host and resource template)
+            separately
+        :param backoff: multiply the rate by this after a 429 response
+        :param min_rate: the minimum rate after backing off
+        :param recovery_time: seconds to recover to the configured rate
+        """
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.per_path = per_path
+        self.backoff = backoff
+        self.min_rate = min_rate
+        self.recovery_time = recovery_time
+        self.throttled = 0
+        self.waited = 0.0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _now():
+        return time.time()
+
+    def key(self, url, template=None):
+        """
+        get the bucket key for a url
+        :param url: the request url
+        :param template: (optional) the resource template, so that requests
+            for different entities share a bucket if per_path is set
+        """
+        if self.per_path:
+            return resource_path(url, template)
+        return urlparse(url).netloc
+
+    def bucket(self, key):
+        """
+        get or create the bucket for a key
+        """
+        if key not in self._buckets:
+            rate = self.rates.get(key, (self.rate, self.burst))
+            if not isinstance(rate, tuple):
+                rate = (rate, self.burst)
+            self._buckets[key] = TokenBucket(
+                rate[0], rate[1], self._now(), backoff=self.backoff,
+                min_rate=self.min_rate, recovery_time=self.recovery_time)
+        return self._buckets[key]
+
+    def reserve(self, url, template=None):
+        """
+        reserve a request to a url
+        :param url: the request url
+        :param template: (optional) the resource template
+        :return: the number of seconds to wait before making the request
+        """
+        with self._lock:
+            delay = self.bucket(self.key(url, template)).reserve(self._now())
+            if delay > 0:
+                self.waited += delay
+        return delay
+
+    def cancel(self, url, delay, template=None):
+        """
+        cancel a reservation for a request which won't be made, e.g.
+        because the deadline would pass first
+        :param url: the request url
+        :param delay: the delay returned by reserve
+        :param template: (optional) the resource template
+        """
+        with self._lock:
+            self.bucket(self.key(url, template)).cancel()
+            if delay > 0:
+                self.waited -= delay
+
+    def _on_error(self, url, error, template=None):
+        if isinstance(error, HTTPError) and error.code == 429:
+            retry_after = None
+            if error.response is not None:
+                retry_after = parse_retry_after(
+                    error.response.headers.get('Retry-After'))
+            key = self.key(url, template)
+            logging.debug('Throttling requests to %s for %ss',
+                          key, retry_after)
+            with self._lock:
+                self.throttled += 1
+                self.bucket(key).penalize(self._now(), retry_after)
+
+    def resource(self, template=None):
+        """
+        get an object limiting the rate of requests, keyed by the resource
+        template if per_path is set
+        :param template: (optional) the resource template, e.g.
+            "offers/{id}"
+        """
+        return _ResourceLimiter(self, template)
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function when the rate limit allows it
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        return self.resource().sync_call(fetch, request, **kwargs)
+
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function when the rate limit allows it
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        return self.resource().async_call(fetch, request, **kwargs)
+
+    def stats(self):
+        """
+        get the current rate and queued tokens of each bucket
+        """
+        now = self._now()
+        with self._lock:
+            buckets = {key: {'rate': bucket.rate(now),
+                             'tokens': bucket.tokens}
+                       for key, bucket in self._buckets.items()}
+        return {'throttled': self.throttled,
+                'waited': self.waited,
+                'buckets': buckets}
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+replay traffic captured by a chub.capture.Recorder
+
+Send the requests to a target at the recorded rate, N times faster or as
+fast as possible:
+    python -m chub.replay traffic.log --target http://localhost:8000
+    python -m chub.replay traffic.log --target http://localhost:8000 --speed 4
+    python -m chub.replay traffic.log --target http://localhost:8000 \
+        --speed max --concurrency 50
+
+Or feed the recorded responses through parse_response:
+    python -m chub.replay traffic.log --parse
+"""
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from io import BytesIO
+from urlparse import urlsplit, urlunsplit
+
+from tornado import gen
+from tornado.gen import coroutine, Return
+from tornado.httpclient import (AsyncHTTPClient, HTTPError, HTTPRequest,
+                                HTTPResponse)
+from tornado.ioloop import IOLoop
+
+from .capture import read_log, decode_body, REDACTED
+from .handlers import parse_response
+from .stats import percentile
+
+PERCENTILES = (50, 90, 99)
+
+
+def make_replay_request(record, target=None):
+    """
+    create an HTTPRequest from a record
+    :param record: a dictionary read from a capture log
+    :param target: (optional) a base URL whose scheme and host replace
+        those of the recorded URL
+    """
+    url = record['url']
+    if target:
+        scheme, netloc = urlsplit(target)[:2]
+        url = urlunsplit((scheme, netloc) + urlsplit(url)[2:])
+    headers = {name: value for name, value in record['headers'].items()
+               if value != REDACTED}
+    body = decode_body(record, 'body') if record['method'] in (
+        'POST', 'PUT', 'PATCH') else None
+    return HTTPRequest(url, record['method'], headers=headers, body=body,
+                       allow_nonstandard_methods=True)
+
+
+def _summary(results, elapsed):
+    latencies = [latency for _, latency, _ in results]
+    statuses = defaultdict(int)
+    for status, _, _ in results:
+        statuses[status] += 1
+    summary = {'requests': len(results),
+               'elapsed': elapsed,
+               'throughput': len(results) / elapsed if elapsed else None,
+               'status': dict(statuses),
+               'status_mismatches': sum(1 for _, _, same in results
+                                        if not same)}
+    for pct in PERCENTILES:
+        value = percentile(latencies, pct)
+        summary['p{}_ms'.format(pct)] = (1000 * value
+                                         if value is not None else None)
+    return summary
+
+
+@coroutine
+def replay(records, target=None, speed=1.0, concurrency=10, httpclient=None,
+           io_loop=None):
+    """
+    send recorded requests again
+    :param records: an iterable of records, e.g. from read_log
+    :param target: (optional) the base URL to send the requests to,
+        instead of the recorded host
+    :param speed: how many times faster than recorded to send the requests,
+        or None to send them as fast as possible
+    :param concurrency: the number of requests in flight when speed is None
+    :param httpclient: (optional) an AsyncHTTPClient
+    :param io_loop: (optional) the IOLoop
+    :return: a summary of the responses and latencies
+    """
+    io_loop = io_loop or IOLoop.current()
+    httpclient = httpclient or AsyncHTTPClient(io_loop=io_loop,
+                                               force_instance=True)
+    results = []
+
+    @coroutine
+    def send(record):
+        request = make_replay_request(record, target)
+        start = io_loop.time()
+        try:
+            response = yield httpclient.fetch(request)
+            status = response.code
+        except HTTPError as exc:
+            status = exc.code
+        except Exception:
+            status = 599
+        results.append((status, io_loop.time() - start,
+                        status == record.get('status')))
+
+    start = io_loop.time()
+    if speed is None:
+        records = iter(records)
+
+        @coroutine
+        def worker():
+            for record in records:
+                yield send(record)
+
+        yield [worker() for _ in range(concurrency)]
+    else:
+        futures = []
+        first = None
+        for record in records:
+            if first is None:
+                first = record['t']
+            due = start + (record['t'] - first) / speed
+            if due > io_loop.time():
+                yield gen.sleep(due - io_loop.time())
+            futures.append(send(record))
+        yield futures
+
+    raise Return(_summary(results, io_loop.time() - start))
+
+
+def parse_recorded(records):
+    """
+    feed recorded responses through parse_response
+    :param records: an iterable of records with responses
+    :return: the number of responses parsed, parse errors and the mean
+        CPU time per response in microseconds
+    """
+    responses = []
+    for record in records:
+        if 'response_headers' not in record:
+            continue
+        request = HTTPRequest(record['url'], record['method'])
+        responses.append((request, record['status'],
+                          record['response_headers'],
+                          decode_body(record, 'response_body')))
+
+    errors = 0
+    start = time.clock()
+    for request, status, headers, body in responses:
+        response = HTTPResponse(request, status, headers=headers,
+                                buffer=BytesIO(body))
+        try:
+            parse_response(response)
+        except ValueError:
+            errors += 1
+    elapsed = time.clock() - start
+    return {'responses': len(responses),
+            'errors': errors,
+            'per_call_us': 1000000 * elapsed / len(responses)
+            if responses else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='the capture log')
+    parser.add_argument('--target',
+                        help='base URL to send requests to, by default the '
+                             'recorded host')
+    parser.add_argument('--speed', default='1',
+                        help='a multiple of the recorded rate, or "max"')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='requests in flight with --speed max')
+    parser.add_argument('--parse', action='store_true',
+                        help='parse the recorded responses instead of '
+                             'sending requests')
+    args = parser.parse_args(argv)
+
+    records = sorted(read_log(args.log), key=lambda record: record['t'])
+    if args.parse:
+        result = parse_recorded(records)
+    else:
+        speed = None if args.speed == 'max' else float(args.speed)
+        result = IOLoop.current().run_sync(
+            lambda: replay(records, args.target, speed, args.concurrency))
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a caching, non-blocking DNS resolver for the async client
+"""
+import logging
+import socket
+import sys
+import threading
+import time
+from Queue import Queue
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.netutil import Resolver
+
+
+class ThreadResolver(Resolver):
+    """
+    Resolve hostnames with socket.getaddrinfo in a pool of worker threads,
+    so a slow lookup doesn't block the IOLoop
+    """
+    def initialize(self, io_loop=None, threads=4):
+        """
+        :param io_loop: (optional) the IOLoop
+        :param threads: the number of lookups run at once
+        """
+        self.io_loop = io_loop or IOLoop.current()
+        self._requests = Queue()
+        self._workers = []
+        for _ in range(threads):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def close(self):
+        for _ in self._workers:
+            self._requests.put(None)
+        self._workers = []
+
+    def _work(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            future, host, port, family = request
+            try:
+                addrinfo = socket.getaddrinfo(host, port, family,
+                                              socket.SOCK_STREAM)
+                result = [(family, address)
+                          for family, _, _, _, address in addrinfo]
+            except Exception:
+                self.io_loop.add_callback(future.set_exc_info,
+                                          sys.exc_info())
+            else:
+                self.io_loop.add_callback(future.set_result, result)
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC, callback=None):
+        future = Future()
+        self._requests.put((future, host, port, family))
+        if callback is not None:
+            self.io_loop.add_future(
+                future, lambda future: callback(future.result()))
+        return future
+
+
+class _Entry(object):
+    """A cached lookup result or error"""
+    __slots__ = ('result', 'error', 'expires', 'ttl', 'hits', 'refreshing')
+
+    def __init__(self, result, error, now, ttl):
+        self.result = result
+        self.error = error
+        self.expires = now + ttl
+        self.ttl = ttl
+        self.hits = 0
+        self.refreshing = False
+
+
+class CachingResolver(Resolver):
+    """
+    Cache the addresses of hostnames, so connections to the same hosts don't
+    wait for a DNS lookup each time. Concurrent lookups of a hostname are
+    merged, failed lookups are cached for negative_ttl seconds, and
+    hostnames looked up at least hot_hits times are refreshed in the
+    background when less than refresh_ahead of their TTL is left, so
+    requests to busy hosts never wait for a lookup.
+
+    By default hostnames are resolved by a ThreadResolver. socket.getaddrinfo
+    doesn't return the TTL of the DNS records, so entries are cached for ttl
+    seconds. A resolver which knows the TTL, e.g. one using a DNS library,
+    may have a resolve_ttl method returning a Future resolving to a tuple of
+    the addresses and their TTL, which is used instead, up to ttl seconds.
+
+    Example Usage:
+        >>> resolver = CachingResolver(ttl=30)
+        >>> api = API('https://localhost:8004', resolver=resolver)
+        >>> resolver.stats()
+        {'entries': 1, 'hits': 99, 'misses': 1, 'negative_hits': 0,
+         'refreshes': 1, 'errors': 0, 'hit_rate': 0.99}
+    """
+    def initialize(self, resolver=None, ttl=60, negative_ttl=5,
+                   hot_hits=10, refresh_ahead=0.2, max_entries=1000,
+                   io_loop=None):
+        """
+        :param resolver: (optional) the Resolver doing the lookups, by
+            default a ThreadResolver
+        :param ttl: the maximum number of seconds to cache addresses for
+        :param negative_ttl: the number of seconds to cache failed lookups
+            for
+        :param hot_hits: the number of hits after which a hostname is
+            refreshed in the background
+        :param refresh_ahead: refresh a hot hostname when less than this
+            fraction of its TTL is left
+        :param max_entries: the maximum number of cached hostnames
+        :param io_loop: (optional) the IOLoop
+        """
+        self.io_loop = io_loop or IOLoop.current()
+        if resolver is None:
+            resolver = ThreadResolver(io_loop=self.io_loop)
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hot_hits = hot_hits
+        self.refresh_ahead = refresh_ahead
+        self.max_entries = max_entries
+        self._cache = {}
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    _now = staticmethod(time.time)
+
+    def close(self):
+        self.resolver.close()
+
+    def clear(self):
+        """forget the cached addresses"""
+        self._cache = {}
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC, callback=None):
+        """
+        resolve a hostname, using the cached addresses if they haven't
+        expired
+        :return: a Future resolving to a list of (family, address) pairs
+        """
+        key = (host, port, family)
+        now = self._now()
+        entry = self._cache.get(key)
+        if entry is not None and entry.expires > now:
+            entry.hits += 1
+            future = Future()
+            if entry.error is not None:
+                self.negative_hits += 1
+                future.set_exception(entry.error)
+            else:
+                self.hits += 1
+                future.set_result(entry.result)
+            if (entry.hits >= self.hot_hits and not entry.refreshing and
+                    entry.expires - now < entry.ttl * self.refresh_ahead):
+                entry.refreshing = True
+                self.refreshes += 1
+                self._lookup(key)
+        else:
+            self.misses += 1
+            future = self._pending.get(key)
+            if future is None:
+                future = self._lookup(key)
+
+        if callback is not None:
+            self.io_loop.add_future(
+                future, lambda future: callback(future.result()))
+        return future
+
+    def _lookup(self, key):
+        """look up a hostname and cache the result"""
+        host, port, family = key
+        future = Future()
+        self._pending[key] = future
+        if hasattr(self.resolver, 'resolve_ttl'):
+            lookup = self.resolver.resolve_ttl(host, port, family)
+        else:
+            lookup = self.resolver.resolve(host, port, family)
+        self.io_loop.add_future(
+            lookup, lambda lookup: self._done(key, lookup, future))
+        return future
+
+    def _done(self, key, lookup, future):
+        del self._pending[key]
+        now = self._now()
+        try:
+            result = lookup.result()
+        except Exception as exc:
+            self.errors += 1
+            previous = self._cache.get(key)
+            if previous is not None and previous.refreshing and \
+                    previous.error is None and previous.expires > now:
+                # keep using the addresses until they expire
+                logging.warning('Failed to refresh %s: %s', key[0], exc)
+                previous.refreshing = False
+            else:
+                self._store(key, _Entry(None, exc, now, self.negative_ttl))
+            future.set_exc_info(lookup.exc_info())
+            # the error is cached and handled by the caller, so don't log
+            # it again if there isn't one, e.g. for a refresh
+            future.exception()
+            return
+
+        ttl = self.ttl
+        if hasattr(self.resolver, 'resolve_ttl'):
+            result, record_ttl = result
+            ttl = min(ttl, record_ttl)
+        self._store(key, _Entry(result, None, now, ttl))
+        future.set_result(result)
+
+    def _store(self, key, entry):
+        if key not in self._cache and len(self._cache) >= self.max_entries:
+            # evict the entry closest to expiring
+            oldest = min(self._cache, key=lambda k: self._cache[k].expires)
+            del self._cache[oldest]
+        self._cache[key] = entry
+
+    def stats(self):
+        """
+        get the number of cached hostnames, hits, misses and failed lookups
+        """
+        lookups = self.hits + self.negative_hits + self.misses
+        return {'entries': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'negative_hits': self.negative_hits,
+                'refreshes': self.refreshes,
+                'errors': self.errors,
+                'hit_rate': (self.hits + self.negative_hits) / float(lookups)
+                if lookups else None}
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a retry policy for transient failures of HTTP requests
+"""
+import calendar
+import logging
+import random
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+from tornado.gen import coroutine, Return, sleep
+from tornado.httpclient import HTTPError
+
+from .deadline import current_deadline
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE',
+                                'OPTIONS', 'TRACE'])
+RETRY_STATUSES = frozenset([429, 502, 503, 504, 599])
+
+
+def parse_retry_after(value):
+    """
+    parse the value of a Retry-After header
+    :param value: either delay seconds or an HTTP date
+    :return: the number of seconds to wait, or None if it can't be parsed
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    now = calendar.timegm(time.gmtime())
+    return max(0.0, float(mktime_tz(parsed) - now))
+
+
+class RetryBudget(object):
+    """
+    Limit retries to a ratio of the requests made by a client, so that
+    retries can't amplify the load on a service during an outage.
+
+    Every request deposits `ratio` into the budget and every retry
+    withdraws one. The balance never exceeds `reserve`, which is also the
+    number of retries allowed before any request has been made.
+    """
+    def __init__(self, ratio=0.2, reserve=10):
+        """
+        :param ratio: the proportion of requests that may be retried
+        :param reserve: the maximum number of retries that can be saved up
+        """
+        self.ratio = ratio
+        self.reserve = reserve
+        self._balance = float(reserve)
+
+    @property
+    def balance(self):
+        return self._balance
+
+    def deposit(self):
+        """Record a request"""
+        self._balance = min(self.reserve, self._balance + self.ratio)
+
+    def withdraw(self):
+        """
+        Record a retry
+        :return: False if the budget is exhausted
+        """
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+class RetryPolicy(object):
+    """
+    Retry failed requests with exponential backoff and full jitter.
+
+    Only idempotent methods are retried by default. Retryable failures are
+    connection errors and HTTP errors with one of `statuses`.
+
+    Example Usage:
+        >>> api = API('https://localhost:8004',
+                      retry_policy=RetryPolicy(max_attempts=5))
+        >>> api.offers['1234'].get()
+
+    The policy can be overridden or disabled per call:
+        >>> api.offers['1234'].get(retry_policy=None)
+    """
+    def __init__(self, max_attempts=3, backoff=0.1, max_backoff=10,
+                 methods=IDEMPOTENT_METHODS, statuses=RETRY_STATUSES,
+                 budget=None, max_retry_after=60):
+        """
+        :param max_attempts: the maximum number of attempts, including the
+            first one
+        :param backoff: the base delay in seconds
+        :param max_backoff: the maximum delay in seconds, before jitter
+        :param methods: HTTP methods that can be retried
+        :param statuses: HTTP status codes that can be retried
+        :param budget: (optional) a RetryBudget. A budget is created if one
+            is not provided, share a budget between policies to apply a
+            single budget to them
+        :param max_retry_after: give up if a Retry-After header asks to wait
+            longer than this many seconds
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.methods = frozenset(m.upper() for m in methods)
+        self.statuses = frozenset(statuses)
+        if budget is None:
+            budget = RetryBudget()
+        self.budget = budget
+        self.max_retry_after = max_retry_after
+        self.attempts = 0
+        self.retries = 0
+        self.give_ups = 0
+
+    def retryable(self, method, error):
+        """
+        whether the error is a transient failure that can be retried
+        :param method: the HTTP method of the request
+        :param error: the exception raised by the HTTP client
+        """
+        if method.upper() not in self.methods:
+            return False
+        if isinstance(error, HTTPError):
+            return error.code in self.statuses
+        return isinstance(error, IOError)
+
+    def delay(self, attempt, error=None):
+        """
+        the number of seconds to wait before the next attempt
+        :param attempt: the number of attempts made so far
+        :param error: the exception raised by the last attempt
+        """
+        ceiling = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+        delay = random.uniform(0, ceiling)
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = parse_retry_after(
+                response.headers.get('Retry-After'))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+        return delay
+
+    def next_delay(self, method, attempt, error):
+        """
+        decide whether to retry after a failure and update the counters
+        :param method: the HTTP method of the request
+        :param attempt: the number of attempts made so far
+        :param error: the exception raised by the last attempt
+        :return: the number of seconds to wait, or None to give up
+        """
+        if not self.retryable(method, error):
+            return None
+        delay = self.delay(attempt, error)
+        deadline = current_deadline()
+        if (attempt >= self.max_attempts or
+                delay > self.max_retry_after or
+                (deadline is not None and delay >= deadline.remaining()) or
+                not self.budget.withdraw()):
+            self.give_ups += 1
+            logging.debug('Giving up %s request after %d attempts: %s',
+                          method, attempt, error)
+            return None
+        self.retries += 1
+        logging.debug('Retrying %s request in %.3fs: %s',
+                      method, delay, error)
+        return delay
+
+    def _record_attempt(self, attempt):
+        self.attempts += 1
+        if attempt == 1:
+            self.budget.deposit()
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function, retrying on transient failures
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self._record_attempt(attempt)
+            try:
+                return fetch(request, **kwargs)
+            except Exception as exc:
+                delay = self.next_delay(request.method, attempt, exc)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function, retrying on transient failures
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self._record_attempt(attempt)
+            try:
+                response = yield fetch(request, **kwargs)
+                raise Return(response)
+            except Return:
+                raise
+            except Exception as exc:
+                delay = self.next_delay(request.method, attempt, exc)
+                if delay is None:
+                    raise
+            yield sleep(delay)
+
+    def stats(self):
+        """
+        get the retry counters
+        """
+        return {'attempts': self.attempts,
+                'retries': self.retries,
+                'give_ups': self.give_ups,
+                'budget': self.budget.balance}
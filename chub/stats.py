@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has helpers for keeping track of request latencies
+"""
+import math
+from collections import deque
+
+
+def percentile(values, pct):
+    """
+    get a percentile of some values using the nearest-rank method
+    :param values: an iterable of numbers
+    :param pct: the percentile, between 0 and 100
+    :return: the percentile, or None if there are no values
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(0, rank - 1)]
+
+
+class RollingWindow(object):
+    """
+    The most recent samples of a value, e.g. request latency
+    """
+    def __init__(self, size=200):
+        """
+        :param size: the number of samples to keep
+        """
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value):
+        """Add a sample"""
+        self._samples.append(value)
+
+    def percentile(self, pct):
+        """
+        get a percentile of the samples
+        :param pct: the percentile, between 0 and 100
+        """
+        return percentile(self._samples, pct)
+
+
+class RollingWindows(object):
+    """
+    RollingWindows keyed by e.g. resource
+    """
+    def __init__(self, size=200):
+        """
+        :param size: the number of samples to keep for each key
+        """
+        self.size = size
+        self._windows = {}
+
+    def __getitem__(self, key):
+        if key not in self._windows:
+            self._windows[key] = RollingWindow(self.size)
+        return self._windows[key]
+
+    def __contains__(self, key):
+        return key in self._windows
+
+    def keys(self):
+        return self._windows.keys()
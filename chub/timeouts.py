@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has request timeouts which adapt to the observed latency of
+each resource
+"""
+import copy
+import time
+
+from tornado.gen import coroutine, Return
+from tornado.httpclient import HTTPError
+from tornado.httputil import HTTPHeaders
+
+from .metrics import Metrics
+from .stats import RollingWindows
+
+
+class _ResourceTimeout(object):
+    """Set the timeout of requests to a resource and record their latency"""
+    def __init__(self, policy, key):
+        self.policy = policy
+        self.key = key
+
+    def _request(self, request):
+        timeout = self.policy.timeout(self.key)
+        if timeout is None or request.request_timeout is not None:
+            return request, request.request_timeout
+        request = copy.copy(request)
+        request.headers = HTTPHeaders(request.headers)
+        request.request_timeout = timeout
+        return request, timeout
+
+    def _record(self, start, timeout, error):
+        if isinstance(error, HTTPError) and error.code == 599:
+            if timeout is not None and error.message == 'Timeout':
+                # the latency is at least the timeout, so the timeout grows
+                # if a resource becomes slower
+                self.policy.timeouts[self.key] = \
+                    self.policy.timeouts.get(self.key, 0) + 1
+                self.policy.latencies[self.key].add(timeout)
+            return
+        if error is None or isinstance(error, HTTPError):
+            self.policy.latencies[self.key].add(self.policy._now() - start)
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function with the adaptive timeout
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        request, timeout = self._request(request)
+        start = self.policy._now()
+        try:
+            response = fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(start, timeout, exc)
+            raise
+        self._record(start, timeout, None)
+        return response
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function with the adaptive timeout
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        request, timeout = self._request(request)
+        start = self.policy._now()
+        try:
+            response = yield fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(start, timeout, exc)
+            raise
+        self._record(start, timeout, None)
+        raise Return(response)
+
+
+class AdaptiveTimeout(object):
+    """
+    Set the request timeout of each request to a multiple of the observed
+    percentile of the latency of its method and resource template, within
+    a floor and a ceiling. Cheap resources fail quickly when they are slow,
+    while heavy resources, such as bulk onboarding, get more time.
+
+    Until there are min_samples latencies for a resource the client's
+    request timeout is used. Requests with their own request_timeout are
+    left alone. A request which times out is recorded with the timeout as
+    its latency, so the timeout of a resource that becomes slower grows.
+
+    Example Usage:
+        >>> api = API('https://localhost:8004',
+                      adaptive_timeout=AdaptiveTimeout(multiple=3,
+                                                       floor=0.5))
+        >>> api.adaptive_timeout.stats()
+        {'GET offers/{id}': {'samples': 200, 'p99_ms': 120.0,
+                             'timeout': 0.5, 'timeouts': 0}}
+    """
+    def __init__(self, multiple=3, percentile=99, floor=1, ceiling=60,
+                 min_samples=20, window=200):
+        """
+        :param multiple: the multiple of the latency percentile to use
+        :param percentile: the latency percentile, e.g. 99
+        :param floor: the minimum timeout in seconds
+        :param ceiling: the maximum timeout in seconds
+        :param min_samples: the number of latencies needed to set timeouts
+        :param window: the number of latencies kept for each resource
+        """
+        self.multiple = multiple
+        self.percentile = percentile
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+        self.latencies = RollingWindows(window)
+        self.timeouts = {}
+
+    _now = staticmethod(time.time)
+
+    def timeout(self, key):
+        """
+        the timeout for requests to a resource
+        :param key: the method and resource template, e.g. "GET offers/{id}"
+        :return: the number of seconds, or None if there aren't enough
+            latencies yet
+        """
+        if key not in self.latencies:
+            return None
+        window = self.latencies[key]
+        if len(window) < self.min_samples:
+            return None
+        timeout = self.multiple * window.percentile(self.percentile)
+        return min(self.ceiling, max(self.floor, timeout))
+
+    def resource(self, method, url, template=None):
+        """
+        get an object setting the timeout of a request
+        :param method: the HTTP method
+        :param url: the request url, used if there is no template
+        :param template: (optional) the resource template
+        """
+        return _ResourceTimeout(self, Metrics.key(method, url, template))
+
+    def stats(self):
+        """
+        get the number of latencies, the latency percentile, the timeout and
+        the number of timeouts for each resource
+        """
+        stats = {}
+        for key in self.latencies.keys():
+            value = self.latencies[key].percentile(self.percentile)
+            stats[key] = {
+                'samples': len(self.latencies[key]),
+                'p{}_ms'.format(self.percentile): 1000 * value
+                if value is not None else None,
+                'timeout': self.timeout(key),
+                'timeouts': self.timeouts.get(key, 0)}
+        return stats
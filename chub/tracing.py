@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has hooks for distributed tracing of requests, using W3C
+trace context headers to propagate traces to other services
+"""
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return, maybe_future
+from tornado.httpclient import HTTPError
+from tornado.stack_context import StackContext, run_with_stack_context
+
+TRACEPARENT = 'traceparent'
+TRACEPARENT_RE = re.compile(
+    r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+class _State(threading.local):
+    span = None
+
+_state = _State()
+
+
+def current_span():
+    """
+    get the active span, which is the parent of spans started without an
+    explicit parent
+    """
+    return _state.span
+
+
+class _ActiveSpan(object):
+    """Context manager used by StackContext to make a span active"""
+    def __init__(self, span):
+        self.span = span
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = _state.span
+        _state.span = self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _state.span = self.previous
+
+
+class SpanContext(object):
+    """
+    The identity of a span that is propagated to other services
+    """
+    def __init__(self, trace_id, span_id, sampled):
+        """
+        :param trace_id: 32 hex characters
+        :param span_id: 16 hex characters
+        :param sampled: whether the trace is recorded
+        """
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def __repr__(self):
+        return '<SpanContext {}>'.format(self.traceparent())
+
+    def traceparent(self):
+        """
+        get the W3C traceparent header value
+        """
+        return '00-{}-{}-{}'.format(self.trace_id, self.span_id,
+                                    '01' if self.sampled else '00')
+
+    @classmethod
+    def from_traceparent(cls, header):
+        """
+        parse a W3C traceparent header, e.g. from an incoming request
+        :return: a SpanContext, or None if the header isn't valid
+        """
+        match = TRACEPARENT_RE.match((header or '').strip().lower())
+        if not match:
+            return None
+        trace_id, span_id, flags = match.groups()
+        return cls(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+class Span(object):
+    """
+    A timed operation, such as a request
+    """
+    def __init__(self, tracer, name, context, parent_id=None):
+        """
+        :param tracer: the Tracer that created the span
+        :param name: the operation name
+        :param context: the SpanContext
+        :param parent_id: (optional) the span ID of the parent span
+        """
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.error = None
+        self.attempts = 0
+        self.start_time = time.time()
+        self.end_time = None
+
+    def __repr__(self):
+        return '<Span {} {}>'.format(self.name, self.context.traceparent())
+
+    @property
+    def duration(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def set_attribute(self, key, value):
+        """Set an attribute if the span is sampled"""
+        if self.context.sampled:
+            self.attributes[key] = value
+
+    def inject(self, request):
+        """
+        add the traceparent header for the span to an HTTPRequest
+        """
+        request.headers[TRACEPARENT] = self.context.traceparent()
+
+    def finish(self, error=None):
+        """
+        finish the span and hand it to the exporter if it is sampled
+        :param error: (optional) the exception that ended the operation
+        """
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if error is not None:
+            self.error = error
+            self.set_attribute('error', repr(error))
+        if self.context.sampled:
+            self.tracer.export(self)
+
+    def _record(self, request, response, error):
+        if isinstance(error, HTTPError):
+            response = error.response
+            self.set_attribute('http.status_code', error.code)
+        elif response is not None:
+            self.set_attribute('http.status_code', response.code)
+        self.set_attribute('chub.retries', self.attempts - 1)
+        self.set_attribute('http.request_content_length',
+                           len(request.body or ''))
+        if response is not None:
+            self.set_attribute('http.response_content_length',
+                               len(response.body or ''))
+
+    def sync_call(self, fetch, request, **kwargs):
+        """
+        call a synchronous fetch function and record the attempt on the span
+        :param fetch: the fetch function, e.g. HTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        self.attempts += 1
+        try:
+            response = fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(request, None, exc)
+            raise
+        self._record(request, response, None)
+        return response
+
+    @coroutine
+    def async_call(self, fetch, request, **kwargs):
+        """
+        call an asynchronous fetch function and record the attempt on the
+        span
+        :param fetch: the fetch function, e.g. AsyncHTTPClient.fetch
+        :param request: an HTTPRequest object
+        """
+        self.attempts += 1
+        try:
+            response = yield fetch(request, **kwargs)
+        except Exception as exc:
+            self._record(request, None, exc)
+            raise
+        self._record(request, response, None)
+        raise Return(response)
+
+
+class Exporter(object):
+    """
+    An exporter which drops finished spans, e.g. to keep trace context
+    propagation without collecting spans. Subclasses override export to
+    send spans somewhere, e.g. to a tracing backend
+    """
+    def export(self, span):
+        """
+        export a finished span
+        :param span: the Span
+        """
+
+
+class InMemoryExporter(Exporter):
+    """
+    Keep finished spans in memory, e.g. for tests
+    """
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        """Remove the exported spans"""
+        self.spans = []
+
+
+class Tracer(object):
+    """
+    Create spans for requests and hand finished spans to an exporter.
+
+    A span is created for each request made with the API, as a child of the
+    active span, and the traceparent header is added to the request. Only
+    sampled spans have attributes and are exported, and new traces are
+    sampled at sample_rate, so tracing is cheap at high request rates.
+
+    Example Usage:
+        >>> tracer = Tracer(InMemoryExporter(), sample_rate=0.01)
+        >>> api = API('https://localhost:8004', tracer=tracer)
+
+    Make a span active for a coroutine and the requests it makes:
+        >>> parent = SpanContext.from_traceparent(
+                handler.request.headers.get('traceparent'))
+        >>> yield tracer.run('get offer', get_offer, '1234', parent=parent)
+
+    Or for synchronous code:
+        >>> with tracer.span('get offer'):
+                api.offers['1234'].get()
+    """
+    def __init__(self, exporter=None, sample_rate=1.0):
+        """
+        :param exporter: (optional) an Exporter, by default an Exporter
+            dropping finished spans
+        :param sample_rate: the ratio of new traces that are sampled
+        """
+        if exporter is None:
+            exporter = Exporter()
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start_span(self, name, parent=None):
+        """
+        start a span
+        :param name: the operation name
+        :param parent: (optional) the parent Span or SpanContext. Defaults to
+            the active span
+        """
+        if parent is None:
+            parent = current_span()
+        if isinstance(parent, Span):
+            parent = parent.context
+        span_id = '{:016x}'.format(random.getrandbits(64))
+        if parent is None:
+            context = SpanContext('{:032x}'.format(random.getrandbits(128)),
+                                  span_id,
+                                  random.random() < self.sample_rate)
+            return Span(self, name, context)
+        context = SpanContext(parent.trace_id, span_id, parent.sampled)
+        return Span(self, name, context, parent.span_id)
+
+    def request_span(self, request, resource_template=None):
+        """
+        start a span for an HTTPRequest and inject the traceparent header
+        :param request: the HTTPRequest
+        :param resource_template: (optional) the resource template
+        """
+        span = self.start_span(request.method)
+        span.set_attribute('http.method', request.method)
+        span.set_attribute('http.url', request.url)
+        if resource_template is not None:
+            span.set_attribute('chub.resource', resource_template)
+        span.inject(request)
+        return span
+
+    def export(self, span):
+        """
+        hand a finished span to the exporter
+        """
+        try:
+            self.exporter.export(span)
+        except Exception:
+            logging.exception('Error exporting span %r', span)
+
+    @contextmanager
+    def span(self, name, parent=None):
+        """
+        context manager making a new span active in synchronous code
+        :param name: the operation name
+        :param parent: (optional) the parent Span or SpanContext
+        """
+        span = self.start_span(name, parent)
+        with _ActiveSpan(span):
+            try:
+                yield span
+            except Exception as exc:
+                span.finish(exc)
+                raise
+        span.finish()
+
+    def run(self, name, func, *args, **kwargs):
+        """
+        call a function, e.g. a coroutine, with a new span active. The span
+        stays active in callbacks and coroutines started by the function
+        and is finished when its result is ready.
+        :param name: the operation name
+        :param func: the function
+        :param parent: (optional) the parent Span or SpanContext
+        :return: a Future with the result of the function
+        """
+        span = self.start_span(name, kwargs.pop('parent', None))
+        result = Future()
+
+        def done(future):
+            error = future.exception()
+            span.finish(error)
+            if error is not None:
+                result.set_exc_info(future.exc_info())
+            else:
+                result.set_result(future.result())
+
+        def call():
+            future = maybe_future(func(*args, **kwargs))
+            future.add_done_callback(done)
+
+        try:
+            run_with_stack_context(
+                StackContext(partial(_ActiveSpan, span)), call)
+        except Exception as exc:
+            span.finish(exc)
+            raise
+        return result
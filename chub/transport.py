@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has pluggable transports used beneath the HTTP clients, and an
+in-process loopback transport that routes requests without any sockets
+"""
+import json
+import random
+import re
+import time
+from io import BytesIO
+from urlparse import urlparse
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return
+from tornado.httpclient import AsyncHTTPClient, HTTPClient, HTTPResponse
+from tornado.httputil import (HTTPConnection, HTTPHeaders, RequestStartLine,
+                              responses)
+
+
+class TransportHTTPClient(AsyncHTTPClient):
+    """
+    An AsyncHTTPClient that hands requests to a Transport instead of
+    opening connections
+    """
+    def initialize(self, io_loop, defaults=None, transport=None):
+        super(TransportHTTPClient, self).initialize(io_loop, defaults)
+        self.transport = transport
+
+    def fetch_impl(self, request, callback):
+        start = time.time()
+
+        def done(future):
+            try:
+                response = future.result()
+            except Exception as exc:
+                response = HTTPResponse(request, 599, error=exc,
+                                        request_time=time.time() - start)
+            callback(response)
+
+        try:
+            future = gen.maybe_future(self.transport.fetch(request))
+        except Exception as exc:
+            future = Future()
+            future.set_exception(exc)
+        self.io_loop.add_future(future, done)
+
+
+class Transport(object):
+    """
+    Base class for transports. Subclasses override fetch, which takes an
+    HTTPRequest and returns an HTTPResponse or a Future resolving to one.
+    Responses with an error status are raised as HTTPErrors and other
+    exceptions are treated as connection errors, as with the default
+    clients. This transport responds to every request with 501 Not
+    Implemented.
+
+    Example Usage:
+        >>> api = API('https://localhost:8004', transport=MyTransport())
+    """
+    def fetch(self, request):
+        """
+        send a request
+        :param request: the HTTPRequest
+        :return: an HTTPResponse, or a Future resolving to one
+        """
+        return _respond(request, (501, ''), time.time())
+
+    def async_client(self, **kwargs):
+        """
+        create an AsyncHTTPClient using the transport
+        :param kwargs: passed to the client, e.g. defaults
+        """
+        return TransportHTTPClient(force_instance=True, transport=self,
+                                   **kwargs)
+
+    def sync_client(self, **kwargs):
+        """
+        create an HTTPClient using the transport
+        :param kwargs: passed to the client, e.g. defaults
+        """
+        return HTTPClient(async_client_class=TransportHTTPClient,
+                          force_instance=True, transport=self, **kwargs)
+
+
+class _LoopbackConnection(HTTPConnection):
+    """Collect the response written by a Tornado RequestHandler"""
+    def __init__(self):
+        self.start_line = None
+        self.headers = None
+        self.chunks = []
+        self.future = Future()
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write_headers(self, start_line, headers, chunk=None, callback=None):
+        self.start_line = start_line
+        self.headers = headers
+        return self.write(chunk, callback)
+
+    def write(self, chunk, callback=None):
+        if chunk:
+            self.chunks.append(chunk)
+        if callback is not None:
+            callback()
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def finish(self):
+        self.future.set_result(self)
+
+
+def _respond(request, result, start):
+    """convert the result of a handler function into an HTTPResponse"""
+    if isinstance(result, HTTPResponse):
+        return result
+    code, headers = 200, {}
+    if isinstance(result, tuple):
+        if len(result) == 3:
+            code, result, headers = result
+        else:
+            code, result = result
+    headers = HTTPHeaders(headers)
+    if not isinstance(result, basestring):
+        result = json.dumps(result)
+        headers.setdefault('Content-Type', 'application/json')
+    if isinstance(result, unicode):
+        result = result.encode('utf-8')
+    return HTTPResponse(request, code, headers=headers,
+                        buffer=BytesIO(result), effective_url=request.url,
+                        request_time=time.time() - start)
+
+
+class LoopbackTransport(Transport):
+    """
+    Route requests in-process to registered handler functions or a Tornado
+    Application, with optional injected latency and errors. Nothing is
+    sent over the network, so the client's own overhead, scheduling and
+    caching can be profiled and simulated deterministically.
+
+    Handler functions take the HTTPRequest and the groups matched by the
+    path pattern and return (or return a Future resolving to) either an
+    HTTPResponse, a body, or a tuple of (status, body) or
+    (status, body, headers). Bodies that aren't strings are sent as JSON.
+
+    Example Usage:
+        >>> transport = LoopbackTransport(latency=0.005,
+                                          errors={503: 0.01},
+                                          seed=1)
+        >>> transport.route('GET', '/v1/repository/offers/([^/]+)',
+                            lambda request, offer_id: {'data': {}})
+        >>> api = API('https://localhost:8004', transport=transport)
+
+    Or route requests to an application:
+        >>> transport = LoopbackTransport(app=Application(handlers))
+
+    Latency may be a number of seconds or a function returning one, which
+    is called with the transport's random number generator so that runs
+    with the same seed are repeatable:
+        >>> LoopbackTransport(latency=lambda rng: rng.expovariate(200))
+    """
+    def __init__(self, app=None, latency=None, errors=None, seed=None):
+        """
+        :param app: (optional) a Tornado Application handling requests that
+            don't match a route
+        :param latency: (optional) the latency added to each request, in
+            seconds or a function of a random.Random returning seconds
+        :param errors: (optional) a dictionary of the ratio of requests
+            failing with each error, keyed by an HTTP status code or an
+            exception, e.g. {503: 0.01, IOError: 0.001}
+        :param seed: (optional) a seed for the random number generator
+        """
+        self.app = app
+        self.latency = latency
+        self.errors = errors or {}
+        self.random = random.Random(seed)
+        self.routes = []
+        self.requests = 0
+        self.injected_errors = 0
+
+    def route(self, method, pattern, handler):
+        """
+        register a handler function
+        :param method: the HTTP method, or None for any method
+        :param pattern: a regular expression matching the whole path
+        :param handler: the handler function
+        """
+        self.routes.append((method and method.upper(),
+                            re.compile(pattern + '$'), handler))
+
+    def _delay(self):
+        if callable(self.latency):
+            return self.latency(self.random)
+        return self.latency or 0
+
+    def _error(self):
+        value = self.random.random()
+        for error, ratio in sorted(self.errors.items(),
+                                   key=lambda item: str(item[0])):
+            if value < ratio:
+                return error
+            value -= ratio
+        return None
+
+    @coroutine
+    def fetch(self, request):
+        self.requests += 1
+        start = time.time()
+        delay = self._delay()
+        if delay > 0:
+            yield gen.sleep(delay)
+
+        error = self._error()
+        if error is not None:
+            self.injected_errors += 1
+            if isinstance(error, int):
+                raise Return(_respond(request, (error, ''), start))
+            raise error()
+
+        path = urlparse(request.url).path
+        for method, regex, handler in self.routes:
+            match = regex.match(path)
+            if match and method in (None, request.method):
+                result = yield gen.maybe_future(
+                    handler(request, *match.groups()))
+                raise Return(_respond(request, result, start))
+
+        if self.app is None:
+            raise Return(_respond(request, (404, ''), start))
+        response = yield self._call_app(request, start)
+        raise Return(response)
+
+    @coroutine
+    def _call_app(self, request, start):
+        parsed = urlparse(request.url)
+        uri = parsed.path + ('?' + parsed.query if parsed.query else '')
+        headers = HTTPHeaders(request.headers)
+        headers.setdefault('Host', parsed.netloc)
+        body = request.body or b''
+        if body:
+            headers['Content-Length'] = str(len(body))
+
+        connection = _LoopbackConnection()
+        delegate = self.app.start_request(None, connection)
+        delegate.headers_received(
+            RequestStartLine(request.method, uri, 'HTTP/1.1'), headers)
+        if body:
+            delegate.data_received(body)
+        delegate.finish()
+        yield connection.future
+
+        code = connection.start_line.code
+        raise Return(HTTPResponse(
+            request, code,
+            reason=connection.start_line.reason or responses.get(code),
+            headers=connection.headers,
+            buffer=BytesIO(b''.join(connection.chunks)),
+            effective_url=request.url,
+            request_time=time.time() - start))
+
+    def stats(self):
+        """
+        get the number of requests and injected errors
+        """
+        return {'requests': self.requests,
+                'injected_errors': self.injected_errors}
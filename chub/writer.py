@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+this module has a write-behind writer that buffers records and POSTs them
+in batches
+"""
+import logging
+from collections import deque
+
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return, maybe_future, sleep
+from tornado.ioloop import IOLoop
+from tornado.queues import QueueFull
+
+from .retry import RetryPolicy
+
+
+class Writer(object):
+    """
+    Buffer records and POST them to a resource in batches, so producers
+    don't wait for a round trip per record. A batch is sent when there are
+    batch_size records queued, or flush_interval seconds after a record is
+    queued, with up to max_in_flight batches sent at once. Failed batches
+    are retried with the retry policy.
+
+    write() returns a Future for the delivery of the record, or raises
+    QueueFull if max_queue records are waiting. put() waits for room
+    instead, which slows the producer down to the rate the server accepts
+    records:
+        >>> writer = api.repository.repositories['1234'].assets.writer(
+                batch_size=500)
+        >>> for asset in assets:
+                delivery = yield writer.put(asset)
+        >>> yield writer.flush()
+
+    Each batch is sent as {key: [records]}. If the response data is a list
+    with an item for each record, each record's Future resolves to its
+    item, otherwise to the response. The results are also passed to an
+    optional callback(records, response, error).
+    """
+    def __init__(self, resource, key='data', batch_size=100,
+                 flush_interval=1.0, max_queue=10000, max_in_flight=2,
+                 retry_policy=None, callback=None, send=None, io_loop=None):
+        """
+        :param resource: the Resource to POST to
+        :param key: the key of the list of records in the request body
+        :param batch_size: the maximum number of records in a batch
+        :param flush_interval: the maximum number of seconds a record waits
+            for a batch to fill up
+        :param max_queue: the maximum number of records waiting to be sent
+        :param max_in_flight: the maximum number of batches being sent
+        :param retry_policy: (optional) a RetryPolicy for failed batches, by
+            default retrying 3 attempts with backoff
+        :param callback: (optional) a function called with the records, the
+            response and the error when a batch is done
+        :param send: (optional) a function taking a list of records and
+            returning a Future, used instead of POSTing to the resource
+        :param io_loop: (optional) the IOLoop
+        """
+        self.resource = resource
+        self.key = key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight
+        if retry_policy is None:
+            retry_policy = RetryPolicy(methods=['POST'])
+        self.retry_policy = retry_policy
+        self.callback = callback
+        self.send = send
+        self.io_loop = io_loop or IOLoop.current()
+        self.in_flight = 0
+        self.sent_batches = 0
+        self.sent_records = 0
+        self.failed_batches = 0
+        self.failed_records = 0
+        self._queue = deque()
+        self._waiting = deque()
+        self._idle = []
+        self._timeout = None
+        # the number of queued records to send without waiting for a full
+        # batch, because their flush interval has passed
+        self._due = 0
+        self._closed = False
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def write(self, record):
+        """
+        queue a record without waiting
+        :param record: the record, e.g. a dictionary
+        :return: a Future resolving when the record is delivered
+        :raises QueueFull: if max_queue records are waiting
+        """
+        if self._closed:
+            raise ValueError('Writer is closed')
+        if len(self._queue) >= self.max_queue:
+            raise QueueFull()
+        future = Future()
+        self._queue.append((record, future))
+        self._send_batches()
+        return future
+
+    @coroutine
+    def put(self, record):
+        """
+        queue a record, waiting while the queue is full
+        :param record: the record, e.g. a dictionary
+        :return: a Future resolving to a Future for the delivery of the
+            record
+        """
+        while len(self._queue) >= self.max_queue:
+            waiter = Future()
+            self._waiting.append(waiter)
+            yield waiter
+        raise Return(self.write(record))
+
+    @coroutine
+    def flush(self):
+        """
+        send all the queued records and wait until they are delivered
+        """
+        if not self._queue and not self.in_flight:
+            return
+        idle = Future()
+        self._idle.append(idle)
+        self._send_batches()
+        yield idle
+
+    @coroutine
+    def close(self):
+        """
+        flush the queued records and stop accepting new ones
+        """
+        self._closed = True
+        yield self.flush()
+
+    def _on_timeout(self):
+        self._timeout = None
+        self._due = len(self._queue)
+        self._send_batches()
+
+    def _send_batches(self):
+        # while flushing every record is due
+        while (self._queue and self.in_flight < self.max_in_flight and
+               (self._due or self._idle or
+                len(self._queue) >= self.batch_size)):
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            self._due = max(0, self._due - count)
+            self._deliver(batch)
+
+        if not self._queue:
+            self._due = 0
+            if self._timeout is not None:
+                self.io_loop.remove_timeout(self._timeout)
+                self._timeout = None
+        elif self._timeout is None and not self._due:
+            self._timeout = self.io_loop.call_later(self.flush_interval,
+                                                    self._on_timeout)
+
+        while self._waiting and len(self._queue) < self.max_queue:
+            self._waiting.popleft().set_result(None)
+
+    def _post(self, records):
+        if self.send is not None:
+            return maybe_future(self.send(records))
+        return self.resource.post(**{self.key: records})
+
+    @coroutine
+    def _deliver(self, batch):
+        self.in_flight += 1
+        records = [record for record, _ in batch]
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = yield self._post(records)
+            except Exception as exc:
+                delay = self.retry_policy.next_delay('POST', attempt, exc)
+                if delay is None:
+                    self._done(batch, None, exc)
+                    break
+                yield sleep(delay)
+            else:
+                self._done(batch, response, None)
+                break
+
+        self.in_flight -= 1
+        self._send_batches()
+        if not self._queue and not self.in_flight:
+            idle, self._idle = self._idle, []
+            for future in idle:
+                future.set_result(None)
+
+    def _done(self, batch, response, error):
+        records = [record for record, _ in batch]
+        if error is not None:
+            self.failed_batches += 1
+            self.failed_records += len(batch)
+            logging.warning('Failed to send %d records: %s', len(batch),
+                            error)
+            for _, future in batch:
+                future.set_exception(error)
+                # the failure is logged here, so don't log it again if the
+                # producer ignores the Future
+                future.exception()
+        else:
+            self.sent_batches += 1
+            self.sent_records += len(batch)
+            data = response.get('data') if isinstance(response, dict) \
+                else None
+            if isinstance(data, list) and len(data) == len(batch):
+                results = data
+            else:
+                results = [response] * len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+        if self.callback is not None:
+            try:
+                self.callback(records, response, error)
+            except Exception:
+                logging.exception('Error in writer callback')
+
+    def stats(self):
+        """
+        get the queue depth and the number of batches and records sent
+        """
+        return {'queued': len(self._queue),
+                'in_flight': self.in_flight,
+                'sent_batches': self.sent_batches,
+                'sent_records': self.sent_records,
+                'failed_batches': self.failed_batches,
+                'failed_records': self.failed_records,
+                'retries': self.retry_policy.retries}
@@ -9,8 +9,8 @@
 # 
 
 from tornado.httpclient import AsyncHTTPClient, HTTPClient
-from chub import API
-from chub.api import API_VERSION
+from chub import API, LoopbackTransport
+from chub.api import API_VERSION, Accounts
 from mock import patch
 import pytest
 
@@ -49,6 +49,19 @@ def test_with_token(header, token):
     assert api.default_headers['Authorization'] == header
 
 
+def test_login_sets_bearer_token():
+    transport = LoopbackTransport()
+    transport.route('POST', '/v1/accounts/login',
+                    lambda request: {'status': 200,
+                                     'data': {'token': 'a token'}})
+    api = Accounts('http://example.com/', async=False, transport=transport)
+
+    api.login('user@example.com', 'password')
+
+    assert api.token == 'a token'
+    assert api.default_headers['Authorization'] == 'Bearer a token'
+
+
 @patch('chub.api.partial')
 def test_request(mock_partial):
 
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+from urlparse import urlparse
+
+import pytest
+from tornado.httpclient import HTTPError
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, LoadBalancer, LoopbackTransport
+from chub.breaker import CircuitBreaker, CLOSED, OPEN
+
+
+class TestLoadBalancer(AsyncTestCase):
+    def setUp(self):
+        super(TestLoadBalancer, self).setUp()
+        self.hosts = []
+        self.down = set()
+        self.transport = LoopbackTransport()
+        self.transport.route(None, '/v1/offers/([^/]+)', self.offer)
+        self.now = 1000.0
+        self.balancer = LoadBalancer(failure_threshold=2, ejection_time=10)
+        self.balancer._now = lambda: self.now
+        self.api = API(['http://a.example.com', 'http://b.example.com'],
+                       transport=self.transport,
+                       load_balancer=self.balancer)
+
+    def offer(self, request, offer_id):
+        host = urlparse(request.url).netloc
+        self.hosts.append(host)
+        if host in self.down:
+            return 503, {'status': 503}
+        return {'status': 200, 'data': {'id': offer_id, 'host': host}}
+
+    def test_creates_load_balancer_for_a_list(self):
+        api = API(['http://a.example.com', 'http://b.example.com'],
+                  transport=self.transport)
+
+        assert isinstance(api.load_balancer, LoadBalancer)
+        assert api.load_balancer.base_urls == ['http://a.example.com/v1',
+                                               'http://b.example.com/v1']
+        assert api.base_url == 'http://a.example.com/v1'
+
+    def test_unknown_strategy(self):
+        with pytest.raises(ValueError):
+            LoadBalancer(strategy='random')
+
+    @gen_test
+    def test_spreads_requests(self):
+        for _ in range(4):
+            yield self.api.offers['1'].get()
+
+        assert sorted(self.hosts) == ['a.example.com'] * 2 + \
+            ['b.example.com'] * 2
+
+    @gen_test
+    def test_least_outstanding(self):
+        a, b = self.balancer.endpoints
+        a.outstanding = 3
+
+        response = yield self.api.offers['1'].get()
+
+        assert response['data']['host'] == 'b.example.com'
+
+    @gen_test
+    def test_ewma(self):
+        self.balancer.strategy = 'ewma'
+        a, b = self.balancer.endpoints
+        a.ewma = 0.2
+        b.ewma = 0.05
+
+        response = yield self.api.offers['1'].get()
+
+        assert response['data']['host'] == 'b.example.com'
+        assert b.ewma < 0.05
+
+    @gen_test
+    def test_fails_over_idempotent_requests(self):
+        self.down.add('a.example.com')
+        a, b = self.balancer.endpoints
+        a.outstanding = -1
+
+        response = yield self.api.offers['1'].get()
+
+        assert response['data']['host'] == 'b.example.com'
+        assert self.hosts == ['a.example.com', 'b.example.com']
+        assert self.balancer.stats()['failovers'] == 1
+
+    @gen_test
+    def test_does_not_fail_over_post(self):
+        self.down.add('a.example.com')
+        a, b = self.balancer.endpoints
+        a.outstanding = -1
+
+        with pytest.raises(HTTPError):
+            yield self.api.offers['1'].post(name='x')
+        assert self.hosts == ['a.example.com']
+
+    @gen_test
+    def test_does_not_fail_over_client_errors(self):
+        self.transport.route('GET', '/v1/missing', lambda request: (404, {}))
+
+        with pytest.raises(HTTPError):
+            yield self.api.missing.get()
+        assert self.balancer.stats()['failovers'] == 0
+
+    @gen_test
+    def test_ejects_and_readmits(self):
+        self.down.add('a.example.com')
+        for _ in range(4):
+            yield self.api.offers['1'].get()
+
+        stats = self.balancer.stats()['endpoints']
+        assert stats['http://a.example.com/v1']['ejected']
+        assert stats['http://a.example.com/v1']['ejections'] == 1
+
+        del self.hosts[:]
+        for _ in range(3):
+            yield self.api.offers['1'].get()
+        assert self.hosts == ['b.example.com'] * 3
+
+        self.down.clear()
+        self.now += 11
+        for _ in range(4):
+            yield self.api.offers['1'].get()
+        assert 'a.example.com' in self.hosts[3:]
+        stats = self.balancer.stats()['endpoints']
+        assert not stats['http://a.example.com/v1']['ejected']
+        assert stats['http://a.example.com/v1']['ejections'] == 0
+
+    @gen_test
+    def test_ejection_time_doubles(self):
+        a, b = self.balancer.endpoints
+        self.down.add('a.example.com')
+        self.balancer.max_failovers = 0
+        while not a.ejected(self.now):
+            try:
+                yield self.api.offers['1'].get()
+            except HTTPError:
+                pass
+        assert a.ejected_until == self.now + 10
+
+        self.now += 11
+        b.outstanding = 1
+        with pytest.raises(HTTPError):
+            yield self.api.offers['1'].get()
+        assert a.ejected_until == self.now + 20
+
+    @gen_test
+    def test_uses_an_ejected_endpoint_if_all_are_ejected(self):
+        self.down.update(['a.example.com', 'b.example.com'])
+        for endpoint in self.balancer.endpoints:
+            endpoint.failures = 2
+            endpoint.ejected_until = self.now + 5
+        self.balancer.endpoints[1].ejected_until = self.now + 1
+
+        with pytest.raises(HTTPError):
+            yield self.api.offers['1'].get()
+        assert self.hosts == ['b.example.com']
+
+    @gen_test
+    def test_circuit_for_each_endpoint(self):
+        self.down.add('a.example.com')
+        breaker = CircuitBreaker(min_requests=2)
+        self.balancer.failure_threshold = 100
+        api = API(['http://a.example.com', 'http://b.example.com'],
+                  transport=self.transport, load_balancer=self.balancer,
+                  circuit_breaker=breaker)
+
+        for _ in range(6):
+            response = yield api.offers['1'].get()
+            assert response['data']['host'] == 'b.example.com'
+
+        assert breaker.state('a.example.com') == OPEN
+        assert breaker.state('b.example.com') == CLOSED
+        assert self.hosts.count('a.example.com') == 2
+        assert self.hosts.count('b.example.com') == 6
+
+    def test_sync(self):
+        api = API(['http://a.example.com', 'http://b.example.com'],
+                  async=False, transport=self.transport)
+        self.down.add('a.example.com')
+        a, b = api.load_balancer.endpoints
+        a.outstanding = -1
+
+        response = api.offers['1'].get()
+
+        assert response['data']['host'] == 'b.example.com'
+        assert api.load_balancer.stats()['endpoints'][
+            'http://b.example.com/v1']['requests'] == 1
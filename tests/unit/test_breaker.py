@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import socket
+
+import pytest
+from mock import Mock, patch
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPRequest
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API
+from chub.breaker import (CircuitBreaker, CircuitOpenError,
+                          CLOSED, OPEN, HALF_OPEN)
+from chub.handlers import sync_fetch
+
+
+def request(url='http://example.com/v1/offers'):
+    return HTTPRequest(url, 'GET')
+
+
+def fail(breaker, count, error=None):
+    fetch = Mock(side_effect=error or HTTPError(503))
+    for _ in range(count):
+        with pytest.raises(Exception):
+            breaker.sync_call(fetch, request())
+
+
+def succeed(breaker, count):
+    fetch = Mock(return_value='response')
+    for _ in range(count):
+        breaker.sync_call(fetch, request())
+
+
+@pytest.fixture
+def now(request):
+    now_patch = patch.object(CircuitBreaker, '_now')
+    _now = now_patch.start()
+    _now.return_value = 1000.0
+    request.addfinalizer(now_patch.stop)
+    return _now
+
+
+@pytest.mark.parametrize('url,per_path,key', [
+    ('http://example.com/v1/offers?id=1', False, 'example.com'),
+    ('http://example.com:8004/v1/offers', False, 'example.com:8004'),
+    ('http://example.com/v1/offers?id=1', True, 'example.com/v1/offers'),
+])
+def test_key(url, per_path, key):
+    assert CircuitBreaker(per_path=per_path).key(url) == key
+
+
+@pytest.mark.parametrize('url,template,key', [
+    ('http://example.com/v1/offers/1?a=b', 'offers/{id}',
+     'example.com/v1/offers/{id}'),
+    ('http://example.com/v1/offers/1/sets', 'offers/{id}/sets',
+     'example.com/v1/offers/{id}/sets'),
+    ('http://example.com/v1', '', 'example.com/v1'),
+])
+def test_key_template(url, template, key):
+    assert CircuitBreaker(per_path=True).key(url, template) == key
+
+
+def test_trips_on_failure_rate(now):
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=4)
+    succeed(breaker, 2)
+    fail(breaker, 1)
+    assert breaker.state('example.com') == CLOSED
+    fail(breaker, 1)
+    assert breaker.state('example.com') == OPEN
+
+
+def test_does_not_trip_before_min_requests(now):
+    breaker = CircuitBreaker(failure_rate=0.5, min_requests=4)
+    fail(breaker, 3)
+    assert breaker.state('example.com') == CLOSED
+
+
+def test_client_errors_are_not_failures(now):
+    breaker = CircuitBreaker(min_requests=2)
+    fail(breaker, 4, HTTPError(404))
+    assert breaker.state('example.com') == CLOSED
+
+
+def test_connection_errors_are_failures(now):
+    breaker = CircuitBreaker(min_requests=2)
+    fail(breaker, 2, socket.error())
+    assert breaker.state('example.com') == OPEN
+
+
+def test_trips_on_slow_calls(now):
+    breaker = CircuitBreaker(slow_call_duration=1, slow_call_rate=0.5,
+                             min_requests=2)
+
+    def slow_fetch(request):
+        now.return_value += 2
+        return 'response'
+
+    breaker.sync_call(slow_fetch, request())
+    breaker.sync_call(slow_fetch, request())
+    assert breaker.state('example.com') == OPEN
+
+
+def test_open_fails_fast(now):
+    breaker = CircuitBreaker(min_requests=2, reset_timeout=30)
+    fail(breaker, 2)
+    fetch = Mock()
+    now.return_value += 10
+
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.sync_call(fetch, request())
+
+    assert not fetch.called
+    assert exc.value.key == 'example.com'
+    assert exc.value.retry_after == 20
+
+
+def test_half_open_probe_closes(now):
+    breaker = CircuitBreaker(min_requests=2, reset_timeout=30)
+    fail(breaker, 2)
+    now.return_value += 30
+    succeed(breaker, 1)
+    assert breaker.state('example.com') == CLOSED
+
+
+def test_half_open_probe_reopens(now):
+    breaker = CircuitBreaker(min_requests=2, reset_timeout=30)
+    fail(breaker, 2)
+    now.return_value += 30
+    fail(breaker, 1)
+    assert breaker.state('example.com') == OPEN
+
+
+def test_half_open_limits_probes(now):
+    breaker = CircuitBreaker(min_requests=2, reset_timeout=30)
+    fail(breaker, 2)
+    now.return_value += 30
+    circuit = breaker.circuit('http://example.com')
+    circuit.before_call()
+    assert circuit.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+
+
+def test_listeners(now):
+    breaker = CircuitBreaker(min_requests=2, reset_timeout=30)
+    listener = Mock()
+    breaker.add_listener(listener)
+    fail(breaker, 2)
+    now.return_value += 30
+    succeed(breaker, 1)
+
+    assert [c[0] for c in listener.call_args_list] == [
+        ('example.com', CLOSED, OPEN),
+        ('example.com', OPEN, HALF_OPEN),
+        ('example.com', HALF_OPEN, CLOSED)]
+
+
+def test_hosts_are_independent(now):
+    breaker = CircuitBreaker(min_requests=2)
+    fail(breaker, 2)
+    breaker.sync_call(Mock(), request('http://other.example.com'))
+    assert breaker.stats() == {
+        'example.com': {'state': OPEN, 'requests': 0,
+                        'failure_rate': 0.0, 'slow_call_rate': 0.0},
+        'other.example.com': {'state': CLOSED, 'requests': 1,
+                              'failure_rate': 0.0, 'slow_call_rate': 0.0}}
+
+
+def test_sync_fetch_with_breaker(now):
+    breaker = CircuitBreaker(min_requests=2)
+    fail(breaker, 2)
+    httpclient = Mock()
+    with pytest.raises(CircuitOpenError):
+        sync_fetch('http://example.com/v1/offers', 'GET',
+                   httpclient=httpclient, chub_circuit_breaker=breaker)
+    assert not httpclient.fetch.called
+
+
+def test_sync_fetch_entities_share_a_circuit(now):
+    breaker = CircuitBreaker(min_requests=2, per_path=True)
+    httpclient = Mock()
+    httpclient.fetch.side_effect = HTTPError(503)
+    for entity_id in ('1', '2'):
+        with pytest.raises(HTTPError):
+            sync_fetch('http://example.com/v1/offers/' + entity_id, 'GET',
+                       httpclient=httpclient, chub_circuit_breaker=breaker,
+                       chub_resource_template='offers/{id}')
+    assert breaker.state('example.com/v1/offers/{id}') == OPEN
+    assert breaker.stats().keys() == ['example.com/v1/offers/{id}']
+    with pytest.raises(CircuitOpenError):
+        sync_fetch('http://example.com/v1/offers/3', 'GET',
+                   httpclient=httpclient, chub_circuit_breaker=breaker,
+                   chub_resource_template='offers/{id}')
+
+
+def test_api_circuit_breaker():
+    breaker = CircuitBreaker()
+    api = API('http://example.com', circuit_breaker=breaker)
+    assert api.fetch.keywords['chub_circuit_breaker'] is breaker
+
+
+class TestAsyncBreaker(AsyncTestCase):
+    @gen_test
+    def test_async_call(self):
+        breaker = CircuitBreaker(min_requests=1)
+        future = Future()
+        future.set_exception(HTTPError(502))
+        fetch = Mock(return_value=future)
+
+        with pytest.raises(HTTPError):
+            yield breaker.async_call(fetch, request())
+        with pytest.raises(CircuitOpenError):
+            yield breaker.async_call(fetch, request())
+        assert fetch.call_count == 1
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import json
+
+import pytest
+from tornado.httpclient import HTTPError
+
+from chub import API, LoopbackTransport
+from chub.capture import Recorder, read_log, decode_body, REDACTED
+from chub.retry import RetryPolicy
+
+
+@pytest.fixture
+def log_path(tmpdir):
+    return str(tmpdir.join('traffic.log'))
+
+
+def make_transport():
+    transport = LoopbackTransport()
+    transport.route('GET', '/v1/offers/([^/]+)',
+                    lambda request, offer_id: {'id': offer_id})
+    transport.route('POST', '/v1/offers', lambda request: (
+        201, '\xff\xfe', {'Content-Type': 'application/octet-stream'}))
+    return transport
+
+
+def test_records_requests(log_path):
+    recorder = Recorder(log_path)
+    api = API('http://example.com', async=False, recorder=recorder,
+              transport=make_transport())
+
+    api.offers['1'].get(headers={'Authorization': 'Bearer secret'})
+    api.offers.post(foo='bar')
+    recorder.close()
+
+    get, post = list(read_log(log_path))
+    assert get['method'] == 'GET'
+    assert get['url'] == 'http://example.com/v1/offers/1'
+    assert get['template'] == 'offers/{id}'
+    assert get['headers']['Authorization'] == REDACTED
+    assert get['status'] == 200
+    assert json.loads(get['response_body']) == {'id': '1'}
+    assert get['duration'] >= 0
+    assert 'body' not in get
+
+    assert json.loads(decode_body(post, 'body')) == {'foo': 'bar'}
+    assert post['status'] == 201
+    assert decode_body(post, 'response_body') == '\xff\xfe'
+    assert recorder.stats() == {'records': 2}
+
+
+def test_records_each_attempt(log_path):
+    recorder = Recorder(log_path, responses=False)
+    api = API('http://example.com', async=False, recorder=recorder,
+              transport=LoopbackTransport(),
+              retry_policy=RetryPolicy(max_attempts=2, statuses={404},
+                                       backoff=0))
+
+    with pytest.raises(HTTPError):
+        api.offers['1'].get()
+    recorder.close()
+
+    records = list(read_log(log_path))
+    assert [record['status'] for record in records] == [404, 404]
+    assert 'response_headers' not in records[0]
+
+
+def test_log_is_appended_to(log_path):
+    for _ in range(2):
+        recorder = Recorder(log_path)
+        api = API('http://example.com', async=False, recorder=recorder,
+                  transport=make_transport())
+        api.offers['1'].get()
+        recorder.close()
+
+    assert len(list(read_log(log_path))) == 2
+
+
+def test_read_log_skips_partial_line(log_path):
+    with open(log_path, 'w') as log:
+        log.write('{"method": "GET"}\n{"meth')
+
+    assert list(read_log(log_path)) == [{'method': 'GET'}]
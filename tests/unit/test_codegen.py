@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import json
+import os
+import sys
+from StringIO import StringIO
+
+import pytest
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, LoopbackTransport, Metrics
+from chub import codegen
+from chub.codegen import check, compile_client, generate, snake_case
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+SPEC_PATH = os.path.join(DATA, 'repository.json')
+
+
+def load():
+    return codegen.load_spec(SPEC_PATH)
+
+
+def test_snake_case():
+    assert snake_case('getOffer') == 'get_offer'
+    assert snake_case('X-Request-Id') == 'x_request_id'
+    assert snake_case('get /offers/{offer_id}') == 'get_offers_offer_id'
+    assert snake_case('class') == 'class_'
+
+
+def test_check():
+    check('page', 1, 'integer')
+    check('order', 'asc', 'string', ('asc', 'desc'))
+    with pytest.raises(ValueError):
+        check('page', '1', 'integer')
+    with pytest.raises(ValueError):
+        check('page', True, 'integer')
+    with pytest.raises(ValueError):
+        check('order', 'up', 'string', ('asc', 'desc'))
+
+
+def test_class_name():
+    assert codegen.class_name(load()) == 'RepositoryClient'
+
+
+def test_operations():
+    operations = codegen.operations(load())
+
+    assert [(o.method, o.path, o.name) for o in operations] == [
+        ('GET', 'repository', 'get_service_info'),
+        ('GET', 'repository/offers/{offer_id}', 'get_offer'),
+        ('PATCH', 'repository/offers/{offer_id}', 'update_offer'),
+        ('GET', 'repository/repositories/{repository_id}/assets',
+         'get_assets'),
+        ('POST', 'repository/repositories/{repository_id}/assets',
+         'add_asset'),
+        ('POST', 'repository/repositories/{repository_id}/assets/bulk',
+         'add_assets'),
+        ('DELETE',
+         'repository/repositories/{repository_id}/assets/{asset_id}',
+         'delete_asset')]
+    assert operations[3].template() == (
+        'repository/repositories/{}/assets',
+        'repository/repositories/{id}/assets',
+        [operations[3].parameters[0]])
+
+
+def test_openapi_3():
+    spec = {'openapi': '3.0.0',
+            'servers': [{'url': 'https://localhost:8004/v1/accounts'}],
+            'paths': {'/login': {'post': {
+                'operationId': 'login',
+                'requestBody': {'required': True, 'content': {
+                    'application/json': {'schema': {'type': 'object'}}}}}}}}
+
+    operation, = codegen.operations(spec)
+
+    assert operation.path == 'accounts/login'
+    assert [(p.argument, p.location, p.required)
+            for p in operation.parameters] == [('body', 'body', True)]
+
+
+def test_duplicate_names():
+    spec = {'paths': {'/a': {'get': {'operationId': 'get'}},
+                      '/b': {'get': {'operationId': 'get'}}}}
+    with pytest.raises(ValueError):
+        codegen.operations(spec)
+
+
+def test_generated_module_compiles():
+    source = generate([(load(), None)], 'repository.json')
+    namespace = {}
+
+    exec compile(source, 'repository_client.py', 'exec') in namespace
+
+    assert issubclass(namespace['RepositoryClient'], API)
+    assert source.startswith('# generated by chub.codegen from '
+                             'repository.json')
+
+
+def test_main(monkeypatch):
+    output = StringIO()
+    monkeypatch.setattr(sys, 'stdout', output)
+
+    codegen.main([SPEC_PATH, '--class-name', 'Repository'])
+
+    assert 'class Repository(API):' in output.getvalue()
+    assert 'def get_offer(self, offer_id):' in output.getvalue()
+
+
+class TestGeneratedClient(AsyncTestCase):
+    def setUp(self):
+        super(TestGeneratedClient, self).setUp()
+        self.requests = []
+        self.transport = LoopbackTransport()
+        self.transport.route(None, '/v1/repository.*', self.handle)
+        self.metrics = Metrics()
+        self.client = compile_client(load())(
+            'http://example.com', transport=self.transport,
+            metrics=self.metrics)
+
+    def handle(self, request):
+        self.requests.append(request)
+        return {'status': 200, 'data': {}}
+
+    @gen_test
+    def test_path_parameters(self):
+        yield self.client.get_offer('a b')
+        yield self.client.delete_asset('repo1', 'asset1')
+
+        assert [(r.method, r.url) for r in self.requests] == [
+            ('GET', 'http://example.com/v1/repository/offers/a+b'),
+            ('DELETE', 'http://example.com/v1/repository/repositories/'
+                       'repo1/assets/asset1')]
+
+    @gen_test
+    def test_query_parameters(self):
+        yield self.client.get_assets('repo1', page=2, order='desc')
+        yield self.client.get_assets('repo1')
+
+        assert self.requests[0].url.startswith(
+            'http://example.com/v1/repository/repositories/repo1/assets?')
+        assert sorted(self.requests[0].url.split('?')[1].split('&')) == [
+            'order=desc', 'page=2']
+        assert self.requests[1].url == \
+            'http://example.com/v1/repository/repositories/repo1/assets'
+
+    @gen_test
+    def test_body_and_header_parameters(self):
+        yield self.client.add_asset('repo1', {'source_ids': ['1']},
+                                    x_request_id='abc')
+
+        request = self.requests[0]
+        assert request.method == 'POST'
+        assert json.loads(request.body) == {'source_ids': ['1']}
+        assert request.headers['X-Request-Id'] == 'abc'
+
+    @gen_test
+    def test_patch_body(self):
+        yield self.client.update_offer('1', {'title': 'x'})
+
+        request = self.requests[0]
+        assert (request.method, request.url) == (
+            'PATCH', 'http://example.com/v1/repository/offers/1')
+        assert json.loads(request.body) == {'title': 'x'}
+
+    @gen_test
+    def test_array_body_and_query_parameters(self):
+        yield self.client.add_assets('repo1', [{'id': '1'}, {'id': '2'}],
+                                     dry_run=True)
+
+        request = self.requests[0]
+        assert (request.method, request.url) == (
+            'POST', 'http://example.com/v1/repository/repositories/repo1/'
+                    'assets/bulk?dry_run=true')
+        assert json.loads(request.body) == [{'id': '1'}, {'id': '2'}]
+        with pytest.raises(ValueError):
+            self.client.add_assets('repo1', {'id': '1'})
+
+    def test_build_request(self):
+        request = codegen.build_request(
+            'http://example.com/v1/offers', 'POST',
+            query={'ids': ['1', '2']}, form={'name': u'caf\xe9'})
+
+        assert request.url == 'http://example.com/v1/offers?ids=1&ids=2'
+        assert request.body == 'name=caf%C3%A9'
+        assert request.headers['Content-Type'] == \
+            'application/x-www-form-urlencoded'
+
+    def test_build_request_without_body(self):
+        for method in ('POST', 'PUT', 'PATCH'):
+            request = codegen.build_request('http://example.com', method)
+            assert request.body == ''
+        assert codegen.build_request('http://example.com', 'GET').body \
+            is None
+
+    def test_validates_parameters(self):
+        with pytest.raises(ValueError):
+            self.client.get_assets('repo1', page='2')
+        with pytest.raises(ValueError):
+            self.client.get_assets('repo1', order='up')
+        with pytest.raises(TypeError):
+            self.client.get_offer()
+        assert self.requests == []
+
+    @gen_test
+    def test_metrics_match_dynamic_resources(self):
+        yield self.client.get_offer('1')
+        yield self.client.repository.offers['2'].get()
+
+        assert self.metrics.snapshot().keys() == [
+            'GET repository/offers/{id}']
+
+    def test_sync(self):
+        client = compile_client(load())('http://example.com', async=False,
+                                        transport=self.transport)
+
+        response = client.get_offer('1')
+
+        assert response['status'] == 200
+        assert self.requests[0].url == \
+            'http://example.com/v1/repository/offers/1'
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import json
+import zlib
+
+import pytest
+from tornado.httpserver import HTTPServer
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from chub import API, Compression, LoopbackTransport
+from chub.compression import gzip_body
+
+ASSETS = [{'id': '{:032x}'.format(index),
+           'source_id_types': ['examplecopictureid'],
+           'source_ids': [str(100000 + index)],
+           'description': 'Sunset over a Caribbean beach'}
+          for index in range(500)]
+
+
+def gunzip(body):
+    return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+
+def test_gzip_body():
+    body = json.dumps(ASSETS)
+
+    compressed = gzip_body(body, level=9)
+
+    assert len(compressed) < len(body) / 5
+    assert gunzip(compressed) == body
+
+
+def test_invalid_level():
+    with pytest.raises(ValueError):
+        Compression(level=0)
+
+
+class TestCompression(AsyncTestCase):
+    def setUp(self):
+        super(TestCompression, self).setUp()
+        self.requests = []
+        self.transport = LoopbackTransport()
+        self.transport.route('POST', '/v1/assets', self.assets)
+
+    def assets(self, request):
+        self.requests.append(request)
+        return {'status': 200, 'data': {}}
+
+    def api(self, compression, async=True):
+        return API('http://example.com', async=async,
+                   transport=self.transport, compression=compression)
+
+    @gen_test
+    def test_compresses_large_body(self):
+        compression = Compression(threshold=1024)
+
+        yield self.api(compression).assets.post(data=ASSETS)
+
+        request = self.requests[0]
+        assert request.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gunzip(request.body)) == {'data': ASSETS}
+        assert request.decompress_response is True
+        stats = compression.stats()
+        assert stats['compressed'] == 1
+        assert stats['threaded'] == 0
+        assert stats['bytes_out'] == len(request.body)
+        assert stats['ratio'] < 0.2
+
+    @gen_test
+    def test_small_body_not_compressed(self):
+        compression = Compression(threshold=1024)
+
+        yield self.api(compression).assets.post(data=ASSETS[:1])
+
+        request = self.requests[0]
+        assert 'Content-Encoding' not in request.headers
+        assert json.loads(request.body) == {'data': ASSETS[:1]}
+        assert compression.stats()['compressed'] == 0
+
+    @gen_test
+    def test_compresses_very_large_body_in_thread(self):
+        compression = Compression(threshold=1024, thread_threshold=4096,
+                                  io_loop=self.io_loop)
+
+        yield self.api(compression).assets.post(data=ASSETS)
+
+        request = self.requests[0]
+        assert json.loads(gunzip(request.body)) == {'data': ASSETS}
+        assert compression.stats()['threaded'] == 1
+
+    def test_sync(self):
+        compression = Compression(threshold=1024, thread_threshold=4096)
+
+        self.api(compression, async=False).assets.post(data=ASSETS)
+
+        request = self.requests[0]
+        assert request.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gunzip(request.body)) == {'data': ASSETS}
+        assert compression.stats()['threaded'] == 0
+
+
+class Assets(RequestHandler):
+    def get(self):
+        self.finish({'status': 200, 'data': ASSETS})
+
+    def post(self):
+        body = json.loads(self.request.body)
+        self.finish({'status': 200, 'data': {'count': len(body['data'])}})
+
+
+class TestCompressionServer(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r'/v1/assets', Assets)], compress_response=True)
+
+    def get_http_server(self):
+        return HTTPServer(self._app, io_loop=self.io_loop,
+                          decompress_request=True,
+                          **self.get_httpserver_options())
+
+    @gen_test
+    def test_round_trip(self):
+        compression = Compression(threshold=1024, thread_threshold=4096,
+                                  io_loop=self.io_loop)
+        api = API(self.get_url('/'), compression=compression,
+                  decompress_response=False)
+
+        response = yield api.assets.post(data=ASSETS)
+        assets = yield api.assets.get()
+
+        assert response['data'] == {'count': 500}
+        assert assets['data'] == ASSETS
+        assert compression.stats()['threaded'] == 1
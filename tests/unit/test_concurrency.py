@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import pytest
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError
+from tornado.queues import QueueFull
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, ConcurrencyLimiter, LoopbackTransport
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def busy(limiter, host):
+    """fill the host's limit, as if the limit were in use"""
+    host.in_flight = int(host.limit)
+
+
+def test_aimd_grows_while_latency_is_flat():
+    limiter = ConcurrencyLimiter(initial_limit=10)
+    host = limiter.host('example.com')
+    busy(limiter, host)
+
+    for _ in range(20):
+        limiter.update(host, 0.01)
+
+    assert 11 < host.limit < 12.5
+    assert host.decreases == 0
+
+
+def test_aimd_does_not_grow_unused_limit():
+    limiter = ConcurrencyLimiter(initial_limit=10)
+    host = limiter.host('example.com')
+    host.in_flight = 1
+
+    for _ in range(20):
+        limiter.update(host, 0.01)
+
+    assert host.limit == 10
+
+
+def test_aimd_shrinks_when_latency_rises():
+    limiter = ConcurrencyLimiter(initial_limit=10, tolerance=2,
+                                 backoff=0.5)
+    limiter._now = FakeClock()
+    host = limiter.host('example.com')
+    busy(limiter, host)
+    limiter.update(host, 0.01)
+    start = host.limit
+
+    for _ in range(10):
+        limiter._now.now += 1
+        limiter.update(host, 0.2)
+
+    assert host.limit < start / 2
+    assert host.decreases > 1
+
+
+def test_aimd_shrinks_once_per_round_trip():
+    limiter = ConcurrencyLimiter(initial_limit=10, backoff=0.5)
+    limiter._now = FakeClock()
+    host = limiter.host('example.com')
+    limiter.update(host, 0.1)
+
+    for _ in range(5):
+        limiter.update(host, 0.1, HTTPError(503))
+
+    assert host.limit == 5
+    limiter._now.now += 1
+    limiter.update(host, 0.1, HTTPError(429))
+    assert host.limit == 2.5
+
+
+def test_client_errors_do_not_shrink_limit():
+    limiter = ConcurrencyLimiter(initial_limit=10)
+    host = limiter.host('example.com')
+    limiter.update(host, 0.1)
+
+    limiter.update(host, 0.1, HTTPError(404))
+
+    assert host.limit == 10
+
+
+def test_limit_is_bounded():
+    limiter = ConcurrencyLimiter(initial_limit=4, min_limit=2, max_limit=5,
+                                 backoff=0.1)
+    limiter._now = FakeClock()
+    host = limiter.host('example.com')
+    busy(limiter, host)
+    for _ in range(100):
+        limiter.update(host, 0.01)
+    assert host.limit == 5
+
+    for _ in range(5):
+        limiter._now.now += 1
+        limiter.update(host, 0.1, HTTPError(599))
+    assert host.limit == 2
+
+
+def test_gradient_shrinks_when_latency_rises():
+    limiter = ConcurrencyLimiter(initial_limit=20, algorithm='gradient',
+                                 tolerance=1.5)
+    host = limiter.host('example.com')
+    busy(limiter, host)
+    limiter.update(host, 0.01)
+    for _ in range(10):
+        limiter.update(host, 0.01)
+    grown = host.limit
+    assert grown > 20
+
+    for _ in range(20):
+        limiter.update(host, 0.5)
+
+    assert host.limit < grown / 2
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        ConcurrencyLimiter(algorithm='vegas')
+
+
+def test_sync_api_not_supported():
+    with pytest.raises(ValueError):
+        API('http://example.com', async=False,
+            transport=LoopbackTransport(),
+            concurrency_limiter=ConcurrencyLimiter())
+
+
+class TestConcurrencyLimiter(AsyncTestCase):
+    def setUp(self):
+        super(TestConcurrencyLimiter, self).setUp()
+        self.pending = []
+        self.transport = LoopbackTransport()
+        self.transport.route('GET', '/v1/offers/([^/]+)', self.offer)
+        self.limiter = ConcurrencyLimiter(initial_limit=2, max_queue=2)
+        self.api = API(['http://one.example.com', 'http://two.example.com'],
+                       transport=self.transport,
+                       concurrency_limiter=self.limiter)
+
+    def offer(self, request, offer_id):
+        future = Future()
+        self.pending.append(future)
+        return future
+
+    @gen.coroutine
+    def settle(self):
+        for _ in range(10):
+            yield gen.moment
+
+    def respond(self):
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.set_result({'status': 200, 'data': {}})
+
+    @gen_test
+    def test_queues_requests_over_limit(self):
+        responses = [self.api.offers['1'].get() for _ in range(6)]
+        yield self.settle()
+
+        hosts = self.limiter.stats()['hosts']
+        assert sorted(hosts) == ['one.example.com', 'two.example.com']
+        for host in hosts.values():
+            assert host['in_flight'] == 2
+            assert host['queued'] == 1
+        assert len(self.pending) == 4
+
+        self.respond()
+        yield self.settle()
+        assert len(self.pending) == 2
+        self.respond()
+        yield responses
+
+        for host in self.limiter.stats()['hosts'].values():
+            assert host['in_flight'] == 0
+            assert host['queued'] == 0
+
+    @gen_test
+    def test_rejects_when_queue_is_full(self):
+        limiter = ConcurrencyLimiter(initial_limit=1, max_queue=1)
+        api = API('http://example.com', transport=self.transport,
+                  concurrency_limiter=limiter)
+        responses = [api.offers['1'].get() for _ in range(2)]
+
+        with pytest.raises(QueueFull):
+            yield api.offers['1'].get()
+
+        assert limiter.stats()['rejected'] == 1
+        yield self.settle()
+        self.respond()
+        yield self.settle()
+        self.respond()
+        yield responses
+
+    @gen_test
+    def test_releases_on_error(self):
+        transport = LoopbackTransport()
+        transport.route('GET', '/v1/offers',
+                        lambda request: (503, {'status': 503}))
+        limiter = ConcurrencyLimiter(initial_limit=10)
+        api = API('http://example.com', transport=transport,
+                  concurrency_limiter=limiter)
+
+        with pytest.raises(HTTPError):
+            yield api.offers.get()
+
+        host = limiter.stats()['hosts']['example.com']
+        assert host['in_flight'] == 0
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import pytest
+from mock import patch
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPRequest
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from chub import (API, ConcurrencyLimiter, Deadline, DeadlineExceeded,
+                  HedgePolicy, LoopbackTransport, PriorityScheduler,
+                  RateLimiter, RetryBudget, RetryPolicy, current_deadline,
+                  oauth2)
+
+
+class TestDeadline(AsyncTestCase):
+    def setUp(self):
+        super(TestDeadline, self).setUp()
+        self.requests = []
+        self.transport = LoopbackTransport()
+        self.transport.route('GET', '/v1/offers/([^/]+)', self.offer)
+        self.api = API('http://example.com', transport=self.transport)
+
+    def offer(self, request, offer_id):
+        self.requests.append(request)
+        return {'status': 200, 'data': {'id': offer_id}}
+
+    def test_remaining(self):
+        deadline = Deadline(2)
+        deadline._now = lambda: deadline.expires - 0.5
+
+        assert deadline.remaining() == 0.5
+        assert not deadline.expired
+
+        deadline._now = lambda: deadline.expires + 1
+        assert deadline.remaining() == 0
+        assert deadline.expired
+        with pytest.raises(DeadlineExceeded):
+            deadline.check()
+
+    def test_nested_deadline_ends_no_later(self):
+        with Deadline(1) as outer:
+            inner = Deadline(10)
+            assert inner.expires == outer.expires
+            with Deadline(0.5) as shorter:
+                assert current_deadline() is shorter
+            assert current_deadline() is outer
+        assert current_deadline() is None
+
+    @gen_test
+    def test_sets_request_timeouts(self):
+        @gen.coroutine
+        def handler():
+            yield gen.moment
+            response = yield self.api.offers['1'].get()
+            raise gen.Return(response)
+
+        response = yield Deadline(2).run(handler)
+
+        assert response['data'] == {'id': '1'}
+        request = self.requests[0]
+        assert 1.5 < request.request_timeout <= 2
+        assert 1.5 < request.connect_timeout <= 2
+        assert current_deadline() is None
+
+    @gen_test
+    def test_keeps_shorter_timeouts(self):
+        resource = self.api.offers['1']
+        resource.prepare_request(request_timeout=0.5)
+
+        yield Deadline(2).run(resource.get)
+
+        assert self.requests[0].request_timeout == 0.5
+        assert self.requests[0].connect_timeout > 1.5
+
+    @gen_test
+    def test_keeps_shorter_client_timeouts(self):
+        api = API('http://example.com', transport=self.transport,
+                  request_timeout=0.5, connect_timeout=0.25)
+
+        yield Deadline(2).run(api.offers['1'].get)
+
+        assert self.requests[0].request_timeout == 0.5
+        assert self.requests[0].connect_timeout == 0.25
+
+    def test_sync_keeps_shorter_client_timeouts(self):
+        api = API('http://example.com', async=False,
+                  transport=self.transport, request_timeout=0.5)
+
+        with Deadline(30):
+            api.offers['1'].get()
+
+        assert self.requests[0].request_timeout == 0.5
+        assert self.requests[0].connect_timeout <= 20
+
+    @gen_test
+    def test_fails_fast_when_expired(self):
+        deadline = Deadline(0)
+
+        with pytest.raises(DeadlineExceeded):
+            yield deadline.run(self.api.offers['1'].get)
+        assert self.requests == []
+
+    @gen_test
+    def test_retries_stop_at_deadline(self):
+        attempts = []
+
+        def unavailable(request):
+            attempts.append(request)
+            return 503, {}
+        self.transport.route('GET', '/v1/down', unavailable)
+        retry_policy = RetryPolicy(max_attempts=10, backoff=0.2,
+                                   budget=RetryBudget(reserve=100))
+        api = API('http://example.com', transport=self.transport,
+                  retry_policy=retry_policy)
+
+        with pytest.raises(HTTPError):
+            yield Deadline(0.05).run(api.down.get)
+        assert len(attempts) < 10
+        assert retry_policy.give_ups == 1
+
+    @gen_test
+    def test_rate_limiter_fails_fast(self):
+        limiter = RateLimiter(rate=1)
+        api = API('http://example.com', transport=self.transport,
+                  rate_limiter=limiter)
+        yield api.offers['1'].get()
+
+        start = self.io_loop.time()
+        with pytest.raises(DeadlineExceeded):
+            yield Deadline(0.1).run(api.offers['2'].get)
+        assert self.io_loop.time() - start < 0.1
+        assert len(self.requests) == 1
+        # the reserved token is given back
+        assert limiter.stats()['buckets']['example.com']['tokens'] >= 0
+        assert limiter.waited == 0
+
+    @gen_test
+    def test_priority_lane_fails_fast(self):
+        scheduler = PriorityScheduler(max_concurrency=1)
+        lane = scheduler.lane()
+        blocker = Future()
+        lane.async_call(lambda request: blocker, HTTPRequest('blocker'))
+
+        with pytest.raises(DeadlineExceeded):
+            yield Deadline(0.05).run(lane.async_call, self.fetch,
+                                     HTTPRequest('queued'))
+        assert lane.queued == 0
+        assert lane.in_flight == 1
+
+    @gen_test
+    def test_concurrency_limiter_fails_fast(self):
+        limiter = ConcurrencyLimiter(initial_limit=1)
+        blocker = Future()
+        limiter.async_call(lambda request: blocker,
+                           HTTPRequest('http://example.com/blocker'))
+
+        with pytest.raises(DeadlineExceeded):
+            yield Deadline(0.05).run(limiter.async_call, self.fetch,
+                                     HTTPRequest('http://example.com/queued'))
+        host = limiter.host('example.com')
+        assert host.queued == 0
+        assert host.in_flight == 1
+
+    @gen_test
+    def test_no_hedge_past_deadline(self):
+        policy = HedgePolicy(delay=0.05, max_ratio=1)
+        responses = []
+
+        def fetch(request):
+            future = Future()
+            responses.append(future)
+            return future
+
+        future = Deadline(0.02).run(policy.async_call, fetch,
+                                    HTTPRequest('http://example.com'))
+        yield gen.sleep(0.1)
+        responses[0].set_result('response')
+        assert (yield future) == 'response'
+        assert policy.hedges == 0
+
+    def fetch(self, request):
+        self.requests.append(request)
+        future = Future()
+        future.set_result('response')
+        return future
+
+    @gen_test
+    def test_get_token_uses_deadline(self):
+        self.transport.route(
+            'POST', '/v1/auth/token',
+            lambda request: {'access_token': 'token', 'expiry': 0})
+        transport = self.transport
+
+        class LoopbackAPI(API):
+            def __init__(self, *args, **kwargs):
+                kwargs['transport'] = transport
+                super(LoopbackAPI, self).__init__(*args, **kwargs)
+
+        with patch('chub.oauth2.API', LoopbackAPI):
+            with pytest.raises(DeadlineExceeded):
+                yield Deadline(0).run(
+                    oauth2.RequestToken(), 'http://example.com', 'client',
+                    'secret')
+
+            token = yield Deadline(1).run(
+                oauth2.RequestToken(), 'http://example.com', 'client',
+                'secret')
+        assert token == 'token'
+
+    def test_sync(self):
+        api = API('http://example.com', async=False,
+                  transport=self.transport)
+
+        with Deadline(2):
+            api.offers['1'].get()
+        assert self.requests[0].request_timeout <= 2
+
+        with pytest.raises(DeadlineExceeded):
+            with Deadline(0):
+                api.offers['1'].get()
+        assert len(self.requests) == 1
+
+    @patch('chub.ratelimit.time.sleep')
+    def test_sync_rate_limiter_fails_fast(self, sleep):
+        api = API('http://example.com', async=False,
+                  transport=self.transport, rate_limiter=RateLimiter(rate=1))
+        api.offers['1'].get()
+
+        with pytest.raises(DeadlineExceeded):
+            with Deadline(0.5):
+                api.offers['2'].get()
+        assert not sleep.called
+        assert len(self.requests) == 1
+
+
+class Slow(RequestHandler):
+    @gen.coroutine
+    def get(self):
+        yield gen.sleep(0.5)
+        self.write({'status': 200})
+
+
+class TestDeadlineTimeout(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r'/v1/slow', Slow)])
+
+    @gen_test
+    def test_timeout_raises_deadline_exceeded(self):
+        api = API(self.get_url('/'))
+
+        with pytest.raises(DeadlineExceeded):
+            yield Deadline(0.05).run(api.slow.get)
@@ -14,12 +14,15 @@ import json
 from mock import Mock
 import pytest
 
-from tornado.httpclient import HTTPRequest
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPRequest
 from tornado.ioloop import IOLoop
 
+from chub import RetryPolicy
 from chub.handlers import (
     convert, make_request, parse_response, sync_fetch, async_fetch,
-    ResponseObject, DEFAULT_HEADERS)
+    direct_async_fetch, ResponseObject, DEFAULT_HEADERS)
+from chub.transport import LoopbackTransport
 
 
 @pytest.mark.parametrize('input,expected', [
@@ -193,3 +196,50 @@ def test_response_object():
     obj = ResponseObject()
     obj['foo'] = 'bar'
     assert obj.foo == 'bar'
+
+
+def _loopback_client():
+    transport = LoopbackTransport()
+    transport.route('GET', r'/offers/(\w+)',
+                    lambda request, offer_id: {'data': {'id': offer_id}})
+    transport.route('GET', r'/missing', lambda request: (404, {}))
+    return transport.async_client()
+
+
+def test_direct_async_fetch():
+    client = _loopback_client()
+    future = direct_async_fetch('http://example.com/offers/1', 'GET',
+                                httpclient=client, chub_resource_template='x')
+    assert isinstance(future, Future)
+    rsp = IOLoop.current().run_sync(lambda: future)
+    assert rsp['data'] == {'id': '1'}
+
+
+def test_direct_async_fetch_error():
+    client = _loopback_client()
+    future = direct_async_fetch('http://example.com/missing', 'GET',
+                                httpclient=client)
+    with pytest.raises(HTTPError) as exc:
+        IOLoop.current().run_sync(lambda: future)
+    assert exc.value.code == 404
+
+
+def test_direct_async_fetch_callback():
+    client = _loopback_client()
+    results = []
+    future = direct_async_fetch('http://example.com/offers/1', 'GET',
+                                httpclient=client, callback=results.append)
+    IOLoop.current().run_sync(lambda: future)
+    IOLoop.current().run_sync(lambda: None)
+    assert results == [{'data': {'id': '1'}}]
+
+
+def test_direct_async_fetch_with_layers_uses_coroutine():
+    client = _loopback_client()
+    retry_policy = RetryPolicy()
+    future = direct_async_fetch('http://example.com/offers/1', 'GET',
+                                httpclient=client,
+                                chub_retry_policy=retry_policy)
+    rsp = IOLoop.current().run_sync(lambda: future)
+    assert rsp['data'] == {'id': '1'}
+    assert retry_policy.attempts == 1
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+from StringIO import StringIO
+
+import pytest
+from mock import Mock
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPRequest, HTTPResponse
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API
+from chub.handlers import async_fetch
+from chub.hedging import HedgePolicy
+from chub.tracing import InMemoryExporter, Tracer
+
+
+def test_hedge_delay_fixed():
+    policy = HedgePolicy(delay=0.2)
+    assert policy.hedge_delay('GET offers/{id}') == 0.2
+
+
+def test_hedge_delay_percentile():
+    policy = HedgePolicy(delay=0.2, percentile=50, min_samples=3)
+    key = 'GET offers/{id}'
+    policy.latencies[key].add(0.01)
+    policy.latencies[key].add(0.03)
+    assert policy.hedge_delay(key) == 0.2
+    policy.latencies[key].add(0.02)
+    assert policy.hedge_delay(key) == 0.02
+
+
+@pytest.mark.parametrize('method,url,template,key', [
+    ('GET', 'http://example.com/v1/offers/1', 'offers/{id}',
+     'GET offers/{id}'),
+    ('get', 'http://example.com/v1/offers', None, 'GET v1/offers'),
+])
+def test_key(method, url, template, key):
+    assert HedgePolicy.key(method, url, template) == key
+
+
+def test_sync_api_does_not_support_hedging():
+    with pytest.raises(ValueError):
+        API('http://example.com', async=False, hedge_policy=HedgePolicy())
+
+
+def test_api_hedge_policy():
+    policy = HedgePolicy()
+    api = API('http://example.com', hedge_policy=policy)
+    assert api.fetch.keywords['chub_hedge_policy'] is policy
+
+
+class TestHedging(AsyncTestCase):
+    def request(self, method='GET'):
+        return HTTPRequest('http://example.com/v1/offers', method,
+                           body='' if method == 'POST' else None)
+
+    def respond(self, delay, result=None, error=None):
+        future = Future()
+        if error is not None:
+            self.io_loop.call_later(delay, future.set_exception, error)
+        else:
+            self.io_loop.call_later(delay, future.set_result, result)
+        return future
+
+    @gen_test
+    def test_fast_request_is_not_hedged(self):
+        policy = HedgePolicy(delay=0.05)
+        fetch = Mock(return_value=self.respond(0, 'fast'))
+
+        response = yield policy.async_call(fetch, self.request())
+
+        assert response == 'fast'
+        assert fetch.call_count == 1
+        assert policy.stats() == {'requests': 1, 'hedges': 0,
+                                  'hedge_wins': 0}
+
+    @gen_test
+    def test_slow_request_is_hedged(self):
+        policy = HedgePolicy(delay=0.01)
+        fetch = Mock(side_effect=[self.respond(0.5, 'slow'),
+                                  self.respond(0, 'hedge')])
+
+        request = self.request()
+        response = yield policy.async_call(fetch, request)
+
+        assert response == 'hedge'
+        assert fetch.call_count == 2
+        hedge = fetch.call_args_list[1][0][0]
+        assert hedge is not request
+        assert hedge.url == request.url
+        assert hedge.headers is not request.headers
+        assert policy.stats() == {'requests': 1, 'hedges': 1,
+                                  'hedge_wins': 1}
+
+    @gen_test
+    def test_first_response_wins_after_hedge(self):
+        policy = HedgePolicy(delay=0.01)
+        fetch = Mock(side_effect=[self.respond(0.02, 'first'),
+                                  self.respond(0.5, 'hedge')])
+
+        response = yield policy.async_call(fetch, self.request())
+
+        assert response == 'first'
+        assert policy.hedge_wins == 0
+
+    @gen_test
+    def test_error_waits_for_other_request(self):
+        policy = HedgePolicy(delay=0.01)
+        fetch = Mock(side_effect=[
+            self.respond(0.02, error=HTTPError(503)),
+            self.respond(0.03, 'hedge')])
+
+        response = yield policy.async_call(fetch, self.request())
+
+        assert response == 'hedge'
+
+    @gen_test
+    def test_both_fail(self):
+        policy = HedgePolicy(delay=0.01)
+        fetch = Mock(side_effect=[
+            self.respond(0.02, error=HTTPError(503)),
+            self.respond(0.03, error=HTTPError(502))])
+
+        with pytest.raises(HTTPError) as exc:
+            yield policy.async_call(fetch, self.request())
+        assert exc.value.code == 502
+
+    @gen_test
+    def test_hedge_ratio_is_capped(self):
+        policy = HedgePolicy(delay=0.001, max_ratio=0.5)
+        for _ in range(4):
+            fetch = Mock(side_effect=[self.respond(0.01, 'slow'),
+                                      self.respond(0, 'hedge')])
+            yield policy.async_call(fetch, self.request())
+        assert policy.requests == 4
+        assert policy.hedges == 2
+
+    @gen_test
+    def test_post_is_not_hedged(self):
+        policy = HedgePolicy(delay=0.001)
+        fetch = Mock(return_value=self.respond(0.01, 'slow'))
+
+        response = yield policy.async_call(fetch, self.request('POST'))
+
+        assert response == 'slow'
+        assert fetch.call_count == 1
+        assert policy.requests == 0
+
+    @gen_test
+    def test_entities_share_latencies(self):
+        policy = HedgePolicy(delay=0.001, percentile=50, max_ratio=0)
+        httpclient = Mock()
+        httpclient.fetch.side_effect = lambda request, **kwargs: \
+            self.respond(0, HTTPResponse(request, 200, buffer=StringIO('{}')))
+
+        for entity_id in ('1', '2', '3'):
+            yield async_fetch('http://example.com/v1/offers/' + entity_id,
+                              'GET', httpclient=httpclient,
+                              chub_hedge_policy=policy,
+                              chub_resource_template='offers/{id}')
+
+        assert policy.latencies.keys() == ['GET offers/{id}']
+        assert len(policy.latencies['GET offers/{id}']) == 3
+
+    @gen_test
+    def test_hedges_are_not_counted_as_retries(self):
+        policy = HedgePolicy(delay=0.01)
+        tracer = Tracer(InMemoryExporter())
+        delays = [0.5, 0]
+        httpclient = Mock()
+        httpclient.fetch.side_effect = lambda request, **kwargs: \
+            self.respond(delays.pop(0), HTTPResponse(
+                request, 200, buffer=StringIO('{}')))
+
+        yield async_fetch('http://example.com/v1/offers/1', 'GET',
+                          httpclient=httpclient, chub_hedge_policy=policy,
+                          chub_tracer=tracer)
+
+        assert policy.hedges == 1
+        span, = tracer.exporter.spans
+        assert span.attempts == 1
+        assert span.attributes['chub.retries'] == 0
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import time
+
+import pytest
+from mock import patch
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, LagMonitor, LoopbackTransport
+from chub.handlers import parse_response
+
+
+def test_check_below_threshold():
+    monitor = LagMonitor(threshold=0.1)
+    monitor.check(0.01)
+
+    assert monitor.lag.count == 1
+    assert monitor.slow_events == 0
+    assert list(monitor.events) == []
+
+
+def test_check_attributes_longest_operation():
+    monitor = LagMonitor(threshold=0.1)
+    monitor._timeout = object()
+    monitor.record('make_request', 'POST assets', 100, 0.01)
+    monitor.record('parse_response', 'GET assets', 5000, 0.2)
+
+    monitor.check(0.25)
+
+    assert monitor.slow_events == 1
+    event = monitor.events[-1]
+    assert event['lag'] == 0.25
+    assert event['operation'] == 'parse_response'
+    assert event['resource'] == 'GET assets'
+    assert event['size'] == 5000
+    assert event['duration'] == 0.2
+    assert monitor._operations == []
+
+
+def test_check_outside_chub():
+    monitor = LagMonitor(threshold=0.1)
+    monitor.check(0.2)
+
+    assert monitor.events[-1]['operation'] is None
+
+
+def test_sync_api_not_supported():
+    with pytest.raises(ValueError):
+        API('http://example.com', async=False, lag_monitor=LagMonitor())
+
+
+class TestLagMonitor(AsyncTestCase):
+    def make_api(self, monitor):
+        transport = LoopbackTransport()
+        transport.route('GET', '/v1/assets', lambda request: {
+            'data': [{'id': str(i)} for i in range(1000)]})
+        return API('http://example.com', transport=transport,
+                   lag_monitor=monitor)
+
+    @gen_test
+    def test_measures_lag(self):
+        monitor = LagMonitor(interval=0.01, threshold=0.05,
+                             io_loop=self.io_loop)
+        monitor.start()
+        yield gen.sleep(0.03)
+        time.sleep(0.08)
+        yield gen.sleep(0.03)
+        monitor.stop()
+
+        assert monitor.lag.count >= 3
+        assert monitor.lag.max >= 0.05
+        assert monitor.slow_events == 1
+        assert not monitor.running
+
+    @gen_test
+    def test_records_blocking_operations(self):
+        monitor = LagMonitor(interval=0.01)
+        api = self.make_api(monitor)
+
+        result = yield api.assets.get()
+        monitor.stop()
+
+        assert len(result['data']) == 1000
+        stats = monitor.stats()
+        assert set(stats['blocking']['GET assets']) == {'make_request',
+                                                        'parse_response'}
+        assert stats['blocking']['GET assets']['parse_response']['count']             == 1
+        assert monitor.io_loop is self.io_loop
+
+    @gen_test
+    def test_attributes_lag_to_request(self):
+        monitor = LagMonitor(interval=0.01, threshold=0.03)
+        api = self.make_api(monitor)
+
+        def slow_parse(response):
+            time.sleep(0.05)
+            return parse_response(response)
+
+        with patch('chub.handlers.parse_response', slow_parse):
+            yield api.assets.get()
+        yield gen.sleep(0.02)
+        monitor.stop()
+
+        event = monitor.events[-1]
+        assert event['lag'] >= 0.03
+        assert event['operation'] == 'parse_response'
+        assert event['resource'] == 'GET assets'
+        assert event['size'] > 1000
+        assert event['duration'] >= 0.05
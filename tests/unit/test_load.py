@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+from collections import Counter
+
+import pytest
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, LoopbackTransport
+from chub.load import (parse_call, _parse_call, Call, Scenario,
+                       LoadGenerator)
+
+
+@pytest.mark.parametrize('expression,expected', [
+    ('offers.get', ([('attr', 'offers')], 'get', {})),
+    ('repository.offers[{id}].get',
+     ([('attr', 'repository'), ('attr', 'offers'), ('item', '{id}')],
+      'get', {})),
+    ('repositories[abc].assets.post?page=2',
+     ([('attr', 'repositories'), ('item', 'abc'), ('attr', 'assets')],
+      'post', {'page': '2'})),
+])
+def test_parse_call(expression, expected):
+    assert parse_call(expression) == expected
+
+
+@pytest.mark.parametrize('expression', ['offers', 'offers[1]', 'get[1]',
+                                        'offers..get!', ''])
+def test_parse_call_invalid(expression):
+    with pytest.raises(ValueError):
+        parse_call(expression)
+
+
+@pytest.mark.parametrize('value,expression,weight', [
+    ('offers.get', 'offers.get', 1),
+    ('offers.get=3', 'offers.get', 3),
+    ('offers.get?page=1', 'offers.get?page=1', 1),
+    ('offers.get?page=1=0.5', 'offers.get?page=1', 0.5),
+])
+def test_parse_call_weight(value, expression, weight):
+    call = _parse_call(value)
+    assert (call.expression, call.weight) == (expression, weight)
+
+
+def test_call_fills_placeholders():
+    fetch = []
+    transport = LoopbackTransport()
+    transport.route('GET', '.*', lambda request: fetch.append(request.url) or {})
+    api = API('http://example.com', async=False, transport=transport)
+    scenario = Scenario([Call('repositories[{repo}].assets[{id}].get')],
+                        variables={'repo': ['r1']}, seed=1)
+
+    call = scenario.choose()
+    call(api, scenario.variables, scenario.random)
+
+    assert fetch[0].startswith('http://example.com/v1/repositories/r1/assets/')
+    assert len(fetch[0].rsplit('/', 1)[1]) == 32
+
+
+def test_call_does_not_cache_random_ids():
+    transport = LoopbackTransport()
+    transport.route('GET', '.*', lambda request: {})
+    api = API('http://example.com', async=False, transport=transport)
+    scenario = Scenario([Call('repositories[{repo}].assets[{id}].get')],
+                        variables={'repo': ['r1']}, seed=1)
+
+    for _ in range(10):
+        scenario.calls[0](api, scenario.variables, scenario.random)
+
+    assert sorted(api.resource_map) == [
+        'http://example.com/v1/repositories',
+        'http://example.com/v1/repositories/r1',
+        'http://example.com/v1/repositories/r1/assets']
+
+
+def test_scenario_weights():
+    heavy, light = Call('offers.get', 3), Call('assets.get', 1)
+    scenario = Scenario([heavy, light], seed=0)
+
+    counts = Counter(scenario.choose().expression for _ in range(4000))
+
+    assert 2.5 < float(counts['offers.get']) / counts['assets.get'] < 3.5
+
+
+def test_scenario_needs_calls():
+    with pytest.raises(ValueError):
+        Scenario([])
+
+
+def test_load_generator_needs_concurrency_or_rate():
+    with pytest.raises(ValueError):
+        LoadGenerator(None, Scenario([Call('offers.get')]))
+    with pytest.raises(ValueError):
+        LoadGenerator(None, Scenario([Call('offers.get')]), concurrency=1,
+                      rate=1)
+
+
+class TestLoadGenerator(AsyncTestCase):
+    def make_api(self, **kwargs):
+        transport = LoopbackTransport(seed=1, **kwargs)
+        transport.route('GET', '/v1/offers/([^/]+)',
+                        lambda request, offer_id: {'id': offer_id})
+        return API('http://example.com', transport=transport)
+
+    @gen_test
+    def test_concurrency(self):
+        reports = []
+        api = self.make_api(latency=0.005, errors={503: 0.1})
+        generator = LoadGenerator(
+            api, Scenario([Call('offers[{id}].get')], seed=1),
+            concurrency=5, duration=0.2, interval=0.05,
+            report=reports.append)
+
+        summary = yield generator.run()
+
+        assert summary['requests'] > 20
+        assert summary['outcomes']['ok'] + summary['outcomes'][503] ==             summary['requests']
+        assert summary['errors'] == summary['outcomes'][503]
+        assert summary['calls']['offers[{id}].get']['count'] ==             summary['requests']
+        assert summary['latency']['p50'] >= 0.005
+        assert len(reports) >= 3
+        assert sum(report['requests'] for report in reports) ==             summary['requests']
+        assert generator.in_flight == 0
+
+    @gen_test
+    def test_rate(self):
+        api = self.make_api()
+        generator = LoadGenerator(
+            api, Scenario([Call('offers[{id}].get')]),
+            rate=100, duration=0.2, interval=0)
+
+        summary = yield generator.run()
+
+        assert 15 <= summary['requests'] <= 21
+        assert summary['outcomes'] == {'ok': summary['requests']}
+
+    @gen_test
+    def test_rate_drops_calls_over_max_in_flight(self):
+        api = self.make_api(latency=0.3)
+        generator = LoadGenerator(
+            api, Scenario([Call('offers[{id}].get')]),
+            rate=200, duration=0.1, interval=0, max_in_flight=5)
+
+        summary = yield generator.run()
+
+        assert summary['requests'] == 5
+        assert summary['outcomes']['dropped'] > 5
+        assert generator.in_flight == 0
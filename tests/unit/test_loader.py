@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import json
+
+import pytest
+from tornado import gen
+from tornado.httpclient import HTTPError
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, LoopbackTransport
+
+
+class TestLoader(AsyncTestCase):
+    def setUp(self):
+        super(TestLoader, self).setUp()
+        self.requests = []
+        self.transport = LoopbackTransport()
+        self.transport.route('GET', '/v1/assets/([^/]+)', self.get_asset)
+        self.api = API('http://example.com', transport=self.transport)
+
+    def get_asset(self, request, asset_id):
+        self.requests.append(request)
+        if asset_id == 'missing':
+            return 404, {'status': 404}
+        return {'status': 200, 'data': {'id': asset_id}}
+
+    def post_ids(self, request):
+        self.requests.append(request)
+        ids = json.loads(request.body)['ids']
+        return {'status': 200,
+                'data': [{'id': i} for i in ids if i != 'missing']}
+
+    @gen_test
+    def test_batches_lookups_in_the_same_iteration(self):
+        self.transport.route('POST', '/v1/assets/ids', self.post_ids)
+        loader = self.api.assets.loader(batch='ids')
+
+        first, second, again = yield [loader.load('a1'), loader.load('a2'),
+                                      loader.load('a1')]
+
+        assert first == {'id': 'a1'}
+        assert second == {'id': 'a2'}
+        assert again is first
+        assert len(self.requests) == 1
+        assert json.loads(self.requests[0].body) == {'ids': ['a1', 'a2']}
+        assert loader.stats() == {'loads': 3, 'memo_hits': 1, 'batches': 1,
+                                  'fallbacks': 0}
+
+    @gen_test
+    def test_memo(self):
+        self.transport.route('POST', '/v1/assets/ids', self.post_ids)
+        loader = self.api.assets.loader(batch='ids')
+
+        yield loader.load('a1')
+        yield loader.load('a1')
+        loader.clear('a1')
+        yield loader.load('a1')
+
+        assert len(self.requests) == 2
+
+    @gen_test
+    def test_window(self):
+        self.transport.route('POST', '/v1/assets/ids', self.post_ids)
+        loader = self.api.assets.loader(batch='ids', window=0.01)
+
+        first = loader.load('a1')
+        yield gen.sleep(0.001)
+        second = loader.load('a2')
+        yield [first, second]
+
+        assert len(self.requests) == 1
+
+    @gen_test
+    def test_max_batch(self):
+        self.transport.route('POST', '/v1/assets/ids', self.post_ids)
+        loader = self.api.assets.loader(batch='ids', max_batch=2)
+
+        items = yield loader.load_many(['a1', 'a2', 'a3'])
+
+        assert [item['id'] for item in items] == ['a1', 'a2', 'a3']
+        assert len(self.requests) == 2
+
+    @gen_test
+    def test_missing_from_batch(self):
+        self.transport.route('POST', '/v1/assets/ids', self.post_ids)
+        loader = self.api.assets.loader(batch='ids')
+
+        found = loader.load('a1')
+        with pytest.raises(HTTPError) as exc:
+            yield loader.load('missing')
+
+        assert exc.value.code == 404
+        assert (yield found) == {'id': 'a1'}
+
+    @gen_test
+    def test_batch_function(self):
+        calls = []
+
+        @gen.coroutine
+        def batch(keys):
+            calls.append(keys)
+            yield gen.moment
+            raise gen.Return({key: key.upper() for key in keys})
+
+        loader = self.api.assets.loader(batch=batch)
+        items = yield loader.load_many(['a', 'b', 'a'])
+
+        assert items == ['A', 'B', 'A']
+        assert calls == [['a', 'b']]
+
+    @gen_test
+    def test_without_batch_endpoint(self):
+        loader = self.api.assets.loader()
+
+        items = yield loader.load_many(['a1', 'a2'])
+
+        assert items == [{'id': 'a1'}, {'id': 'a2'}]
+        assert sorted(r.url for r in self.requests) == [
+            'http://example.com/v1/assets/a1',
+            'http://example.com/v1/assets/a2']
+        assert loader.stats()['fallbacks'] == 1
+
+    @gen_test
+    def test_falls_back_if_batch_unsupported(self):
+        loader = self.api.assets.loader(batch='ids')
+
+        items = yield loader.load_many(['a1', 'a2'])
+        more = yield loader.load('a3')
+
+        assert items == [{'id': 'a1'}, {'id': 'a2'}]
+        assert more == {'id': 'a3'}
+        assert loader.batch is None
+        assert loader.stats()['batches'] == 1
+        assert loader.stats()['fallbacks'] == 2
+
+    @gen_test
+    def test_errors_are_not_remembered(self):
+        loader = self.api.assets.loader()
+
+        for _ in range(2):
+            with pytest.raises(HTTPError):
+                yield loader.load('missing')
+
+        assert len(self.requests) == 2
+
+    @gen_test
+    def test_batch_error(self):
+        self.transport.route('POST', '/v1/assets/ids',
+                             lambda request: (500, {}))
+        loader = self.api.assets.loader(batch='ids')
+
+        with pytest.raises(HTTPError) as exc:
+            yield loader.load('a1')
+
+        assert exc.value.code == 500
+        assert loader.batch == 'ids'
+
+    @gen_test
+    def test_prime(self):
+        loader = self.api.assets.loader()
+        loader.prime('a1', {'id': 'a1', 'primed': True})
+
+        item = yield loader.load('a1')
+
+        assert item['primed']
+        assert self.requests == []
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import json
+
+import pytest
+from mock import Mock
+from tornado.httpclient import HTTPError, HTTPResponse
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.concurrent import Future
+from StringIO import StringIO
+
+from chub import API
+from chub.handlers import sync_fetch, async_fetch
+from chub.metrics import Histogram, Metrics
+
+
+def response(request, code=200, body='{"foo": "bar"}', time_info=None):
+    return HTTPResponse(request, code,
+                        headers={'Content-Type': 'application/json'},
+                        buffer=StringIO(body), time_info=time_info)
+
+
+def test_histogram_empty():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+    assert histogram.snapshot()['mean'] is None
+
+
+@pytest.mark.parametrize('pct', [1, 50, 90, 99, 100])
+def test_histogram_precision(pct):
+    histogram = Histogram(precision=32)
+    for value in range(1, 100001):
+        histogram.record(value)
+    expected = pct * 1000
+    assert abs(histogram.percentile(pct) - expected) <= expected / 32.0
+
+
+@pytest.mark.parametrize('precision', [10, 32, 100])
+def test_histogram_bucket_bounds(precision):
+    histogram = Histogram(precision=precision)
+    for value in range(1, 5000):
+        index = histogram._index(value)
+        upper = histogram._upper(index)
+        assert upper >= value
+        assert histogram._index(upper) == index
+        assert histogram._index(upper + 1) != index
+
+
+@pytest.mark.parametrize('pct', [1, 50, 90, 99, 100])
+def test_histogram_precision_not_a_power_of_two(pct):
+    histogram = Histogram(precision=10)
+    for value in range(1, 100001):
+        histogram.record(value)
+    expected = pct * 1000
+    assert abs(histogram.percentile(pct) - expected) <= expected / 10.0
+
+
+def test_histogram_small_values_are_exact():
+    histogram = Histogram(precision=32)
+    for value in range(10):
+        histogram.record(value)
+    assert histogram.percentile(50) == 4
+
+
+def test_histogram_scale():
+    histogram = Histogram(scale=1000000)
+    histogram.record(0.0123)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 1
+    assert snapshot['min'] == snapshot['max'] == 0.0123
+    assert snapshot['p99'] == 0.0123
+
+
+@pytest.mark.parametrize('method,url,template,key', [
+    ('get', 'http://example.com/v1/offers/1?a=b', 'offers/{id}',
+     'GET offers/{id}'),
+    ('POST', 'http://example.com/v1/offers?a=b', None, 'POST v1/offers'),
+])
+def test_key(method, url, template, key):
+    assert Metrics.key(method, url, template) == key
+
+
+def test_sync_fetch_records_metrics():
+    metrics = Metrics()
+    httpclient = Mock()
+    httpclient.fetch.side_effect = lambda request: response(
+        request, time_info={'queue': 0.001, 'namelookup': 0.002,
+                            'connect': 0.005, 'appconnect': 0.01,
+                            'starttransfer': 0.02})
+
+    rsp = sync_fetch('http://example.com/v1/offers/1', 'POST',
+                     httpclient=httpclient, chub_metrics=metrics,
+                     chub_resource_template='offers/{id}', foo='bar')
+
+    assert rsp == {'foo': 'bar'}
+    snapshot = metrics.snapshot()['POST offers/{id}']
+    assert snapshot['status'] == {200: 1}
+    assert snapshot['total']['count'] == 1
+    assert snapshot['parse']['count'] == 1
+    assert snapshot['bytes_in']['sum'] == len('{"foo": "bar"}')
+    assert snapshot['bytes_out']['sum'] == len(json.dumps({'foo': 'bar'}))
+    assert round(snapshot['connect']['max'], 6) == 0.003
+    assert round(snapshot['tls']['max'], 6) == 0.005
+    assert snapshot['ttfb']['max'] == 0.02
+
+
+def test_sync_fetch_records_errors():
+    metrics = Metrics()
+    httpclient = Mock()
+    httpclient.fetch.side_effect = HTTPError(599)
+
+    with pytest.raises(HTTPError):
+        sync_fetch('http://example.com/v1/offers', 'GET',
+                   httpclient=httpclient, chub_metrics=metrics)
+
+    snapshot = metrics.snapshot()['GET v1/offers']
+    assert snapshot['status'] == {599: 1}
+    assert 'parse' not in snapshot
+
+
+def test_prometheus():
+    metrics = Metrics()
+    resource = metrics.resource('GET', '', 'offers/{id}')
+    resource.statuses[200] += 2
+    resource.timings['total'].record(0.5)
+
+    text = metrics.prometheus()
+
+    assert ('chub_requests_total{resource="GET offers/{id}",status="200"} 2'
+            in text.splitlines())
+    assert '# TYPE chub_request_total_seconds summary' in text
+    assert ('chub_request_total_seconds{resource="GET offers/{id}",'
+            'quantile="0.99"} 0.5' in text.splitlines())
+    assert ('chub_request_total_seconds_count{resource="GET offers/{id}"} 1'
+            in text.splitlines())
+    assert 'chub_request_dns_seconds{' not in text
+
+
+def test_api_metrics():
+    metrics = Metrics()
+    api = API('http://example.com', metrics=metrics)
+    assert api.fetch.keywords['chub_metrics'] is metrics
+    assert api.offers['1'].get.keywords['chub_resource_template'] == \
+        'offers/{id}'
+
+
+class TestAsyncMetrics(AsyncTestCase):
+    @gen_test
+    def test_async_fetch_records_metrics(self):
+        metrics = Metrics()
+        httpclient = Mock()
+
+        def fetch(request):
+            future = Future()
+            future.set_result(response(request))
+            return future
+        httpclient.fetch.side_effect = fetch
+
+        rsp = yield async_fetch('http://example.com/v1/offers/1', 'GET',
+                                httpclient=httpclient, chub_metrics=metrics,
+                                chub_resource_template='offers/{id}')
+
+        assert rsp == {'foo': 'bar'}
+        snapshot = metrics.snapshot()['GET offers/{id}']
+        assert snapshot['status'] == {200: 1}
+        assert snapshot['parse']['count'] == 1
+        assert 'dns' not in snapshot
@@ -8,17 +8,23 @@
 # See the License for the specific language governing permissions and limitations under the License.
 # 
 
+import base64
 import calendar
+import threading
+import time
 import urllib
 import urlparse
 from datetime import datetime
 
 import pytest
 from mock import patch
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError
 from tornado.testing import AsyncTestCase, gen_test
 from tornado.gen import coroutine, Return
 
-from chub import oauth2
+from chub import API, LoopbackTransport, oauth2
 
 
 def test_read():
@@ -122,10 +128,10 @@ class TestGetToken(AsyncTestCase):
         self.API.assert_called_once_with(
             'https://localhost:8007',
             auth_username='4225f4774d6874a68565a04130001144',
-            auth_password='FMjU7vNIay5HGNABQVTTghOfEJqbet')
+            auth_password='FMjU7vNIay5HGNABQVTTghOfEJqbet',
+            request_timeout=60)
         self.API().auth.token.post.assert_called_once_with(
             body=urllib.urlencode({'grant_type': oauth2.CLIENT_CREDENTIALS}),
-            request_timeout=60,
             headers={'Content-Type': 'application/x-www-form-urlencoded',
                      'Accept': 'application/json'})
 
@@ -262,6 +268,73 @@ class TestTokenCache(AsyncTestCase):
 
         assert token2 == self.token2, 'Should not use an expired cached token'
 
+    @gen_test
+    def test_cached_token_future_is_resolved(self):
+        yield oauth2.get_token('https://localhost:8007',
+                               '4225f4774d6874a68565a04130001144',
+                               'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+
+        future = oauth2.get_token('https://localhost:8007',
+                                  '4225f4774d6874a68565a04130001144',
+                                  'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+
+        assert future.done()
+        assert future.result() == self.token1
+        assert self.request_count == 1
+
+    @gen_test
+    def test_response(self):
+        response = yield oauth2.get_token.response(
+            'https://localhost:8007', '4225f4774d6874a68565a04130001144',
+            'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+        cached = yield oauth2.get_token.response(
+            'https://localhost:8007', '4225f4774d6874a68565a04130001144',
+            'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+
+        assert response == {'access_token': self.token1,
+                            'expiry': self.expiry}
+        assert cached is response
+        assert self.request_count == 1
+
+    @gen_test
+    def test_response_min_remaining(self):
+        yield oauth2.get_token.response(
+            'https://localhost:8007', '4225f4774d6874a68565a04130001144',
+            'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+        response = yield oauth2.get_token.response(
+            'https://localhost:8007', '4225f4774d6874a68565a04130001144',
+            'FMjU7vNIay5HGNABQVTTghOfEJqbet',
+            min_remaining=oauth2.RequestToken.max_until_expired * 3)
+
+        assert response['access_token'] == self.token2
+        token = yield oauth2.get_token('https://localhost:8007',
+                                       '4225f4774d6874a68565a04130001144',
+                                       'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+        assert token == self.token2, 'Should cache the new token'
+
+    @gen_test
+    def test_response_force(self):
+        yield oauth2.get_token.response(
+            'https://localhost:8007', '4225f4774d6874a68565a04130001144',
+            'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+        response = yield oauth2.get_token.response(
+            'https://localhost:8007', '4225f4774d6874a68565a04130001144',
+            'FMjU7vNIay5HGNABQVTTghOfEJqbet', force=True)
+
+        assert response['access_token'] == self.token2
+
+    @gen_test
+    def test_response_expires_in(self):
+        self.API().auth.token.post.side_effect = None
+        self.API().auth.token.post.return_value = gen.maybe_future(
+            {'access_token': self.token1, 'expires_in': 3600})
+
+        response = yield oauth2.get_token.response(
+            'https://localhost:8007', '4225f4774d6874a68565a04130001144',
+            'FMjU7vNIay5HGNABQVTTghOfEJqbet')
+
+        assert response['expiry'] == oauth2.get_token._now() + 3600
+
     def test_purge_cache(self):
         n = oauth2.get_token.max_cache_size
         expired_time = self.expiry - oauth2.RequestToken.max_until_expired * 3
@@ -292,3 +365,275 @@ class TestTokenCache(AsyncTestCase):
         oauth2.get_token.purge_cache()
 
         assert oauth2.get_token._cache == items
+
+
+class FakeTokenSource(object):
+    """A RequestToken stand-in returning the token responses it's given"""
+    def __init__(self):
+        self.calls = []
+        self.futures = []
+        self.count = 0
+
+    def response(self, base_url, client_id, client_secret, **kwargs):
+        self.calls.append(kwargs)
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def sync_response(self, base_url, client_id, client_secret, **kwargs):
+        self.calls.append(kwargs)
+        self.count += 1
+        return {'access_token': 'token{}'.format(self.count),
+                'expiry': oauth2.ClientCredentials._now() + 3600}
+
+    def resolve(self, expires_in=3600):
+        futures, self.futures = self.futures, []
+        for future in futures:
+            self.count += 1
+            future.set_result({'access_token': 'token{}'.format(self.count),
+                               'expiry': oauth2.ClientCredentials._now() +
+                               expires_in})
+
+
+class TestClientCredentials(AsyncTestCase):
+    def setUp(self):
+        super(TestClientCredentials, self).setUp()
+        self.requests = []
+        self.rejected = set()
+        self.transport = LoopbackTransport()
+        self.transport.route('GET', '/v1/offers/([^/]+)', self.offer)
+        self.source = FakeTokenSource()
+        self.auth = oauth2.ClientCredentials(
+            'https://localhost:8007', 'client', 'secret',
+            scope=oauth2.Read(), refresh_ahead=300, token_source=self.source)
+        self.api = API('http://example.com', transport=self.transport,
+                       auth_provider=self.auth)
+
+    def offer(self, request, offer_id):
+        self.requests.append(request.headers['Authorization'])
+        if request.headers['Authorization'] in self.rejected:
+            return 401, {'status': 401}
+        return {'status': 200, 'data': {'id': offer_id}}
+
+    @coroutine
+    def settle(self):
+        for _ in range(10):
+            yield gen.moment
+
+    @gen_test
+    def test_adds_bearer_token(self):
+        first = self.api.offers['1'].get()
+        yield self.settle()
+        self.source.resolve()
+        yield first
+        yield self.api.offers['2'].get()
+
+        assert self.requests == ['Bearer token1', 'Bearer token1']
+        assert len(self.source.calls) == 1
+        assert self.source.calls[0]['scope'] == oauth2.Read()
+        assert self.auth.stats()['refreshes'] == 1
+
+    @gen_test
+    def test_concurrent_requests_share_refresh(self):
+        responses = [self.api.offers[str(i)].get() for i in range(5)]
+        yield self.settle()
+        self.source.resolve()
+        yield responses
+
+        assert len(self.source.calls) == 1
+        assert self.requests == ['Bearer token1'] * 5
+
+    @gen_test
+    def test_refreshes_ahead_in_background(self):
+        self.auth.token = 'old'
+        self.auth.expiry = self.auth._now() + 100
+
+        yield self.api.offers['1'].get()
+        yield self.api.offers['2'].get()
+
+        assert self.requests == ['Bearer old', 'Bearer old']
+        assert len(self.source.calls) == 1
+        self.source.resolve()
+        yield self.settle()
+        yield self.api.offers['3'].get()
+        assert self.requests[-1] == 'Bearer token1'
+
+    @gen_test
+    def test_waits_for_expired_token(self):
+        self.auth.token = 'old'
+        self.auth.expiry = self.auth._now() - 1
+
+        response = self.api.offers['1'].get()
+        yield self.settle()
+        assert self.requests == []
+        self.source.resolve()
+        yield response
+
+        assert self.requests == ['Bearer token1']
+
+    @gen_test
+    def test_retries_once_after_401(self):
+        self.auth.token = 'old'
+        self.auth.expiry = self.auth._now() + 3600
+        self.rejected.add('Bearer old')
+
+        responses = [self.api.offers[str(i)].get() for i in range(3)]
+        yield self.settle()
+        self.source.resolve()
+        yield responses
+
+        assert self.requests == ['Bearer old'] * 3 + ['Bearer token1'] * 3
+        assert len(self.source.calls) == 1
+        assert self.source.calls[0]['force'] is True
+        assert self.auth.stats()['retries'] == 3
+
+    @gen_test
+    def test_second_401_is_raised(self):
+        self.auth.token = 'old'
+        self.auth.expiry = self.auth._now() + 3600
+        self.rejected.update(['Bearer old', 'Bearer token1'])
+
+        response = self.api.offers['1'].get()
+        yield self.settle()
+        self.source.resolve()
+
+        with pytest.raises(HTTPError) as exc:
+            yield response
+        assert exc.value.code == 401
+        assert len(self.requests) == 2
+
+    def test_sync(self):
+        api = API('http://example.com', async=False,
+                  transport=self.transport, auth_provider=self.auth)
+
+        api.offers['1'].get()
+        api.offers['2'].get()
+
+        assert self.requests == ['Bearer token1', 'Bearer token1']
+        assert len(self.source.calls) == 1
+
+    def test_sync_retries_once_after_401(self):
+        api = API('http://example.com', async=False,
+                  transport=self.transport, auth_provider=self.auth)
+        self.auth.token = 'old'
+        self.auth.expiry = self.auth._now() + 3600
+        self.rejected.add('Bearer old')
+
+        api.offers['1'].get()
+
+        assert self.requests == ['Bearer old', 'Bearer token1']
+        assert self.source.calls[0]['force'] is True
+        assert self.auth.stats()['retries'] == 1
+
+    def test_sync_refreshes_ahead_in_one_thread(self):
+        api = API('http://example.com', async=False,
+                  transport=self.transport, auth_provider=self.auth)
+        self.auth.token = 'old'
+        self.auth.expiry = self.auth._now() + 100
+        # another thread is refreshing the token
+        self.auth._lock.acquire()
+        try:
+            api.offers['1'].get()
+        finally:
+            self.auth._lock.release()
+        api.offers['2'].get()
+
+        assert self.requests == ['Bearer old', 'Bearer token1']
+        assert len(self.source.calls) == 1
+
+
+class TestSyncToken(object):
+    def setup_method(self, method):
+        self.requests = []
+        self.transport = LoopbackTransport()
+        self.transport.route('POST', '/v1/auth/token', self.token)
+        self.get_token = oauth2.RequestToken()
+
+    def token(self, request):
+        self.requests.append(request)
+        # hold the request so other threads want the token meanwhile
+        time.sleep(0.05)
+        return {'access_token': 'token{}'.format(len(self.requests)),
+                'expiry': oauth2.RequestToken._now() + 3600}
+
+    def test_sync(self):
+        token = self.get_token.sync('http://example.com', 'client',
+                                    'secret', scope='read',
+                                    transport=self.transport)
+
+        assert token == 'token1'
+        request = self.requests[0]
+        assert request.headers['Authorization'] == 'Basic {}'.format(
+            base64.b64encode('client:secret'))
+        assert dict(urlparse.parse_qsl(request.body)) == {
+            'grant_type': 'client_credentials', 'scope': 'read'}
+        assert request.request_timeout == 60
+
+    def test_sync_client_request_timeout(self):
+        self.get_token.sync('http://example.com', 'client', 'secret',
+                            transport=self.transport, request_timeout=5)
+
+        assert self.requests[0].request_timeout == 5
+
+    def test_sync_shares_cache(self):
+        token = self.get_token.sync('http://example.com', 'client',
+                                    'secret', transport=self.transport)
+        future = self.get_token('http://example.com', 'client', 'secret',
+                                transport=self.transport)
+
+        assert future.result() == token
+        assert len(self.requests) == 1
+
+    def test_sync_without_cache(self):
+        for _ in range(2):
+            self.get_token.sync('http://example.com', 'client', 'secret',
+                                cache=False, transport=self.transport)
+
+        assert len(self.requests) == 2
+        assert self.get_token._cache == {}
+
+    def test_threads_share_one_request(self):
+        tokens = []
+
+        def get():
+            tokens.append(self.get_token.sync(
+                'http://example.com', 'client', 'secret',
+                transport=self.transport))
+
+        threads = [threading.Thread(target=get) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert tokens == ['token1'] * 10
+        assert len(self.requests) == 1
+
+    def test_force_once_for_waiting_threads(self):
+        stale = self.get_token.sync_response(
+            'http://example.com', 'client', 'secret',
+            transport=self.transport)
+        responses = []
+
+        def refresh():
+            responses.append(self.get_token.sync_response(
+                'http://example.com', 'client', 'secret', force=True,
+                transport=self.transport))
+
+        # hold the key's lock, as if a thread were requesting a new token
+        key = self.get_token._key('http://example.com', 'client',
+                                  self.get_token._parameters(None, None))
+        lock = self.get_token._key_locks[hash(key) %
+                                         self.get_token.lock_stripes]
+        with lock:
+            threads = [threading.Thread(target=refresh) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.01)
+            self.get_token._cache[key] = {'access_token': 'new',
+                                          'expiry': stale['expiry']}
+        for thread in threads:
+            thread.join()
+
+        assert [r['access_token'] for r in responses] == ['new'] * 3
+        assert len(self.requests) == 1
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+import os
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, AsyncHTTPSTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+import pytest
+
+from chub import API, ConnectionPool
+
+
+class Hello(RequestHandler):
+    def get(self):
+        self.write({'status': 200, 'data': 'hello'})
+
+
+class Close(RequestHandler):
+    def get(self):
+        self.set_header('Connection', 'close')
+        self.write({'status': 200, 'data': 'bye'})
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def make_app():
+    return Application([(r'/v1/hello', Hello), (r'/v1/close', Close)])
+
+
+class TestConnectionPool(AsyncHTTPTestCase):
+    def get_app(self):
+        return make_app()
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.pool = ConnectionPool(io_loop=self.io_loop)
+        self.api = API(self.get_url('/'), connection_pool=self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        super(TestConnectionPool, self).tearDown()
+
+    @gen_test
+    def test_reuses_connections(self):
+        for _ in range(3):
+            response = yield self.api.hello.get()
+            assert response['data'] == 'hello'
+            yield gen.moment
+
+        assert self.pool.stats() == {'connects': 1, 'reuses': 2, 'idle': 1,
+                                     'expired': 0}
+
+    @gen_test
+    def test_shared_between_apis(self):
+        other = API(self.get_url('/'), connection_pool=self.pool)
+        yield self.api.hello.get()
+        yield gen.moment
+        yield other.hello.get()
+
+        assert self.pool.stats()['reuses'] == 1
+
+    @gen_test
+    def test_does_not_keep_closed_connections(self):
+        response = yield self.api.close.get()
+        assert response['data'] == 'bye'
+        yield gen.moment
+
+        assert self.pool.idle == 0
+        yield self.api.hello.get()
+        assert self.pool.stats()['connects'] == 2
+
+    @gen_test
+    def test_warmup(self):
+        opened = yield self.api.warmup(connections=3)
+        yield gen.moment
+
+        assert opened == 3
+        assert self.pool.stats()['idle'] == 3
+
+        yield [self.api.hello.get() for _ in range(3)]
+        assert self.pool.stats()['connects'] == 3
+        assert self.pool.stats()['reuses'] == 3
+
+    @gen_test
+    def test_max_idle(self):
+        self.pool.max_idle = 2
+        yield self.api.warmup(connections=3)
+        yield gen.moment
+
+        assert self.pool.idle == 2
+
+    @gen_test
+    def test_expires_idle_connections(self):
+        self.pool.idle_timeout = 0.01
+        yield self.api.hello.get()
+        yield gen.sleep(0.05)
+
+        assert self.pool.idle == 0
+        assert self.pool.stats()['expired'] == 1
+
+    @gen_test
+    def test_removes_connections_closed_by_server(self):
+        yield self.api.hello.get()
+        yield gen.moment
+        assert self.pool.idle == 1
+
+        self.http_server.close_all_connections()
+        yield gen.sleep(0.05)
+
+        assert self.pool.idle == 0
+
+    def test_warmup_requires_pool(self):
+        api = API(self.get_url('/'))
+        with pytest.raises(ValueError):
+            self.io_loop.run_sync(api.warmup)
+
+    def test_sync_api_does_not_support_pool(self):
+        with pytest.raises(ValueError):
+            API(self.get_url('/'), async=False,
+                connection_pool=ConnectionPool(io_loop=self.io_loop))
+
+
+class TestConnectionPoolTLS(AsyncHTTPSTestCase):
+    def get_app(self):
+        return make_app()
+
+    def get_ssl_options(self):
+        return {'certfile': os.path.join(DATA, 'localhost.crt'),
+                'keyfile': os.path.join(DATA, 'localhost.key')}
+
+    @gen_test
+    def test_reuses_tls_connections(self):
+        pool = ConnectionPool(io_loop=self.io_loop)
+        api = API(self.get_url('/'), connection_pool=pool,
+                  validate_cert=False)
+        yield api.warmup(connections=2)
+        yield gen.moment
+
+        responses = yield [api.hello.get(), api.hello.get()]
+
+        assert [r['data'] for r in responses] == ['hello', 'hello']
+        assert pool.stats()['connects'] == 2
+        assert pool.stats()['reuses'] == 2
+        pool.close()
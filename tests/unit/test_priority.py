@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import pytest
+import json
+import urlparse
+
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest
+from tornado.testing import AsyncTestCase, gen_test
+from tornado import gen
+
+from chub import API
+from chub.priority import (PriorityScheduler, Lane,
+                           INTERACTIVE, DEFAULT, BULK)
+from chub.transport import LoopbackTransport
+
+
+def echo(request):
+    query = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+    return {'query': query, 'body': json.loads(request.body or 'null')}
+
+
+def test_default_lanes():
+    scheduler = PriorityScheduler(max_concurrency=10)
+    assert set(scheduler.lanes) == {INTERACTIVE, DEFAULT, BULK}
+    assert scheduler.lane().name == DEFAULT
+    assert scheduler.lane(BULK).max_concurrency == 5
+
+
+def test_unknown_lane():
+    with pytest.raises(ValueError):
+        PriorityScheduler().lane('urgent')
+
+
+def test_sync_api_does_not_support_priority():
+    with pytest.raises(ValueError):
+        API('http://example.com', async=False,
+            priority_scheduler=PriorityScheduler())
+
+
+def test_resource_priority():
+    api = API('http://example.com', priority_scheduler=PriorityScheduler())
+    api.repositories.priority = BULK
+    assert api.repositories.get.keywords['chub_priority'] == BULK
+    assert api.repositories.assets.priority == BULK
+    assert 'chub_priority' not in api.offers.get.keywords
+
+
+def test_sync_priority_field_is_request_data():
+    transport = LoopbackTransport()
+    transport.route(None, '/v1/offers', echo)
+    api = API('http://example.com', async=False, transport=transport)
+
+    rsp = api.offers.post(priority='high', name='x')
+    assert rsp['body'] == {'priority': 'high', 'name': 'x'}
+    rsp = api.offers.get(priority='high', page=1)
+    assert rsp['query'] == {'priority': ['high'], 'page': ['1']}
+
+
+class TestPriorityField(AsyncTestCase):
+    @gen_test
+    def test_priority_field_is_request_data(self):
+        transport = LoopbackTransport()
+        transport.route(None, '/v1/offers', echo)
+        scheduler = PriorityScheduler()
+        api = API('http://example.com', transport=transport,
+                  priority_scheduler=scheduler)
+        api.offers.priority = BULK
+
+        rsp = yield api.offers.post(priority='high', name='x')
+        assert rsp['body'] == {'priority': 'high', 'name': 'x'}
+        rsp = yield api.offers.get(priority='high', page=1)
+        assert rsp['query'] == {'priority': ['high'], 'page': ['1']}
+        assert scheduler.stats()[BULK]['started'] == 2
+
+
+class TestPriorityScheduler(AsyncTestCase):
+    def setUp(self):
+        super(TestPriorityScheduler, self).setUp()
+        self.pending = []
+        self.started = []
+
+    def fetch(self, request):
+        future = Future()
+        self.pending.append(future)
+        self.started.append(request.url)
+        return future
+
+    def complete(self):
+        self.pending.pop(0).set_result('response')
+
+    @gen.coroutine
+    def settle(self):
+        for _ in range(5):
+            yield gen.moment
+
+    def call(self, scheduler, name, url):
+        request = HTTPRequest(url)
+        return scheduler.lane(name).async_call(self.fetch, request)
+
+    @gen_test
+    def test_max_concurrency(self):
+        scheduler = PriorityScheduler(max_concurrency=2)
+        futures = [self.call(scheduler, DEFAULT, str(i)) for i in range(3)]
+        yield gen.moment
+
+        assert self.started == ['0', '1']
+        assert scheduler.lane(DEFAULT).queued == 1
+
+        self.complete()
+        response = yield futures[0]
+        yield self.settle()
+        assert response == 'response'
+        assert self.started == ['0', '1', '2']
+        assert scheduler.in_flight == 2
+
+    @gen_test
+    def test_weighted_scheduling(self):
+        scheduler = PriorityScheduler(max_concurrency=1, lanes=[
+            Lane(INTERACTIVE, 3), Lane(BULK, 1)])
+        self.call(scheduler, BULK, 'blocker')
+        for i in range(4):
+            self.call(scheduler, BULK, 'bulk')
+            self.call(scheduler, INTERACTIVE, 'interactive')
+        yield gen.moment
+
+        for _ in range(4):
+            self.complete()
+            yield self.settle()
+
+        assert self.started[0] == 'blocker'
+        assert sorted(self.started[1:]) == ['bulk', 'interactive',
+                                            'interactive', 'interactive']
+
+    @gen_test
+    def test_lane_max_concurrency(self):
+        scheduler = PriorityScheduler(max_concurrency=4)
+        for i in range(4):
+            self.call(scheduler, BULK, 'bulk')
+        self.call(scheduler, INTERACTIVE, 'interactive')
+        yield gen.moment
+
+        assert self.started == ['bulk', 'bulk', 'interactive']
+
+    @gen_test
+    def test_release_on_error(self):
+        scheduler = PriorityScheduler(max_concurrency=1)
+        future = self.call(scheduler, DEFAULT, 'error')
+        self.pending.pop().set_exception(ValueError())
+
+        with pytest.raises(ValueError):
+            yield future
+        assert scheduler.in_flight == 0
+
+    @gen_test
+    def test_stats(self):
+        scheduler = PriorityScheduler(max_concurrency=1)
+        self.call(scheduler, DEFAULT, '0')
+        self.call(scheduler, BULK, '1')
+        yield gen.moment
+
+        stats = scheduler.stats()
+        assert stats[DEFAULT]['in_flight'] == 1
+        assert stats[DEFAULT]['started'] == 1
+        assert stats[DEFAULT]['wait_max'] >= 0
+        assert stats[BULK]['queued'] == 1
+        assert stats[BULK]['wait_max'] is None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+from StringIO import StringIO
+
+import pytest
+from mock import Mock, patch
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPRequest, HTTPResponse
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API
+from chub.handlers import sync_fetch
+from chub.ratelimit import TokenBucket, RateLimiter
+
+
+def too_many_requests(retry_after=None):
+    request = HTTPRequest('http://example.com')
+    headers = {'Retry-After': retry_after} if retry_after else {}
+    response = HTTPResponse(request, 429, headers=headers)
+    return HTTPError(429, response=response)
+
+
+def test_bucket_burst():
+    bucket = TokenBucket(rate=10, burst=2, now=0)
+    assert bucket.reserve(0) == 0
+    assert bucket.reserve(0) == 0
+    assert round(bucket.reserve(0), 6) == 0.1
+    assert round(bucket.reserve(0), 6) == 0.2
+
+
+def test_bucket_refills():
+    bucket = TokenBucket(rate=10, burst=2, now=0)
+    for _ in range(3):
+        bucket.reserve(0)
+    assert bucket.reserve(0.2) == 0
+    assert bucket.reserve(10) == 0
+    assert bucket.tokens == 1
+
+
+def test_bucket_penalize():
+    bucket = TokenBucket(rate=10, burst=1, now=0, backoff=0.5,
+                         recovery_time=10)
+    bucket.penalize(0)
+    assert bucket.rate(0) == 5
+    assert bucket.rate(5) == 7.5
+    assert bucket.rate(10) == 10
+    assert bucket.reserve(10) == 0
+
+
+def test_bucket_penalize_min_rate():
+    bucket = TokenBucket(rate=10, burst=1, now=0, min_rate=4)
+    bucket.penalize(0)
+    bucket.penalize(0)
+    assert bucket.rate(0) == 4
+
+
+def test_bucket_penalize_retry_after():
+    bucket = TokenBucket(rate=10, burst=5, now=0, backoff=1)
+    bucket.penalize(0, retry_after=2)
+    assert round(bucket.reserve(0), 6) == 2.1
+    assert round(bucket.reserve(1), 6) == 1.2
+
+
+@pytest.mark.parametrize('url,per_path,key', [
+    ('http://example.com/v1/offers?id=1', False, 'example.com'),
+    ('http://example.com/v1/offers?id=1', True, 'example.com/v1/offers'),
+])
+def test_key(url, per_path, key):
+    assert RateLimiter(1, per_path=per_path).key(url) == key
+
+
+def test_key_template():
+    limiter = RateLimiter(1, per_path=True)
+    assert limiter.key('http://example.com/v1/offers/1',
+                       'offers/{id}') == 'example.com/v1/offers/{id}'
+
+
+@patch.object(RateLimiter, '_now', return_value=0)
+def test_host_rates(_now):
+    limiter = RateLimiter(10, burst=2, rates={'slow.example.com': 1,
+                                              'fast.example.com': (100, 5)})
+    assert limiter.bucket('example.com').max_rate == 10
+    assert limiter.bucket('slow.example.com').max_rate == 1
+    assert limiter.bucket('slow.example.com').burst == 2
+    assert limiter.bucket('fast.example.com').max_rate == 100
+    assert limiter.bucket('fast.example.com').burst == 5
+
+
+@patch.object(RateLimiter, '_now', return_value=0)
+@patch('chub.ratelimit.time.sleep')
+def test_sync_call_waits(sleep, _now):
+    limiter = RateLimiter(10)
+    fetch = Mock(return_value='response')
+    request = HTTPRequest('http://example.com/v1/offers')
+
+    assert limiter.sync_call(fetch, request) == 'response'
+    assert not sleep.called
+    assert limiter.sync_call(fetch, request) == 'response'
+    assert sleep.call_count == 1
+    assert round(sleep.call_args[0][0], 6) == 0.1
+
+
+@patch.object(RateLimiter, '_now', return_value=0)
+@patch('chub.ratelimit.time.sleep')
+def test_sync_call_throttled(sleep, _now):
+    limiter = RateLimiter(10, burst=5)
+    fetch = Mock(side_effect=too_many_requests('3'))
+    request = HTTPRequest('http://example.com/v1/offers')
+
+    with pytest.raises(HTTPError):
+        limiter.sync_call(fetch, request)
+
+    stats = limiter.stats()
+    assert stats['throttled'] == 1
+    assert stats['buckets']['example.com']['rate'] == 5
+    assert round(limiter.reserve(request.url), 6) == 3.2
+
+
+@patch.object(RateLimiter, '_now', return_value=0)
+@patch('chub.ratelimit.time.sleep')
+def test_sync_fetch_entities_share_a_bucket(sleep, _now):
+    limiter = RateLimiter(10, per_path=True)
+    httpclient = Mock()
+    httpclient.fetch.return_value = HTTPResponse(
+        HTTPRequest('http://example.com'), 200, buffer=StringIO('{}'))
+
+    for entity_id in ('1', '2'):
+        sync_fetch('http://example.com/v1/offers/' + entity_id, 'GET',
+                   httpclient=httpclient, chub_rate_limiter=limiter,
+                   chub_resource_template='offers/{id}')
+
+    assert sleep.call_count == 1
+    assert limiter.stats()['buckets'].keys() == ['example.com/v1/offers/{id}']
+
+
+def test_api_rate_limiter():
+    limiter = RateLimiter(10)
+    api = API('http://example.com', async=False, rate_limiter=limiter)
+    assert api.fetch.keywords['chub_rate_limiter'] is limiter
+
+
+class TestAsyncRateLimiter(AsyncTestCase):
+    @gen_test
+    def test_async_call(self):
+        limiter = RateLimiter(100)
+        future = Future()
+        future.set_result('response')
+        fetch = Mock(return_value=future)
+        request = HTTPRequest('http://example.com/v1/offers')
+
+        start = self.io_loop.time()
+        for _ in range(3):
+            response = yield limiter.async_call(fetch, request)
+            assert response == 'response'
+        assert self.io_loop.time() - start >= 0.015
+        assert limiter.waited > 0
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+import os
+import tempfile
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, LoopbackTransport, Recorder
+from chub.capture import read_log
+from chub.replay import make_replay_request, parse_recorded, replay
+
+
+def make_transport():
+    transport = LoopbackTransport()
+    transport.route('GET', '/v1/offers/([^/]+)',
+                    lambda request, offer_id: {'id': offer_id})
+    transport.route('POST', '/v1/offers',
+                    lambda request: (201, request.body))
+    return transport
+
+
+def record(path, count=3):
+    recorder = Recorder(path)
+    api = API('http://example.com', async=False, recorder=recorder,
+              transport=make_transport())
+    for index in range(count):
+        api.offers[str(index)].get()
+    api.offers.post(foo='bar', headers={'Authorization': 'Bearer x'})
+    recorder.close()
+    return list(read_log(path))
+
+
+def test_make_replay_request(tmpdir):
+    records = record(str(tmpdir.join('traffic.log')))
+
+    request = make_replay_request(records[-1], 'https://localhost:8000/')
+
+    assert request.url == 'https://localhost:8000/v1/offers'
+    assert request.method == 'POST'
+    assert request.body == '{"foo": "bar"}'
+    assert 'Authorization' not in request.headers
+
+
+def test_parse_recorded(tmpdir):
+    records = record(str(tmpdir.join('traffic.log')))
+
+    result = parse_recorded(records)
+
+    assert result['responses'] == 4
+    assert result['errors'] == 0
+    assert result['per_call_us'] >= 0
+
+
+class TestReplay(AsyncTestCase):
+    @gen_test
+    def test_replay_max_speed(self):
+        records = record(self.path(), count=20)
+        transport = make_transport()
+
+        result = yield replay(records, speed=None, concurrency=4,
+                              httpclient=transport.async_client())
+
+        assert result['requests'] == 21
+        assert result['status'] == {200: 20, 201: 1}
+        assert result['status_mismatches'] == 0
+        assert transport.requests == 21
+
+    @gen_test
+    def test_replay_speed(self):
+        records = [{'t': 100 + i * 0.1, 'method': 'GET',
+                    'url': 'http://example.com/v1/offers/1',
+                    'headers': {}, 'status': 200} for i in range(3)]
+        transport = make_transport()
+
+        result = yield replay(records, speed=4,
+                              httpclient=transport.async_client())
+
+        assert 0.05 <= result['elapsed'] < 0.2
+        assert result['requests'] == 3
+
+    @gen_test
+    def test_replay_counts_mismatches(self):
+        records = record(self.path(), count=1)
+        transport = LoopbackTransport()
+
+        result = yield replay(records, speed=None,
+                              httpclient=transport.async_client())
+
+        assert result['status'] == {404: 2}
+        assert result['status_mismatches'] == 2
+
+    def path(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        return path
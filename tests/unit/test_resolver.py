@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import socket
+
+import pytest
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.netutil import Resolver
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from chub import API, CachingResolver, ThreadResolver
+
+
+class StubResolver(Resolver):
+    """Resolve hostnames from a dictionary, counting the lookups"""
+    def initialize(self, hosts=None, ttl=None):
+        self.hosts = hosts or {}
+        self.record_ttl = ttl
+        self.lookups = []
+        if ttl is not None:
+            self.resolve_ttl = self._resolve_ttl
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC, callback=None):
+        self.lookups.append(host)
+        future = Future()
+        if host in self.hosts:
+            future.set_result([(socket.AF_INET, (self.hosts[host], port))])
+        else:
+            future.set_exception(socket.gaierror(-2, 'Name not known'))
+        return future
+
+    def _resolve_ttl(self, host, port, family=socket.AF_UNSPEC):
+        future = Future()
+        lookup = self.resolve(host, port, family)
+        if lookup.exception():
+            future.set_exception(lookup.exception())
+        else:
+            future.set_result((lookup.result(), self.record_ttl))
+        return future
+
+
+class TestCachingResolver(AsyncTestCase):
+    def setUp(self):
+        super(TestCachingResolver, self).setUp()
+        self.stub = StubResolver(hosts={'service.test': '10.0.0.1'})
+        self.now = 1000.0
+        self.resolver = CachingResolver(resolver=self.stub, ttl=60,
+                                        negative_ttl=5, hot_hits=2,
+                                        io_loop=self.io_loop)
+        self.resolver._now = lambda: self.now
+
+    @gen_test
+    def test_caches_addresses(self):
+        first = yield self.resolver.resolve('service.test', 80)
+        second = yield self.resolver.resolve('service.test', 80)
+
+        assert first == second == [(socket.AF_INET, ('10.0.0.1', 80))]
+        assert self.stub.lookups == ['service.test']
+        stats = self.resolver.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_rate'] == 0.5
+
+    @gen_test
+    def test_cached_future_is_resolved(self):
+        yield self.resolver.resolve('service.test', 80)
+
+        assert self.resolver.resolve('service.test', 80).done()
+
+    @gen_test
+    def test_expires_addresses(self):
+        yield self.resolver.resolve('service.test', 80)
+        self.now += 61
+        yield self.resolver.resolve('service.test', 80)
+
+        assert self.stub.lookups == ['service.test'] * 2
+
+    @gen_test
+    def test_merges_concurrent_lookups(self):
+        slow = Future()
+        self.stub.resolve = lambda *args: slow
+        first = self.resolver.resolve('service.test', 80)
+        second = self.resolver.resolve('service.test', 80)
+        slow.set_result([(socket.AF_INET, ('10.0.0.1', 80))])
+
+        results = yield [first, second]
+
+        assert results[0] == results[1]
+        assert self.resolver.stats()['misses'] == 2
+        assert self.resolver.stats()['entries'] == 1
+
+    @gen_test
+    def test_negative_caching(self):
+        with pytest.raises(socket.gaierror):
+            yield self.resolver.resolve('missing.test', 80)
+        with pytest.raises(socket.gaierror):
+            yield self.resolver.resolve('missing.test', 80)
+        assert self.stub.lookups == ['missing.test']
+        assert self.resolver.stats()['negative_hits'] == 1
+
+        self.now += 6
+        with pytest.raises(socket.gaierror):
+            yield self.resolver.resolve('missing.test', 80)
+        assert self.stub.lookups == ['missing.test'] * 2
+
+    @gen_test
+    def test_refreshes_hot_hostnames(self):
+        yield self.resolver.resolve('service.test', 80)
+        yield self.resolver.resolve('service.test', 80)
+        self.now += 55
+        self.stub.hosts['service.test'] = '10.0.0.2'
+
+        # served from the cache while the hostname is refreshed
+        result = yield self.resolver.resolve('service.test', 80)
+        assert result == [(socket.AF_INET, ('10.0.0.1', 80))]
+        yield gen.moment
+
+        self.now += 10
+        result = yield self.resolver.resolve('service.test', 80)
+        assert result == [(socket.AF_INET, ('10.0.0.2', 80))]
+        assert self.stub.lookups == ['service.test'] * 2
+        assert self.resolver.stats()['refreshes'] == 1
+        assert self.resolver.stats()['misses'] == 1
+
+    @gen_test
+    def test_failed_refresh_keeps_addresses(self):
+        yield self.resolver.resolve('service.test', 80)
+        yield self.resolver.resolve('service.test', 80)
+        self.now += 55
+        del self.stub.hosts['service.test']
+
+        yield self.resolver.resolve('service.test', 80)
+        yield gen.moment
+        result = yield self.resolver.resolve('service.test', 80)
+
+        assert result == [(socket.AF_INET, ('10.0.0.1', 80))]
+        assert self.resolver.stats()['errors'] == 1
+
+    @gen_test
+    def test_uses_record_ttl(self):
+        stub = StubResolver(hosts={'service.test': '10.0.0.1'}, ttl=10)
+        resolver = CachingResolver(resolver=stub, ttl=60,
+                                   io_loop=self.io_loop)
+        resolver._now = lambda: self.now
+
+        result = yield resolver.resolve('service.test', 80)
+        assert result == [(socket.AF_INET, ('10.0.0.1', 80))]
+        self.now += 11
+        yield resolver.resolve('service.test', 80)
+
+        assert stub.lookups == ['service.test'] * 2
+
+    @gen_test
+    def test_refreshes_ahead_of_record_ttl(self):
+        stub = StubResolver(hosts={'service.test': '10.0.0.1'}, ttl=10)
+        resolver = CachingResolver(resolver=stub, ttl=60, hot_hits=2,
+                                   io_loop=self.io_loop)
+        resolver._now = lambda: self.now
+        yield resolver.resolve('service.test', 80)
+        yield resolver.resolve('service.test', 80)
+
+        self.now += 1
+        yield resolver.resolve('service.test', 80)
+        yield gen.moment
+        assert stub.lookups == ['service.test']
+
+        self.now += 8
+        yield resolver.resolve('service.test', 80)
+        yield gen.moment
+        assert stub.lookups == ['service.test'] * 2
+        assert resolver.stats()['refreshes'] == 1
+
+    @gen_test
+    def test_refreshes_hot_failed_lookups(self):
+        del self.stub.hosts['service.test']
+        for _ in range(2):
+            with pytest.raises(socket.gaierror):
+                yield self.resolver.resolve('service.test', 80)
+
+        self.now += 4.5
+        self.stub.hosts['service.test'] = '10.0.0.1'
+        with pytest.raises(socket.gaierror):
+            yield self.resolver.resolve('service.test', 80)
+        yield gen.moment
+
+        self.now += 1
+        result = yield self.resolver.resolve('service.test', 80)
+        assert result == [(socket.AF_INET, ('10.0.0.1', 80))]
+        assert self.stub.lookups == ['service.test'] * 2
+        assert self.resolver.stats()['misses'] == 1
+
+    @gen_test
+    def test_max_entries(self):
+        self.resolver.max_entries = 1
+        yield self.resolver.resolve('service.test', 80)
+        yield self.resolver.resolve('service.test', 443)
+
+        assert self.resolver.stats()['entries'] == 1
+
+
+class TestThreadResolver(AsyncTestCase):
+    @gen_test
+    def test_resolve(self):
+        resolver = ThreadResolver(io_loop=self.io_loop, threads=1)
+        try:
+            result = yield resolver.resolve('127.0.0.1', 80, socket.AF_INET)
+        finally:
+            resolver.close()
+
+        assert result == [(socket.AF_INET, ('127.0.0.1', 80))]
+
+
+class Hello(RequestHandler):
+    def get(self):
+        self.write({'status': 200, 'data': 'hello'})
+
+
+class TestAPIResolver(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r'/v1/hello', Hello)])
+
+    @gen_test
+    def test_api_uses_resolver(self):
+        stub = StubResolver(hosts={'service.test': '127.0.0.1'})
+        resolver = CachingResolver(resolver=stub, io_loop=self.io_loop)
+        api = API('http://service.test:{}'.format(self.get_http_port()),
+                  resolver=resolver)
+
+        yield api.hello.get()
+        api.fetch.keywords['httpclient'].close()
+        api = API('http://service.test:{}'.format(self.get_http_port()),
+                  resolver=resolver)
+        response = yield api.hello.get()
+
+        assert response['data'] == 'hello'
+        assert stub.lookups == ['service.test']
+
+    def test_sync_api_does_not_support_resolver(self):
+        with pytest.raises(ValueError):
+            API('http://service.test', async=False,
+                resolver=CachingResolver(resolver=StubResolver()))
@@ -112,3 +112,11 @@ def test_prepare_request():
     assert isinstance(req, HTTPRequest)
     assert req.auth_username == 'user'
     assert req.auth_password == 'password'
+
+
+def test_resource_template():
+    world = Resource('world', fetch)
+    london = world.countries['uk'].cities['london']
+    assert london.template == 'world/countries/{id}/cities/{id}'
+    london.get()
+    assert fetch.call_args[-1]['chub_resource_template'] == london.template
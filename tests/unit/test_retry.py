@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import socket
+from email.utils import formatdate
+
+import pytest
+from mock import Mock, patch
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPRequest, HTTPResponse
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API
+from chub.retry import RetryPolicy, RetryBudget, parse_retry_after
+
+
+def http_error(code, headers=None):
+    request = HTTPRequest('http://example.com')
+    response = HTTPResponse(request, code, headers=headers or {})
+    return HTTPError(code, response=response)
+
+
+def future(result=None, error=None):
+    f = Future()
+    if error is not None:
+        f.set_exception(error)
+    else:
+        f.set_result(result)
+    return f
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after('120') == 120
+
+
+def test_parse_retry_after_date():
+    assert 0 <= parse_retry_after(formatdate(usegmt=True)) <= 1
+
+
+@pytest.mark.parametrize('value', [None, '', 'soon'])
+def test_parse_retry_after_invalid(value):
+    assert parse_retry_after(value) is None
+
+
+def test_budget():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_budget_does_not_exceed_reserve():
+    budget = RetryBudget(ratio=1, reserve=2)
+    for _ in range(10):
+        budget.deposit()
+    assert budget.balance == 2
+
+
+@pytest.mark.parametrize('method,error,expected', [
+    ('GET', http_error(503), True),
+    ('GET', http_error(599), True),
+    ('GET', socket.error(), True),
+    ('GET', http_error(404), False),
+    ('GET', ValueError(), False),
+    ('DELETE', http_error(502), True),
+    ('POST', http_error(503), False),
+    ('PATCH', socket.error(), False),
+])
+def test_retryable(method, error, expected):
+    assert RetryPolicy().retryable(method, error) == expected
+
+
+def test_delay_full_jitter():
+    policy = RetryPolicy(backoff=1, max_backoff=5)
+    with patch('chub.retry.random.uniform') as uniform:
+        uniform.side_effect = lambda low, high: high
+        assert policy.delay(1) == 1
+        assert policy.delay(3) == 4
+        assert policy.delay(10) == 5
+
+
+def test_delay_retry_after():
+    policy = RetryPolicy(backoff=0.1)
+    assert policy.delay(1, http_error(503, {'Retry-After': '3'})) == 3
+
+
+def test_next_delay_retry_after_too_long():
+    policy = RetryPolicy(max_retry_after=10)
+    error = http_error(429, {'Retry-After': '11'})
+    assert policy.next_delay('GET', 1, error) is None
+    assert policy.give_ups == 1
+
+
+def test_next_delay_max_attempts():
+    policy = RetryPolicy(max_attempts=2)
+    assert policy.next_delay('GET', 1, http_error(503)) is not None
+    assert policy.next_delay('GET', 2, http_error(503)) is None
+    assert policy.retries == 1
+    assert policy.give_ups == 1
+
+
+def test_next_delay_budget_exhausted():
+    policy = RetryPolicy(budget=RetryBudget(reserve=1))
+    assert policy.next_delay('GET', 1, http_error(503)) is not None
+    assert policy.next_delay('GET', 1, http_error(503)) is None
+    assert policy.give_ups == 1
+
+
+def test_not_retryable_is_not_a_give_up():
+    policy = RetryPolicy()
+    assert policy.next_delay('POST', 1, http_error(503)) is None
+    assert policy.give_ups == 0
+
+
+@patch('chub.retry.time.sleep')
+def test_sync_call(sleep):
+    request = HTTPRequest('http://example.com', 'GET')
+    fetch = Mock(side_effect=[http_error(503), socket.error(), 'response'])
+    policy = RetryPolicy()
+
+    assert policy.sync_call(fetch, request) == 'response'
+    assert fetch.call_count == 3
+    assert sleep.call_count == 2
+    assert policy.stats() == {'attempts': 3, 'retries': 2, 'give_ups': 0,
+                              'budget': 8}
+
+
+@patch('chub.retry.time.sleep')
+def test_sync_call_gives_up(sleep):
+    request = HTTPRequest('http://example.com', 'GET')
+    fetch = Mock(side_effect=http_error(503))
+    policy = RetryPolicy(max_attempts=2)
+
+    with pytest.raises(HTTPError):
+        policy.sync_call(fetch, request)
+    assert fetch.call_count == 2
+    assert policy.give_ups == 1
+
+
+@patch('chub.retry.time.sleep')
+def test_sync_call_non_idempotent(sleep):
+    request = HTTPRequest('http://example.com', 'POST', body='')
+    fetch = Mock(side_effect=http_error(503))
+
+    with pytest.raises(HTTPError):
+        RetryPolicy().sync_call(fetch, request)
+    assert fetch.call_count == 1
+    assert not sleep.called
+
+
+def test_api_retry_policy():
+    policy = RetryPolicy()
+    api = API('http://example.com', retry_policy=policy)
+    assert api.fetch.keywords['chub_retry_policy'] is policy
+
+
+class TestAsyncRetry(AsyncTestCase):
+    @gen_test
+    def test_async_call(self):
+        request = HTTPRequest('http://example.com', 'GET')
+        fetch = Mock(side_effect=[future(error=http_error(502)),
+                                  future('response')])
+        policy = RetryPolicy(backoff=0.001)
+
+        response = yield policy.async_call(fetch, request)
+
+        assert response == 'response'
+        assert fetch.call_count == 2
+        assert policy.retries == 1
+
+    @gen_test
+    def test_async_call_gives_up(self):
+        request = HTTPRequest('http://example.com', 'GET')
+        fetch = Mock(side_effect=lambda request: future(
+            error=http_error(503)))
+        policy = RetryPolicy(max_attempts=3, backoff=0.001)
+
+        with pytest.raises(HTTPError):
+            yield policy.async_call(fetch, request)
+        assert fetch.call_count == 3
+        assert policy.give_ups == 1
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import pytest
+
+from chub.stats import percentile, RollingWindow, RollingWindows
+
+
+@pytest.mark.parametrize('values,pct,expected', [
+    ([], 50, None),
+    ([1], 99, 1),
+    (range(1, 101), 50, 50),
+    (range(1, 101), 95, 95),
+    (range(100, 0, -1), 99, 99),
+    (range(1, 101), 100, 100),
+    (range(1, 101), 0, 1),
+])
+def test_percentile(values, pct, expected):
+    assert percentile(values, pct) == expected
+
+
+def test_rolling_window():
+    window = RollingWindow(size=3)
+    for value in [10, 1, 2, 3]:
+        window.add(value)
+    assert len(window) == 3
+    assert window.percentile(100) == 3
+
+
+def test_rolling_windows():
+    windows = RollingWindows(size=3)
+    assert 'foo' not in windows
+    windows['foo'].add(1)
+    assert 'foo' in windows
+    assert windows['foo'].percentile(50) == 1
+    assert list(windows.keys()) == ['foo']
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import pytest
+from tornado import gen
+from tornado.httpclient import HTTPError
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from chub import API, AdaptiveTimeout, Deadline, LoopbackTransport
+
+
+class TestAdaptiveTimeout(AsyncTestCase):
+    def setUp(self):
+        super(TestAdaptiveTimeout, self).setUp()
+        self.requests = []
+        self.transport = LoopbackTransport()
+        self.transport.route('GET', '/v1/offers/([^/]+)', self.offer)
+        self.policy = AdaptiveTimeout(multiple=3, floor=0.5, ceiling=10,
+                                      min_samples=5)
+        self.api = API('http://example.com', transport=self.transport,
+                       adaptive_timeout=self.policy)
+
+    def offer(self, request, offer_id):
+        self.requests.append(request)
+        return {'status': 200, 'data': {'id': offer_id}}
+
+    def fill(self, key, latency, count=5):
+        for _ in range(count):
+            self.policy.latencies[key].add(latency)
+
+    def test_no_timeout_without_enough_samples(self):
+        self.fill('GET offers/{id}', 1, count=4)
+
+        assert self.policy.timeout('GET offers/{id}') is None
+        assert self.policy.timeout('GET assets') is None
+
+    def test_timeout_is_multiple_of_percentile(self):
+        self.fill('GET offers/{id}', 1)
+
+        assert self.policy.timeout('GET offers/{id}') == 3
+
+    def test_floor_and_ceiling(self):
+        self.fill('GET offers/{id}', 0.01)
+        self.fill('POST bulk', 20)
+
+        assert self.policy.timeout('GET offers/{id}') == 0.5
+        assert self.policy.timeout('POST bulk') == 10
+
+    @gen_test
+    def test_sets_request_timeout_per_template(self):
+        self.fill('GET offers/{id}', 1)
+
+        yield self.api.offers['1'].get()
+        yield self.api.offers['2'].get()
+
+        assert [r.request_timeout for r in self.requests] == [3, 3]
+        assert self.policy.stats()['GET offers/{id}']['samples'] == 7
+
+    @gen_test
+    def test_keeps_explicit_timeout(self):
+        self.fill('GET offers/{id}', 1)
+        resource = self.api.offers['1']
+        resource.prepare_request(request_timeout=20)
+
+        yield resource.get()
+
+        assert self.requests[0].request_timeout == 20
+
+    @gen_test
+    def test_deadline_is_shorter(self):
+        self.fill('GET offers/{id}', 1)
+
+        yield Deadline(1).run(self.api.offers['1'].get)
+
+        assert self.requests[0].request_timeout <= 1
+
+    def test_sync(self):
+        api = API('http://example.com', async=False,
+                  transport=self.transport, adaptive_timeout=self.policy)
+        self.fill('GET offers/{id}', 1)
+
+        api.offers['1'].get()
+
+        assert self.requests[0].request_timeout == 3
+
+    def test_stats(self):
+        self.fill('GET offers/{id}', 0.1)
+
+        assert self.policy.stats() == {
+            'GET offers/{id}': {'samples': 5, 'p99_ms': 100.0,
+                                'timeout': 0.5, 'timeouts': 0}}
+
+
+class Slow(RequestHandler):
+    @gen.coroutine
+    def get(self):
+        yield gen.sleep(0.2)
+        self.write({'status': 200})
+
+
+class TestAdaptiveTimeoutTimeouts(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r'/v1/slow', Slow)])
+
+    @gen_test
+    def test_timeout_is_recorded(self):
+        policy = AdaptiveTimeout(multiple=1, floor=0.05, min_samples=5)
+        for _ in range(5):
+            policy.latencies['GET slow'].add(0.01)
+        api = API(self.get_url('/'), adaptive_timeout=policy)
+
+        with pytest.raises(HTTPError) as exc:
+            yield api.slow.get()
+
+        assert exc.value.code == 599
+        stats = policy.stats()['GET slow']
+        assert stats['timeouts'] == 1
+        assert stats['samples'] == 6
+        assert stats['p99_ms'] == 50.0
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+from StringIO import StringIO
+
+import pytest
+from mock import Mock
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPResponse
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API
+from chub.handlers import sync_fetch, async_fetch
+from chub.retry import RetryPolicy
+from chub.tracing import (Tracer, SpanContext, Exporter, InMemoryExporter,
+                          current_span, TRACEPARENT)
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+SPAN_ID = '00f067aa0ba902b7'
+
+
+def respond(request):
+    return HTTPResponse(request, 200,
+                        headers={'Content-Type': 'application/json'},
+                        buffer=StringIO('{"id": "1"}'))
+
+
+@pytest.mark.parametrize('header,expected', [
+    ('00-{}-{}-01'.format(TRACE_ID, SPAN_ID), (TRACE_ID, SPAN_ID, True)),
+    ('00-{}-{}-00'.format(TRACE_ID, SPAN_ID), (TRACE_ID, SPAN_ID, False)),
+    (' 00-{}-{}-01 '.format(TRACE_ID.upper(), SPAN_ID),
+     (TRACE_ID, SPAN_ID, True)),
+])
+def test_from_traceparent(header, expected):
+    context = SpanContext.from_traceparent(header)
+    assert (context.trace_id, context.span_id, context.sampled) == expected
+    assert SpanContext.from_traceparent(context.traceparent()).trace_id == \
+        TRACE_ID
+
+
+@pytest.mark.parametrize('header', [None, '', 'garbage',
+                                    '01-{}-{}-01'.format(TRACE_ID, SPAN_ID)])
+def test_from_traceparent_invalid(header):
+    assert SpanContext.from_traceparent(header) is None
+
+
+def test_start_root_span():
+    tracer = Tracer(sample_rate=1)
+    span = tracer.start_span('root')
+    assert len(span.context.trace_id) == 32
+    assert len(span.context.span_id) == 16
+    assert span.context.sampled
+    assert span.parent_id is None
+
+
+def test_start_child_span():
+    tracer = Tracer()
+    parent = SpanContext(TRACE_ID, SPAN_ID, False)
+    span = tracer.start_span('child', parent)
+    assert span.context.trace_id == TRACE_ID
+    assert span.context.span_id != SPAN_ID
+    assert span.parent_id == SPAN_ID
+    assert not span.context.sampled
+
+
+def test_unsampled_spans_are_not_exported():
+    exporter = InMemoryExporter()
+    tracer = Tracer(exporter, sample_rate=0)
+    span = tracer.start_span('root')
+    span.set_attribute('foo', 'bar')
+    span.finish()
+    assert span.attributes == {}
+    assert exporter.spans == []
+
+
+def test_exporter_drops_spans():
+    tracer = Tracer()
+    assert type(tracer.exporter) is Exporter
+    with tracer.span('root') as span:
+        assert current_span() is span
+    assert span.end_time is not None
+
+
+def test_sync_span_context_manager():
+    tracer = Tracer(InMemoryExporter())
+    with tracer.span('outer') as outer:
+        assert current_span() is outer
+        with tracer.span('inner') as inner:
+            assert inner.parent_id == outer.context.span_id
+        assert current_span() is outer
+    assert current_span() is None
+    assert tracer.exporter.spans == [inner, outer]
+
+
+def test_sync_span_context_manager_error():
+    tracer = Tracer(InMemoryExporter())
+    with pytest.raises(ValueError):
+        with tracer.span('outer'):
+            raise ValueError()
+    assert isinstance(tracer.exporter.spans[0].error, ValueError)
+    assert current_span() is None
+
+
+def test_sync_fetch_creates_span():
+    tracer = Tracer(InMemoryExporter())
+    httpclient = Mock()
+    requests = []
+
+    def fetch(request):
+        requests.append(request)
+        if len(requests) == 1:
+            raise HTTPError(503)
+        return respond(request)
+    httpclient.fetch.side_effect = fetch
+
+    with tracer.span('handler') as parent:
+        sync_fetch('http://example.com/v1/offers/1', 'GET',
+                   httpclient=httpclient, chub_tracer=tracer,
+                   chub_retry_policy=RetryPolicy(backoff=0),
+                   chub_resource_template='offers/{id}')
+
+    span = tracer.exporter.spans[0]
+    assert span.parent_id == parent.context.span_id
+    assert requests[0].headers[TRACEPARENT] == span.context.traceparent()
+    assert span.attributes == {
+        'http.method': 'GET',
+        'http.url': 'http://example.com/v1/offers/1',
+        'chub.resource': 'offers/{id}',
+        'http.status_code': 200,
+        'chub.retries': 1,
+        'http.request_content_length': 0,
+        'http.response_content_length': len('{"id": "1"}')}
+    assert span.duration >= 0
+
+
+def test_sync_fetch_error_finishes_span():
+    tracer = Tracer(InMemoryExporter())
+    httpclient = Mock()
+    httpclient.fetch.side_effect = HTTPError(404)
+
+    with pytest.raises(HTTPError):
+        sync_fetch('http://example.com/v1/offers/1', 'GET',
+                   httpclient=httpclient, chub_tracer=tracer)
+
+    span = tracer.exporter.spans[0]
+    assert span.attributes['http.status_code'] == 404
+    assert isinstance(span.error, HTTPError)
+
+
+def test_api_tracer():
+    tracer = Tracer(InMemoryExporter())
+    api = API('http://example.com', tracer=tracer)
+    assert api.fetch.keywords['chub_tracer'] is tracer
+
+
+class TestAsyncTracing(AsyncTestCase):
+    @gen_test
+    def test_context_propagates_across_coroutines(self):
+        tracer = Tracer(InMemoryExporter())
+        httpclient = Mock()
+
+        def fetch(request):
+            future = Future()
+            self.io_loop.add_callback(future.set_result, respond(request))
+            return future
+        httpclient.fetch.side_effect = fetch
+
+        @gen.coroutine
+        def handler():
+            yield gen.moment
+            yield async_fetch('http://example.com/v1/offers/1', 'GET',
+                              httpclient=httpclient, chub_tracer=tracer)
+            yield gen.sleep(0.001)
+            yield async_fetch('http://example.com/v1/offers/2', 'GET',
+                              httpclient=httpclient, chub_tracer=tracer)
+            raise gen.Return('done')
+
+        parent = SpanContext(TRACE_ID, SPAN_ID, True)
+        result = yield tracer.run('handler', handler, parent=parent)
+
+        assert result == 'done'
+        assert current_span() is None
+        first, second, root = tracer.exporter.spans
+        assert root.name == 'handler'
+        assert root.parent_id == SPAN_ID
+        assert first.parent_id == root.context.span_id
+        assert second.parent_id == root.context.span_id
+        assert first.context.trace_id == TRACE_ID
+
+    @gen_test
+    def test_run_error(self):
+        tracer = Tracer(InMemoryExporter())
+
+        @gen.coroutine
+        def handler():
+            yield gen.moment
+            raise ValueError()
+
+        with pytest.raises(ValueError):
+            yield tracer.run('handler', handler)
+        assert isinstance(tracer.exporter.spans[0].error, ValueError)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import json
+
+import pytest
+from tornado import gen
+from tornado.httpclient import HTTPError
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from chub import API
+from chub.retry import RetryPolicy, RetryBudget
+from chub.transport import LoopbackTransport, Transport
+
+
+class OfferHandler(RequestHandler):
+    def get(self, offer_id):
+        self.write({'status': 200,
+                    'data': {'id': offer_id,
+                             'page': self.get_argument('page', None)}})
+
+    def post(self, offer_id):
+        self.set_status(201)
+        self.write({'status': 201, 'data': json.loads(self.request.body)})
+
+
+class SlowHandler(RequestHandler):
+    @gen.coroutine
+    def get(self):
+        yield gen.moment
+        raise gen.Return(self.write({'status': 200, 'data': 'slow'}))
+
+
+def make_app():
+    return Application([(r'/v1/offers/([^/]+)', OfferHandler),
+                        (r'/v1/slow', SlowHandler)])
+
+
+def test_sync_route():
+    transport = LoopbackTransport()
+    transport.route('GET', '/v1/offers/([^/]+)',
+                    lambda request, offer_id: {'id': offer_id})
+    api = API('http://example.com', async=False, transport=transport)
+
+    assert api.offers['1'].get() == {'id': '1'}
+    assert transport.stats() == {'requests': 1, 'injected_errors': 0}
+
+
+def test_sync_route_not_found():
+    api = API('http://example.com', async=False,
+              transport=LoopbackTransport())
+
+    with pytest.raises(HTTPError) as exc:
+        api.offers['1'].get()
+    assert exc.value.code == 404
+
+
+def test_sync_route_status_and_body():
+    transport = LoopbackTransport()
+    transport.route(None, '/v1/offers', lambda request: (
+        202, 'accepted', {'Content-Type': 'text/plain'}))
+    api = API('http://example.com', async=False, transport=transport)
+
+    assert api.offers.post(body='x', headers={'Content-Type': 'text/plain'}) \
+        == 'accepted'
+
+
+def test_sync_app():
+    api = API('http://example.com', async=False,
+              transport=LoopbackTransport(app=make_app()))
+
+    assert api.offers['1'].get(page=2)['data'] == {'id': '1', 'page': '2'}
+    assert api.offers['1'].post(foo='bar')['data'] == {'foo': 'bar'}
+
+
+def test_injected_errors_are_deterministic():
+    def run():
+        transport = LoopbackTransport(errors={503: 0.3, IOError: 0.1},
+                                      seed=42)
+        transport.route('GET', '/v1/offers', lambda request: {})
+        api = API('http://example.com', async=False, transport=transport)
+        outcomes = []
+        for _ in range(50):
+            try:
+                api.offers.get()
+                outcomes.append(200)
+            except HTTPError as exc:
+                outcomes.append(exc.code)
+            except IOError:
+                outcomes.append('IOError')
+        return outcomes, transport.stats()
+
+    outcomes, stats = run()
+    assert run() == (outcomes, stats)
+    assert stats['injected_errors'] == outcomes.count(503) + \
+        outcomes.count('IOError')
+    assert 0 < outcomes.count(503) < 50
+    assert 0 < outcomes.count('IOError') < 50
+
+
+def test_transport_error_is_a_connection_error():
+    class Broken(Transport):
+        def fetch(self, request):
+            raise IOError('broken')
+
+    api = API('http://example.com', async=False, transport=Broken())
+    with pytest.raises(IOError):
+        api.offers.get()
+
+
+def test_transport_not_implemented():
+    api = API('http://example.com', async=False, transport=Transport())
+    with pytest.raises(HTTPError) as exc:
+        api.offers.get()
+    assert exc.value.code == 501
+
+
+class TestAsyncLoopback(AsyncTestCase):
+    @gen_test
+    def test_app(self):
+        api = API('http://example.com',
+                  transport=LoopbackTransport(app=make_app()))
+
+        result = yield api.offers['1'].get()
+        slow = yield api.slow.get()
+
+        assert result['data']['id'] == '1'
+        assert slow['data'] == 'slow'
+
+    @gen_test
+    def test_latency(self):
+        transport = LoopbackTransport(latency=lambda rng: 0.01, seed=1)
+        transport.route('GET', '/v1/offers', lambda request: {})
+        api = API('http://example.com', transport=transport)
+
+        start = self.io_loop.time()
+        yield [api.offers.get() for _ in range(100)]
+
+        assert 0.01 <= self.io_loop.time() - start < 0.5
+        assert transport.requests == 100
+
+    @gen_test
+    def test_async_handler(self):
+        @gen.coroutine
+        def handler(request):
+            yield gen.moment
+            raise gen.Return((200, {'ok': True}))
+
+        transport = LoopbackTransport()
+        transport.route('GET', '/v1/offers', handler)
+        api = API('http://example.com', transport=transport)
+
+        result = yield api.offers.get()
+        assert result == {'ok': True}
+
+    @gen_test
+    def test_retries_injected_errors(self):
+        transport = LoopbackTransport(errors={503: 0.5}, seed=3)
+        transport.route('GET', '/v1/offers', lambda request: {})
+        api = API('http://example.com', transport=transport,
+                  retry_policy=RetryPolicy(max_attempts=20, backoff=0,
+                                           budget=RetryBudget(reserve=100)))
+
+        results = yield [api.offers.get() for _ in range(20)]
+
+        assert results == [{}] * 20
+        assert transport.stats()['requests'] == \
+            20 + transport.stats()['injected_errors']
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import json
+
+import pytest
+from tornado import gen
+from tornado.httpclient import HTTPError
+from tornado.queues import QueueFull
+from tornado.testing import AsyncTestCase, gen_test
+
+from chub import API, LoopbackTransport
+from chub.retry import RetryPolicy
+
+
+class TestWriter(AsyncTestCase):
+    def setUp(self):
+        super(TestWriter, self).setUp()
+        self.batches = []
+        self.failures = 0
+        self.transport = LoopbackTransport()
+        self.transport.route('POST', '/v1/assets', self.post_assets)
+        self.api = API('http://example.com', transport=self.transport)
+
+    def post_assets(self, request):
+        if self.failures:
+            self.failures -= 1
+            return 503, {'status': 503}
+        records = json.loads(request.body)['data']
+        self.batches.append(records)
+        return {'status': 200,
+                'data': [{'id': str(record['n'])} for record in records]}
+
+    @gen_test
+    def test_sends_full_batches(self):
+        writer = self.api.assets.writer(batch_size=3, flush_interval=10)
+
+        futures = [writer.write({'n': n}) for n in range(6)]
+        results = yield futures
+
+        assert self.batches == [[{'n': 0}, {'n': 1}, {'n': 2}],
+                                [{'n': 3}, {'n': 4}, {'n': 5}]]
+        assert results == [{'id': str(n)} for n in range(6)]
+        assert writer.stats() == {'queued': 0, 'in_flight': 0,
+                                  'sent_batches': 2, 'sent_records': 6,
+                                  'failed_batches': 0, 'failed_records': 0,
+                                  'retries': 0}
+
+    @gen_test
+    def test_flush_interval(self):
+        writer = self.api.assets.writer(batch_size=100, flush_interval=0.01)
+
+        future = writer.write({'n': 1})
+        yield gen.sleep(0.005)
+        assert self.batches == []
+
+        result = yield future
+        assert result == {'id': '1'}
+        assert self.batches == [[{'n': 1}]]
+
+    @gen_test
+    def test_flush(self):
+        writer = self.api.assets.writer(batch_size=2, flush_interval=10)
+        for n in range(5):
+            writer.write({'n': n})
+
+        yield writer.flush()
+
+        assert [len(batch) for batch in self.batches] == [2, 2, 1]
+        assert writer.queued == 0
+
+    @gen_test
+    def test_max_in_flight(self):
+        in_flight = []
+        done = []
+
+        @gen.coroutine
+        def send(records):
+            in_flight.append(len(done))
+            yield gen.sleep(0.01)
+            done.append(records)
+            raise gen.Return({})
+
+        writer = self.api.assets.writer(batch_size=1, max_in_flight=2,
+                                        send=send)
+        for n in range(4):
+            writer.write(n)
+        assert writer.in_flight == 2
+        assert writer.queued == 2
+
+        yield writer.flush()
+        assert len(done) == 4
+
+    @gen_test
+    def test_batches_fill_up_after_flush_interval(self):
+        sent = []
+        release = []
+
+        def send(records):
+            sent.append(len(records))
+            future = gen.Future()
+            release.append(future)
+            return future
+
+        writer = self.api.assets.writer(batch_size=3, max_in_flight=1,
+                                        flush_interval=0.01, send=send)
+        writer.write(0)
+        yield gen.sleep(0.02)
+        writer.write(1)
+        yield gen.sleep(0.02)
+        for n in range(2, 5):
+            writer.write(n)
+        assert sent == [1]
+
+        # the record that was due goes in the next batch, but the record
+        # left over waits for a full batch or its own flush interval
+        release.pop(0).set_result({})
+        yield gen.moment
+        assert sent == [1, 3]
+        release.pop(0).set_result({})
+        yield gen.moment
+        assert sent == [1, 3]
+        writer.write(5)
+        writer.write(6)
+        assert sent == [1, 3, 3]
+
+    @gen_test
+    def test_backpressure(self):
+        writer = self.api.assets.writer(batch_size=2, max_queue=2,
+                                        max_in_flight=1, flush_interval=10)
+        writer.write({'n': 0})
+        writer.write({'n': 1})
+        writer.write({'n': 2})
+        writer.write({'n': 3})
+        with pytest.raises(QueueFull):
+            writer.write({'n': 4})
+
+        delivery = yield writer.put({'n': 4})
+        assert writer.queued <= 2
+
+        yield writer.flush()
+        result = yield delivery
+        assert result == {'id': '4'}
+        assert sum(len(batch) for batch in self.batches) == 5
+
+    @gen_test
+    def test_retries_failed_batches(self):
+        self.failures = 2
+        writer = self.api.assets.writer(
+            batch_size=1,
+            retry_policy=RetryPolicy(methods=['POST'], max_attempts=3,
+                                     backoff=0))
+
+        result = yield writer.write({'n': 1})
+
+        assert result == {'id': '1'}
+        assert writer.stats()['retries'] == 2
+
+    @gen_test
+    def test_failed_batch(self):
+        self.failures = 10
+        calls = []
+        writer = self.api.assets.writer(
+            batch_size=2, callback=lambda *args: calls.append(args),
+            retry_policy=RetryPolicy(methods=['POST'], max_attempts=2,
+                                     backoff=0))
+
+        futures = [writer.write({'n': 1}), writer.write({'n': 2})]
+        for future in futures:
+            with pytest.raises(HTTPError):
+                yield future
+
+        records, response, error = calls[0]
+        assert records == [{'n': 1}, {'n': 2}]
+        assert response is None
+        assert error.code == 503
+        assert writer.stats()['failed_records'] == 2
+
+    @gen_test
+    def test_close(self):
+        writer = self.api.assets.writer(flush_interval=10)
+        writer.write({'n': 1})
+
+        yield writer.close()
+
+        assert self.batches == [[{'n': 1}]]
+        with pytest.raises(ValueError):
+            writer.write({'n': 2})